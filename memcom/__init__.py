@@ -1,14 +1,25 @@
 
 import os
 from . mc_message import *
+from . mc_readers import *
+from . mc_frameinfo import *
 from . mc_video import *
 from . mc_audio import *
+from . mc_resample import *
 from . mc_filter import *
 from . mc_clock import *
 from . mc_shapes import *
 from . mc_blank import *
+from . mc_rawfile import *
+from . mc_yuv import *
 from . mc_record import *
 from . mc_testvid import *
+from . mc_sync import *
+from . mc_levels import *
+from . mc_group import *
+from . mc_pipeline import *
+from . mc_stats import *
+from . mc_async import *
 
 def loadConfig(fname):
     globals()["__info__"] = {}
@@ -34,13 +45,13 @@ def remove_shm_from_resource_tracker():
     def fix_register(name, rtype):
         if rtype == "shared_memory":
             return
-        return resource_tracker._resource_tracker.register(self, name, rtype)
+        return resource_tracker._resource_tracker.register(name, rtype)
     resource_tracker.register = fix_register
 
     def fix_unregister(name, rtype):
         if rtype == "shared_memory":
             return
-        return resource_tracker._resource_tracker.unregister(self, name, rtype)
+        return resource_tracker._resource_tracker.unregister(name, rtype)
     resource_tracker.unregister = fix_unregister
 
     if "shared_memory" in resource_tracker._CLEANUP_FUNCS:
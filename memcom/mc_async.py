@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import time
+import asyncio
+import inspect
+import collections
+import propertybag as pb
+
+from . mc_filter import *
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Filter that runs on the caller's asyncio event loop
+
+    Same callbacks and options as mcFilter, but no thread is created.
+    The filter runs as a task on the loop that calls create(), and any
+    callback may be a coroutine function.  Coroutines are awaited in
+    frame order before the next pass, and frames are only handed on to
+    later pipeline stages once their coroutine has finished.
+
+    Frames are polled on a timer, the event wait option is ignored
+    since blocking on the index would stall the loop.
+
+    @begincode
+
+        async def on_video(ctx, vfi, vfr):
+            await ws.send(vfr.tobytes())
+
+        flt = mcAsync(on_video=on_video, opts={'video': vsname})
+        flt.create()
+        ...
+        await flt.aclose()
+
+    @endcode
+'''
+class mcAsync(mcFilter):
+
+    ''' Initialize object
+        @param [in] on_init     - Called when the filter starts running
+        @param [in] on_idle     - Called every loop
+        @param [in] on_end      - Called when the filter stops
+        @param [in] on_error    - Called when the errors are detected
+        @param [in] on_video    - Called when a new video frame is available
+        @param [in] on_audio    - Called when a new audio frame is available
+        @param [in] opts        - Options, see mcFilter
+        @param [in] on_video_batch  - Called with all pending video frames
+        @param [in] on_audio_batch  - Called with all pending audio frames
+    '''
+    def __init__(self, on_init=None, on_idle=None, on_end=None, on_error=None,
+                       on_video=None, on_audio=None, opts={}, on_video_batch=None, on_audio_batch=None):
+
+        self.task = None
+        self.bRun = False
+        self.bQueued = False
+        self.pending = collections.deque()
+
+        super().__init__(on_error=on_error, opts=opts, thread=False)
+
+        self.setCallbacks(on_init, on_idle, on_end, on_video, on_audio, on_video_batch, on_audio_batch)
+
+
+    ### Delete
+    def __del__(self):
+        super().__del__()
+        self.close()
+
+
+    ### Install the shims that queue coroutine callbacks
+    def setCallbacks(self, on_init, on_idle, on_end, on_video, on_audio, on_video_batch, on_audio_batch):
+
+        def wrap(cb):
+            if not callable(cb):
+                return None
+            def shim(*args):
+                return self.queueCall(cb(*args))
+            return shim
+
+        if callable(on_init):
+            self.on_init_callback = wrap(on_init)
+        if callable(on_end):
+            self.on_end_callback = wrap(on_end)
+        if callable(on_video):
+            self.on_video_callback = wrap(on_video)
+        if callable(on_audio):
+            self.on_audio_callback = wrap(on_audio)
+        if callable(on_video_batch):
+            self.on_video_batch_callback = wrap(on_video_batch)
+        if callable(on_audio_batch):
+            self.on_audio_batch_callback = wrap(on_audio_batch)
+
+        # Idle returns the delay, awaited by the task
+        if callable(on_idle):
+            self.on_idle_callback = on_idle
+
+
+    ''' Creates the filter and starts the task
+        @param [in] opts    - Options, see mcFilter
+
+        Must be called with an event loop running in this thread.
+    '''
+    def create(self, on_init=None, on_idle=None, on_end=None, on_error=None, on_video=None, on_audio=None, opts={},
+                     on_video_batch=None, on_audio_batch=None):
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError as e:
+            self.sErr = "No running event loop"
+            return False
+
+        self.setCallbacks(on_init, on_idle, on_end, on_video, on_audio, on_video_batch, on_audio_batch)
+
+        if not super().create(on_error=on_error, opts=dict(opts, thread=False, process=False)):
+            return False
+
+        self.bRun = True
+        self.task = loop.create_task(self.runTask())
+
+        return True
+
+
+    ### Stop the task without waiting, pending coroutines are discarded
+    def close(self):
+
+        self.bRun = False
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+        super().close()
+        self.dropPending()
+
+
+    ### Stop the task, waiting for pending coroutines and on_end
+    async def aclose(self):
+
+        self.bRun = False
+        if self.task:
+            try:
+                await self.task
+            except asyncio.CancelledError as e:
+                pass
+            self.task = None
+
+        self.close()
+
+
+    ''' Queue the result of a callback if it is a coroutine
+        @param [in] r   - Callback result
+    '''
+    def queueCall(self, r):
+        if inspect.isawaitable(r):
+            self.pending.append(('call', r, None))
+            self.bQueued = True
+        return None
+
+
+    ### Defer the stage bits until the coroutine for the frame is done
+    def markDone(self, share, n):
+        if None != self.nStage:
+            self.pending.append(('stage', share, n))
+
+
+    ### Time the coroutine when it is awaited rather than when it was created
+    def addCallTime(self, base, t, n=1):
+        if self.bQueued:
+            self.bQueued = False
+            _, r, _ = self.pending[-1]
+            self.pending[-1] = ('call', r, (base, n))
+            return
+        super().addCallTime(base, t, n)
+
+
+    ### Await the queued coroutines in order
+    async def flush(self):
+
+        while self.pending:
+            kind, a, b = self.pending.popleft()
+
+            if 'stage' == kind:
+                a.setStage(b, self.nStage)
+                continue
+
+            t = time.perf_counter()
+            try:
+                await a
+            except Exception as e:
+                if self.on_error_callback:
+                    self.on_error_callback(self, e)
+
+            if None != b:
+                mcFilter.addCallTime(self, b[0], t, b[1])
+
+
+    ### Close coroutines that will never be awaited
+    def dropPending(self):
+        while self.pending:
+            kind, a, b = self.pending.popleft()
+            if 'call' == kind:
+                a.close()
+
+
+    ### Filter task
+    async def runTask(self):
+
+        try:
+            while self.bRun:
+
+                delay = self.runStep()
+                await self.flush()
+
+                if inspect.isawaitable(delay):
+                    try:
+                        delay = await delay
+                    except Exception as e:
+                        if self.on_error_callback:
+                            self.on_error_callback(self, e)
+                        delay = self.delay
+
+                await asyncio.sleep(self.delay if None == delay else delay)
+
+            self.runEnd()
+            await self.flush()
+
+        finally:
+            self.dropPending()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
+import sys
 import time
+import mmap
 import string
 import random
 import json
@@ -8,6 +10,12 @@ import numpy as np
 
 from multiprocessing import shared_memory
 
+from . mc_event import *
+from . mc_readers import *
+from . mc_frameinfo import *
+
+from . mc_mirror import *
+
 try:
     import sparen
     Log = sparen.log
@@ -16,7 +24,7 @@ except Exception as e:
 
 
 ### Share audio buffers between processes
-class mcAudio:
+class mcAudio(mcReaders):
 
     ### Initialize object
     def __init__(self):
@@ -29,7 +37,10 @@ class mcAudio:
         # [4] = Bps
         # [5] = Bitrate
         # [6] = FPS
-        self.nOvInts = 8 # Use an even number for byte alignment
+        # [7] = Flags
+        # [8] = Reader table slots, see mcReaders
+        # [9] = Reserved
+        self.nOvInts = 10 # Use an even number for byte alignment
         self.nOvBytes = self.nOvInts * 8
 
         # Packet overhead
@@ -37,16 +48,28 @@ class mcAudio:
         # [1] = PTS
         # [2] = IDX
         # [3] = CLK
-        # [4] = WTS
-        # [5] = RDS
-        self.nPktOvInts = 6 # Use an even number
+        # [4] = RDS
+        # [5] = WTS
+        # [6] = Pipeline stage completion bits, see setStage()
+        # [7] = Reserved
+        # [8..] = Peak / RMS per channel as float64, only if levels are enabled
+        self.nPktOvBase = 8
+        self.nPktOvInts = self.nPktOvBase # Use an even number
         self.nPktOvBytes = self.nPktOvInts * 8
 
-        # ID
-        self.nBufferId = 0x1D13E088FF530CBB
+        # ID, changed whenever the layout changes so older builds reject the share
+        self.nBufferId = 0x150D887FA1ABA67E
         self.nPacketId = 0x16881400350AF97E
 
+        # Flags
+        #   Packed - Packet headers are stored in a table ahead of one
+        #            contiguous sample ring
+        #   Levels - Packet headers carry the peak and RMS level of each channel
+        self.nFlagPacked = 0x1
+        self.nFlagLevels = 0x2
+
         self.cShm = None
+        self.cMirror = None
         self.sErr = ""
         self.close()
 
@@ -116,9 +139,37 @@ class mcAudio:
         return n
         # return int(self.nBitrate / self.nFps)
 
+    ### Returns the number of samples per channel in each buffer
+    def getSamples(self):
+        return self.nSamples
+
+
+    ### Returns True if the share uses the packed layout
+    def isPacked(self):
+        return True if self.nFlags & self.nFlagPacked else False
+
+
+    ### Returns True if the sample ring of a packed share is mirrored,
+    #   readSamples() only copies when a read wraps and this is False
+    def isMirrored(self):
+        return self.aMirror is not None
+
+
+    ### Returns True if packet headers carry audio levels
+    def hasLevels(self):
+        return True if self.nFlags & self.nFlagLevels else False
+
+
     ### Release shared memory and prepare object for reuse
     def close(self):
 
+        # Views into the mirror are invalid after this
+        self.aRing = None
+        self.aMirror = None
+        if self.cMirror:
+            self.cMirror.close()
+            self.cMirror = None
+
         if self.cShm:
             self.cShm.close()
             if self.bCleanup:
@@ -134,6 +185,8 @@ class mcAudio:
         self.bExisting = False
 
         self.nBufs = []
+        self.cHdr = None
+        self.aPktHdrs = []
         self.nBuffers = 0
         self.nCh = 0
         self.nBps = 0
@@ -142,11 +195,23 @@ class mcAudio:
         self.nPacketSize = 0
         self.nFrameSize = 0
         self.nChSize = 0
+        self.nSamples = 0
+        self.nFlags = 0
+        self.nReaders = 0
+        self.nRdrOff = self.nOvBytes
+        self.nHdrOff = 0
+        self.nHdrStride = 0
+        self.nBufOff = 0
+        self.nBufStride = 0
+        self.nPktOvInts = self.nPktOvBase
+        self.nPktOvBytes = self.nPktOvInts * 8
 
 
-    ### Return the main header
+    ### Return the main header, the view is created once per open
     def getHeader(self):
-        return np.ndarray(shape=(self.nOvInts,), dtype=np.int64, buffer=self.cShm.buf[0:self.nOvBytes])
+        if self.cHdr is None:
+            self.cHdr = np.ndarray(shape=(self.nOvInts,), dtype=np.int64, buffer=self.cShm.buf[0:self.nOvBytes])
+        return self.cHdr
 
 
     ### Get the current index
@@ -159,9 +224,39 @@ class mcAudio:
     def setIdx(self, idx):
         hdr = self.getHeader()
         hdr[2] = idx % self.nBuffers
+        mcEvent.wake(self.getIdxAddr(hdr))
         return hdr[2]
 
 
+    ### Returns the address of the 32 bit word holding the index
+    def getIdxAddr(self, hdr):
+        return hdr.ctypes.data + (2 * 8) + (4 if 'big' == sys.byteorder else 0)
+
+
+    ### Wake everything blocked in waitIdx()
+    def notifyIdx(self):
+        hdr = self.getHeader()
+        mcEvent.wake(self.getIdxAddr(hdr))
+
+
+    ''' Wait for the writer to change the index
+        @param [in] idx     - Index last seen
+        @param [in] timeout - Maximum time to wait in seconds, None for no limit
+
+        Returns when the index differs from idx, notifyIdx() is called
+        or the timeout expires.
+
+        @returns The current index
+    '''
+    def waitIdx(self, idx, timeout=None):
+        hdr = self.getHeader()
+        addr = self.getIdxAddr(hdr)
+        val = mcEvent.load(addr)
+        if val % self.nBuffers == idx:
+            mcEvent.wait(addr, val, timeout)
+        return hdr[2] % self.nBuffers
+
+
     ''' Calculates the index based on the specified offset
         @param [in] off - Offset from the index
     '''
@@ -195,12 +290,48 @@ class mcAudio:
     def addIdx(self, add):
         hdr = self.getHeader()
         hdr[2] = (hdr[2] + add) % self.nBuffers
+        mcEvent.wake(self.getIdxAddr(hdr))
         return hdr[2]
 
 
+    ''' Calculate buffer layout and return the total share size
+        @param [in] bufs    - Number of buffers
+        @param [in] ch      - Number of channels
+
+        Uses nFlags, nFrameSize and the header sizes
+    '''
+    def calcLayout(self, bufs, ch):
+
+        # Two float64 per channel for the levels
+        self.nPktOvInts = self.nPktOvBase
+        if self.nFlags & self.nFlagLevels:
+            self.nPktOvInts += 2 * ch
+        self.nPktOvBytes = self.nPktOvInts * 8
+
+        self.nPacketSize = self.nPktOvBytes + self.nFrameSize
+        self.nRdrOff = self.nOvBytes
+        self.nHdrOff = self.nRdrOff + (self.nReaders * mcReaders.RDR_INTS * 8)
+
+        # Header table followed by a page aligned sample ring
+        if self.nFlags & self.nFlagPacked:
+            pg = mmap.PAGESIZE
+            self.nHdrStride = self.nPktOvBytes
+            self.nBufOff = int((self.nHdrOff + (bufs * self.nPktOvBytes) + pg - 1) / pg) * pg
+            self.nBufStride = self.nFrameSize
+            return self.nBufOff + (bufs * self.nFrameSize)
+
+        # Each header is followed by its samples
+        self.nHdrStride = self.nPacketSize
+        self.nBufOff = self.nHdrOff + self.nPktOvBytes
+        self.nBufStride = self.nPacketSize
+        return self.nHdrOff + (bufs * self.nPacketSize)
+
+
     ### Get header for the specified frame
     def getFrameHeader(self, n):
-        off = self.nOvBytes + (n * self.nPacketSize)
+        if n < len(self.aPktHdrs):
+            return self.aPktHdrs[n]
+        off = self.nHdrOff + (n * self.nHdrStride)
         return np.ndarray(shape=(self.nPktOvInts,), dtype=np.int64, buffer=self.cShm.buf[off:off+self.nPktOvBytes])
 
 
@@ -211,6 +342,8 @@ class mcAudio:
         @param [in] clk - CLK - Clock value
         @param [in] rds - RDS - Number of reads
         @param [in] wts - WTS - Number of writes
+
+        Clears the stage bits, the frame starts through the pipeline again
     '''
     def setFrameInfo(self, n, pts, idx, clk, rds, wts):
         fh = self.getFrameHeader(n)
@@ -219,18 +352,48 @@ class mcAudio:
         fh[3] = clk
         fh[4] = rds
         fh[5] = wts
+        fh[6] = 0
         fh[0] = self.nPacketId
 
 
+    ''' Returns the stage completion bits of a frame
+        @param [in] n   - Frame index
+
+        Stored in the low word of the stage field, see mcPipeline
+    '''
+    def getStages(self, n):
+        fh = self.getFrameHeader(n)
+        return int(fh[6]) & 0xffffffff
+
+
+    ''' Mark a pipeline stage done for a frame
+        @param [in] n       - Frame index
+        @param [in] stage   - Stage number (0-31)
+
+        Wakes everything blocked in waitIdx() so later stages run immediately.
+    '''
+    def setStage(self, n, stage):
+        fh = self.getFrameHeader(n)
+        addr = fh.ctypes.data + (6 * 8) + (4 if 'big' == sys.byteorder else 0)
+        mcEvent.setBitWake(addr, stage, self.getIdxAddr(self.getHeader()))
+
+
     ''' Get frame info
+        @param [in] n   - Frame index
+        @param [in] fi  - Optional mcFrameInfo record to fill instead of
+                          creating a dict
+
         @returns Object containing the following
                     {
                         pts: Presentation Time Stamp
                         idx: Frame index
                     }
     '''
-    def getFrameInfo(self, n):
+    def getFrameInfo(self, n, fi=None):
         fh = self.getFrameHeader(n)
+        if None != fi:
+            v = fh.tolist()
+            return fi.set(n, v) if v[0] == self.nPacketId else fi.clear()
         if fh[0] != self.nPacketId:
             return {}
         return {'buf': n, 'pts': fh[1], 'idx': fh[2], 'clk': fh[3], 'rds': fh[4], 'wts': fh[5]}
@@ -244,10 +407,18 @@ class mcAudio:
         @param [in] name    - Name for memory buffer, if not provided a random name will be generated.
         @param [in] size    - Desired total size of the memory buffer
         @param [in] cleanup - Non-zero if the shared memory should be unlinked on close
+        @param [in] packed  - Store all samples in one contiguous ring so that
+                              readSamples() can return views spanning buffers.
+                              Needs 8, 16 or 32 bits per sample.  Reads that
+                              wrap are only views if bufs times the frame size
+                              is a multiple of mmap.PAGESIZE, see isMirrored().
+        @param [in] levels  - Reserve packet header space for the peak and RMS
+                              level of each channel, see setLevels()
+        @param [in] readers - Number of reader table slots, see mcReaders
 
         @returns True if success
     '''
-    def create(self, name = None, bufs = 0, ch = 0, bps = 0, bitrate = 0, fps = 0, mode = "always", cleanup = False):
+    def create(self, name = None, bufs = 0, ch = 0, bps = 0, bitrate = 0, fps = 0, mode = "always", cleanup = False, packed = False, levels = False, readers = 16):
 
         self.sErr = ""
         self.close()
@@ -288,8 +459,14 @@ class mcAudio:
                     self.sErr = f"Invalid audio parameters: channels: {ch}, bps: {bps}, bitrate: {bitrate}, fps: {fps}"
                     return False
 
-                self.nPacketSize = self.nPktOvBytes + self.nFrameSize
-                self.nSize = self.nOvBytes + (bufs * self.nPacketSize)
+                if packed and None == mcAudio.getSampleType(bps):
+                    self.sErr = f"Packed layout needs 8, 16 or 32 bits per sample: {bps}"
+                    return False
+
+                self.nFlags = (self.nFlagPacked if packed else 0) | (self.nFlagLevels if levels else 0)
+                self.nReaders = readers
+
+                self.nSize = self.calcLayout(bufs, ch)
                 if 0 >= self.nSize:
                     self.sErr = "Invalid buffer size: %s" % nSize
                     return False
@@ -312,6 +489,8 @@ class mcAudio:
             hdr[4] = bps
             hdr[5] = bitrate
             hdr[6] = fps
+            hdr[7] = self.nFlags
+            hdr[8] = self.nReaders
             hdr[0] = self.nBufferId
 
         # Validate header id
@@ -326,14 +505,37 @@ class mcAudio:
         self.nBps = hdr[4]
         self.nBitrate = hdr[5]
         self.nFps = hdr[6]
-        self.nChSize = int(self.nBps / 8) * int(self.nBitrate / self.nFps)
+        self.nFlags = hdr[7]
+        self.nReaders = int(hdr[8])
+        self.nSamples = int(self.nBitrate / self.nFps)
+        self.nChSize = int(self.nBps / 8) * self.nSamples
         self.nFrameSize = self.nCh * self.nChSize
-        self.nPacketSize = self.nPktOvBytes + self.nFrameSize
-        self.nSize = self.nOvBytes + (self.nBuffers * self.nPacketSize)
+        self.nSize = self.calcLayout(self.nBuffers, self.nCh)
 
         self.nBufs = []
+        self.aPktHdrs = []
         for i in range(0, self.nBuffers):
             self.nBufs.append(self.getBuf(i))
+            self.aPktHdrs.append(self.getFrameHeader(i))
+
+        # Map the sample ring
+        if self.nFlags & self.nFlagPacked:
+            dt = mcAudio.getSampleType(self.nBps)
+            if None == dt:
+                self.sErr = f"Packed layout needs 8, 16 or 32 bits per sample: {self.nBps}"
+                self.close()
+                return False
+
+            rsz = self.nBuffers * self.nFrameSize
+            self.aRing = np.ndarray(shape=(int(rsz / dt().itemsize),), dtype=dt, buffer=self.cShm.buf[self.nBufOff:self.nBufOff+rsz])
+
+            # Fall back to copying on wrap if the ring can't be mirrored
+            if 0 == rsz % mmap.PAGESIZE:
+                self.cMirror = mcMirror()
+                if self.cMirror.createShm(self.cShm.name, self.nBufOff, rsz):
+                    self.aMirror = self.cMirror.getBuf().view(dt)
+                else:
+                    self.cMirror = None
 
         return True
 
@@ -353,12 +555,122 @@ class mcAudio:
             return None
 
         # Calculate buffer offset
-        off = self.nOvBytes + (n * self.nPacketSize) + self.nPktOvBytes
+        off = self.nBufOff + (n * self.nBufStride)
         # return np.ndarray(shape=(self.nCh, self.nChSize), dtype=np.uint8, buffer=self.cShm.buf[off:off+self.nFrameSize])
         return np.ndarray(shape=(1, int(2 * self.nBitrate / self.nFps)), dtype=np.int16, buffer=self.cShm.buf[off:off+self.nFrameSize])
         # self.arr = numpy.zeros((1, self.nsamples), dtype='int16')
 
 
+    ''' Calculate and store the audio levels of a buffer in its header
+        @param [in] n   - Buffer index
+        @param [in] arr - Buffer samples, if None, buffer n is read
+
+        Requires a share created with levels=True.  Levels are stored
+        relative to full scale, 0 to 1.
+
+        @returns numpy array of shape (channels, 2) containing [peak, rms]
+    '''
+    def setLevels(self, n, arr=None):
+
+        if not self.nFlags & self.nFlagLevels:
+            self.sErr = "Share has no level fields"
+            return None
+
+        if arr is None:
+            arr = self.getBuf(n)
+            if arr is None:
+                return None
+
+        x = arr.reshape(-1, self.nCh).astype(np.float32)
+        fs = float(1 << (self.nBps - 1))
+
+        lvl = self.getLevels(n)
+        lvl[:, 0] = np.abs(x).max(axis=0) / fs
+        lvl[:, 1] = np.sqrt(np.square(x).mean(axis=0)) / fs
+
+        return lvl
+
+
+    ''' Returns the levels stored in a buffer header
+        @param [in] n   - Buffer index
+
+        @returns numpy array view of shape (channels, 2) containing [peak, rms]
+    '''
+    def getLevels(self, n):
+
+        if not self.nFlags & self.nFlagLevels:
+            self.sErr = "Share has no level fields"
+            return None
+
+        fh = self.getFrameHeader(n)
+        return fh[self.nPktOvBase:].view(np.float64).reshape(self.nCh, 2)
+
+
+    ''' Returns the levels of every buffer without touching the sample data
+
+        @returns numpy array view of shape (buffers, channels, 2) containing [peak, rms]
+    '''
+    def getLevelTable(self):
+
+        if not self.nFlags & self.nFlagLevels:
+            self.sErr = "Share has no level fields"
+            return None
+
+        return np.ndarray(shape=(self.nBuffers, self.nCh, 2), dtype=np.float64, buffer=self.cShm.buf,
+                          offset=self.nHdrOff + (self.nPktOvBase * 8), strides=(self.nHdrStride, 16, 8))
+
+
+    ''' Returns the numpy type of a sample in the packed ring
+        @param [in] bps - Bits per sample
+
+        @returns numpy type or None if not supported
+    '''
+    @staticmethod
+    def getSampleType(bps):
+        return {8: np.int8, 16: np.int16, 32: np.int32}.get(int(bps))
+
+
+    ''' Returns the index of the first sample in the specified buffer
+        @param [in] n   - Buffer index
+    '''
+    def calcSample(self, n):
+        return (n % self.nBuffers) * self.nSamples
+
+
+    ''' Returns a contiguous array of samples that may span several buffers
+        @param [in] start   - First sample, use calcSample() to find the
+                              start of a buffer.  Wraps around the ring.
+        @param [in] count   - Number of samples per channel to return
+
+        Requires a share created with packed=True.  The returned array is a
+        view into the share.  Only if the read wraps and the ring could not
+        be mirrored on this platform will it be a copy.
+
+        @returns numpy array of shape (1, count * channels)
+    '''
+    def readSamples(self, start, count):
+
+        if not self.nFlags & self.nFlagPacked:
+            self.sErr = "Share is not packed"
+            return None
+
+        total = self.nBuffers * self.nSamples
+        if 0 >= count or total < count:
+            self.sErr = f"Invalid sample count: {count}, ring holds {total}"
+            return None
+
+        s = (start % total) * self.nCh
+        e = s + (count * self.nCh)
+
+        if self.aMirror is not None:
+            return self.aMirror[s:e].reshape(1, -1)
+
+        if e <= len(self.aRing):
+            return self.aRing[s:e].reshape(1, -1)
+
+        return np.concatenate((self.aRing[s:], self.aRing[:e - len(self.aRing)])).reshape(1, -1)
+
+
     ''' Correct audio drift
         @param [in] pa - First pointer
         @param [in] pb - Second pointer
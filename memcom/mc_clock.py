@@ -53,6 +53,28 @@ class mcClock(mcFilter):
                                 vfps    : Video frame rate
                                 afps    : Audio frame rate
                                 div     : Time divider
+                                policy  : What to do when a frame would lap the slowest
+                                          reader registered in the share reader table
+                                            overwrite = [default] Publish anyway
+                                            block     = Stop the clock until the readers catch up
+                                            drop      = Skip the frame, counted in getDropped()
+                                cpus / sched / priority / nice : Pin the clock thread and set
+                                          its scheduling, see mcFilter
+                                mode    : How the clock advances
+                                            realtime = [default] Paced against wall time / div
+                                            freerun  = As fast as the downstream filters finish
+                                                       frames, for offline renders.  The clock
+                                                       value is the media time of the frame, so
+                                                       the output doesn't depend on the speed.
+                                depth   : freerun, frames the clock may be ahead of the
+                                          slowest downstream filter, default 1
+                                mask    : freerun, stage bits that mark a frame done, see
+                                          mcPipeline.getMask().  Without it the clock waits
+                                          for the filters registered in the reader table,
+                                          see the mcFilter register option, and sleeps
+                                          until one of them moves its cursor.  Create the
+                                          downstream filters before the clock, with
+                                          wait='event' so they wake on every frame.
     '''
     def create(self, opts={}):
 
@@ -63,35 +85,121 @@ class mcClock(mcFilter):
         self.div = None
         self.clk = 0
 
-        r = super().create(opts=opts)
-        if not r:
+        mode = dict(opts).get('mode', self.opts.get('mode', 'realtime'))
+        if mode not in ('realtime', 'freerun'):
+            self.sErr = f"Invalid clock mode : {mode}"
             return False
 
+        policy = dict(opts).get('policy', self.opts.get('policy', 'overwrite'))
+        if policy not in ('overwrite', 'block', 'drop'):
+            self.sErr = f"Invalid clock policy : {policy}"
+            return False
+
+        return super().create(opts=opts)
+
+
+    def on_init(self, ctx):
+
+        # Set here so the options also reach a filter process
         if self.opts.div:
             self.div = self.opts.div
-
         if self.opts.vfps:
             self.vfps = self.opts.vfps
         if self.opts.afps:
             self.afps = self.opts.afps
 
-        return r
+        self.policy = self.opts.get('policy', 'overwrite')
+        self.tBlocked = None
 
+        self.mode = self.opts.get('mode', 'realtime')
+        self.depth = max(1, int(self.opts.get('depth', 1)))
+        self.mask = self.opts.get('mask', None)
 
-    def on_init(self, ctx):
         self.start_time = time.time()
         self.vpts = 0
         self.vind = 0
         self.apts = 0
         self.aind = 0
 
+    ''' Returns True if the downstream filters are done enough to publish another frame
+        @param [in] share   - Video or audio share
+        @param [in] ind     - Frames published so far
+    '''
+    def isDrained(self, share, ind):
+
+        # Stage bits of the frame depth frames back
+        if None != self.mask:
+            if ind < self.depth:
+                return True
+            n = share.calcIdx(-self.depth)
+            return self.mask == (share.getStages(n) & self.mask)
+
+        # Registered readers
+        return share.getSlowestReader() < self.depth
+
+
+    ''' Publish the next frame as soon as the downstream filters allow
+
+        The stream that is behind in media time goes first, so video and
+        audio stay interleaved the same way on every run.
+    '''
+    def runFree(self):
+
+        vt = self.vind / self.vfps if self.vshare and self.vfps else math.inf
+        at = self.aind / self.afps if self.ashare and self.afps else math.inf
+        if math.inf == vt and math.inf == at:
+            return 0.1
+
+        # Wait for the filters, stage bits wake an event wait straight away,
+        # readers wake the clock when they move their cursors
+        share = self.vshare if vt <= at else self.ashare
+        if not self.isDrained(share, self.vind if vt <= at else self.aind):
+            if None != self.mask:
+                return 0.001
+            share.waitReaders(0.1)
+            return 0
+
+        if vt <= at:
+            self.clk = vt
+            n = self.vshare.getIdx()
+            self.vshare.setFrameInfo(n, 0, self.vind, int(round(vt * 1000)), 0, 0)
+            self.vshare.setIdx(n+1)
+            self.vind += 1
+        else:
+            self.clk = at
+            n = self.ashare.calcIdx(1)
+            self.ashare.setFrameInfo(n, 0, self.aind, int(round(at * 1000)), 0, 0)
+            self.ashare.setIdx(n)
+            self.aind += 1
+
+        return 0
+
+
     def on_idle(self, ctx):
 
+        if 'freerun' == self.mode:
+            return self.runFree()
+
         t = time.time()
         dly = 0
         if not self.div:
             self.div = 1
 
+        # Wait for slow readers, the clock stops while blocked.  The readers
+        # wake the clock when they move their cursors.
+        if 'block' == self.policy:
+            share = self.vshare if self.vshare and not self.vshare.canWrite() else None
+            if not share and self.ashare and not self.ashare.canWrite():
+                share = self.ashare
+            if share:
+                if None == self.tBlocked:
+                    self.tBlocked = t
+                share.waitReaders(0.1)
+                return 0
+            if None != self.tBlocked:
+                self.start_time += t - self.tBlocked
+                self.tBlocked = None
+
         self.clk = (t - self.start_time) / self.div
 
         if self.vshare and self.vfps:
@@ -100,7 +208,12 @@ class mcClock(mcFilter):
                 Log("Video lagging : %s" % vdly)
                 # self.start_time = t - (self.vind / self.vfps)
 
-            if 0 >= vdly:
+            if 0 >= vdly and 'drop' == self.policy and not self.vshare.canWrite():
+                self.vdp.dropped += 1
+                self.vind += 1
+                dly = 0
+
+            elif 0 >= vdly:
                 n = self.vshare.getIdx()
                 # Log(f'CLKSRC: {int(self.clk * 1000)}:{n}:{self.vind}')
                 self.vshare.setFrameInfo(n, 0, self.vind, int(self.clk*1000), 0, 0)
@@ -116,7 +229,12 @@ class mcClock(mcFilter):
                 Log("Audio lagging : %s" % adly)
                 # self.start_time = t - (self.aind / self.afps)
 
-            if 0 >= adly:
+            if 0 >= adly and 'drop' == self.policy and not self.ashare.canWrite():
+                self.adp.dropped += 1
+                self.aind += 1
+                dly = 0
+
+            elif 0 >= adly:
                 n = self.ashare.calcIdx(1)
                 self.ashare.setFrameInfo(n, 0, self.aind, int(self.clk*1000), 0, 0)
                 self.ashare.setIdx(n)
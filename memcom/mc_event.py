@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import errno
+import ctypes
+import platform
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Wait / wake on a 32 bit word in shared memory
+
+    Uses a Linux futex, which works between processes that map the same
+    share.  On other platforms wait() falls back to polling the word.
+'''
+class mcEvent:
+
+    FUTEX_WAIT = 0
+    FUTEX_WAKE = 1
+    FUTEX_WAKE_OP = 5
+    FUTEX_OP_OR = 2
+    FUTEX_OP_OPARG_SHIFT = 8
+    WAKE_ALL = 0x7fffffff
+
+    # futex syscall number by machine
+    SYS_FUTEX = {
+        'x86_64': 202, 'amd64': 202,
+        'aarch64': 98, 'arm64': 98, 'riscv64': 98,
+        'i386': 240, 'i686': 240, 'armv7l': 240, 'armv6l': 240,
+        'ppc64le': 221, 'ppc64': 221, 's390x': 238
+    }
+
+    # Polling interval for the fallback
+    POLL = 0.001
+
+    libc = None
+    nr = None
+
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+    ### Returns True if futex calls are available
+    @staticmethod
+    def isSupported():
+
+        if None == mcEvent.nr:
+            mcEvent.nr = 0
+            if 'Linux' == platform.system() and platform.machine() in mcEvent.SYS_FUTEX:
+                try:
+                    mcEvent.libc = ctypes.CDLL(None, use_errno=True)
+                    mcEvent.libc.syscall.restype = ctypes.c_long
+                    mcEvent.nr = mcEvent.SYS_FUTEX[platform.machine()]
+                except Exception as e:
+                    Log(e)
+
+        return 0 < mcEvent.nr
+
+
+    ### Returns the current value of the word at addr
+    @staticmethod
+    def load(addr):
+        return ctypes.c_int32.from_address(addr).value
+
+
+    ''' Wait while the word at addr still holds val
+        @param [in] addr    - Address of the 32 bit word
+        @param [in] val     - Expected value
+        @param [in] timeout - Maximum time to wait in seconds, None for no limit
+
+        May return early, the caller should check the word again.
+
+        @returns False if timed out
+    '''
+    @staticmethod
+    def wait(addr, val, timeout=None):
+
+        val = ctypes.c_int32(val).value
+
+        if not mcEvent.isSupported():
+            end = None if None == timeout else time.time() + timeout
+            while mcEvent.load(addr) == val:
+                if None != end and time.time() >= end:
+                    return False
+                time.sleep(mcEvent.POLL)
+            return True
+
+        ts = None
+        if None != timeout:
+            timeout = max(0, timeout)
+            ts = mcEvent.timespec(int(timeout), int((timeout % 1) * 1e9))
+
+        r = mcEvent.libc.syscall(ctypes.c_long(mcEvent.nr), ctypes.c_void_p(addr), ctypes.c_int(mcEvent.FUTEX_WAIT),
+                                 ctypes.c_int(val), ctypes.byref(ts) if ts else None, None, ctypes.c_int(0))
+
+        return not (0 > r and errno.ETIMEDOUT == ctypes.get_errno())
+
+
+    ''' Wake processes waiting on the word at addr
+        @param [in] addr    - Address of the 32 bit word
+        @param [in] n       - Maximum number of waiters to wake
+    '''
+    @staticmethod
+    def wake(addr, n=WAKE_ALL):
+
+        if not mcEvent.isSupported():
+            return 0
+
+        return mcEvent.libc.syscall(ctypes.c_long(mcEvent.nr), ctypes.c_void_p(addr), ctypes.c_int(mcEvent.FUTEX_WAKE),
+                                    ctypes.c_int(n), None, None, ctypes.c_int(0))
+
+
+    ''' Atomically set a bit in one word and wake the waiters on another
+        @param [in] addr    - Address of the 32 bit word to modify
+        @param [in] bit     - Bit to set (0-31)
+        @param [in] wake    - Address of the 32 bit word waiters are blocked on
+        @param [in] n       - Maximum number of waiters to wake
+
+        Without futex support the bit is set with a plain read / modify / write.
+    '''
+    @staticmethod
+    def setBitWake(addr, bit, wake, n=WAKE_ALL):
+
+        if not mcEvent.isSupported():
+            w = ctypes.c_uint32.from_address(addr)
+            w.value = w.value | (1 << bit)
+            return 0
+
+        # *addr |= (1 << bit), no wake condition on addr
+        op = ((mcEvent.FUTEX_OP_OR | mcEvent.FUTEX_OP_OPARG_SHIFT) << 28) | ((bit & 0xfff) << 12)
+
+        return mcEvent.libc.syscall(ctypes.c_long(mcEvent.nr), ctypes.c_void_p(wake), ctypes.c_int(mcEvent.FUTEX_WAKE_OP),
+                                    ctypes.c_int(n), ctypes.c_void_p(0), ctypes.c_void_p(addr), ctypes.c_int(op))
@@ -1,16 +1,21 @@
 #!/usr/bin/env python3
 
+import os
 import time
+import threading
 import string
 import random
 import json
 import time
 import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 import propertybag as pb
 import threadmsg as tm
 
 from . mc_video import *
 from . mc_audio import *
+from . mc_stats import *
 
 try:
     import sparen
@@ -51,6 +56,9 @@ except Exception as e:
                                 clk - Clock value
                                 rds - Number of reads
                                 wts - Number of writes
+                              An mcFrameInfo record reused for the buffer, valid
+                              until the writer comes round the ring again.  Use
+                              vfi.toDict() to keep it, or the infodict option.
         @param [in/out] vfr - Video frame numpy array
 
     # Called when a new audio frame is available / ready
@@ -63,7 +71,28 @@ except Exception as e:
                                 clk - Clock value
                                 rds - Number of reads
                                 wts - Number of writes
+                              Reused mcFrameInfo record, as vfi
         @param [in/out] afr - Audio frame numpy array
+
+    # Called instead of on_video with all the pending video frames
+    def on_video_batch(ctx, vfis, vfrs)
+        @param [in] ctx     - Pointer to the mcFilter object
+        @param [in] vfis    - List of video frame information, see on_video
+        @param [in/out] vfrs- List of video frame numpy arrays
+
+    # Called instead of on_audio with all the pending audio frames
+    def on_audio_batch(ctx, afis, afrs)
+        @param [in] ctx     - Pointer to the mcFilter object
+        @param [in] afis    - List of audio frame information, see on_audio
+        @param [in/out] afrs- List of audio frame numpy arrays
+
+    # Called concurrently for each tile of a video frame, before on_video.
+    # With on_video_batch each frame of the batch is tiled before the call.
+    def on_video_tile(ctx, vfi, tile, roi)
+        @param [in] ctx     - Pointer to the mcFilter object
+        @param [in] vfi     - Video frame information, see on_video
+        @param [in/out] tile- View of the tile
+        @param [in] roi     - Position of the tile in the frame {x, y, w, h}
 '''
 class mcFilter(tm.ThreadMsg):
 
@@ -74,22 +103,111 @@ class mcFilter(tm.ThreadMsg):
         @param [in] on_error    - Called when the errors are detected
         @param [in] on_video    - Called when a new video frame is available
         @param [in] on_audio    - Called when a new audio frame is available
+        @param [in] on_video_batch  - Called with all pending video frames, replaces on_video
+        @param [in] on_audio_batch  - Called with all pending audio frames, replaces on_audio
+        @param [in] on_video_tile   - Called on a worker pool for each tile of a video frame
         @param [in] opts        - Options
                                     verbose : Print log information
                                     video   : The name of the video share
                                     audio   : The name of the audio share
                                     thread  : True if internal thread should run
-                                              If False, you must call run() yourself
+                                              If False, you must call runStep() yourself,
+                                              or add the filter to an mcGroup
                                     vbias   : Video buffer offset bias (0-1)
                                     vwin    : Video buffer window size (0-1)
                                     abias   : Audio buffer offset bias (0-1)
                                     awin    : Audio window buffer size (0-1)
+                                    wait    : How the thread waits for frames
+                                                timer = [default] Poll twice per frame
+                                                event = Wake when the writer advances the index
+                                    process : Run the callbacks in a child process that
+                                              attaches to the shares by name.  The filter
+                                              object is pickled, so callbacks must be
+                                              module level functions or methods.
+                                    pmethod : Process start method, default 'spawn'
+                                    stage   : Pipeline stage number, see mcPipeline
+                                    after   : Stage bits required before a frame is
+                                              processed, defaults to all earlier stages
+                                    vdrop   : Video drop policy, dropped frames are counted,
+                                              see getDropped(), not reported as errors
+                                                all    = [default] Process every frame
+                                                latest = Only the newest pending frame
+                                                nth    = Every vnth frame
+                                                fps    = Limit to vrate frames per second
+                                    vnth    : Frame interval for the nth policy
+                                    vrate   : Frame rate for the fps policy
+                                    adrop / anth / arate : Audio drop policy, as above
+                                    stats   : Name of an mcStats share to publish the
+                                              counters from getStats() to
+                                    tiles   : Tiles for on_video_tile, a number of row bands
+                                              or (rows, cols), defaults to workers
+                                    workers : Tile worker threads, defaults to the cpu count
+                                    register: Publish the read position in the reader table of
+                                              the shares, so writers can wait for this filter
+                                    infodict: Pass a new dict as the frame info of each
+                                              callback instead of the reused mcFrameInfo
+                                              record of the buffer, default False
+                                    cpus    : CPUs the filter thread may run on, a list of
+                                              numbers or a string such as '2,4-5'
+                                    sched   : Scheduling policy of the filter thread
+                                                other = Normal time sharing
+                                                fifo  = Real time, first in first out
+                                                rr    = Real time, round robin
+                                                batch / idle = Background work
+                                    priority: Real time priority for fifo / rr, default 1
+                                    nice    : Nice level of the filter thread
+                                              The scheduling options apply to the thread that
+                                              runs the callbacks, in the child with process.
+                                              Real time policies usually need CAP_SYS_NICE,
+                                              failures are reported to on_error.
     '''
     def __init__(self, on_init=None, on_idle=None, on_end=None, on_error=None,
-                       on_video=None, on_audio=None, opts={}, thread=True, start=False):
+                       on_video=None, on_audio=None, opts={}, thread=True, start=False,
+                       on_video_batch=None, on_audio_batch=None, on_video_tile=None):
 
         super().__init__(self.msgThread, start=False)
 
+        self.bThread = thread
+        self.bInit = False
+
+        # Event mode
+        self.bEvent = False
+        self.eshare = None
+        self.nEventIdx = -1
+
+        # Pipeline stage
+        self.nStage = None
+        self.nAfter = 0
+
+        # Drop policies
+        self.vdp = pb.Bag({'policy': 'all', 'dropped': 0})
+        self.adp = pb.Bag({'policy': 'all', 'dropped': 0})
+
+        # Statistics
+        self.aStats = mcStats.createSlot()
+        self.cStats = None
+        self.nStatSlot = -1
+
+        # Reader table slots
+        self.nVReader = -1
+        self.nAReader = -1
+
+        # Thread scheduling
+        self.sched = None
+        self.bSched = False
+        self.tWake = None
+
+        # Tiles
+        self.pool = None
+        self.nWorkers = 0
+        self.tiles = {}
+
+        # Process mode
+        self.bChild = False
+        self.cProc = None
+        self.cErrQ = None
+        self.cStop = None
+
         self.sErr = ""
         self.iopts = opts
         self.opts = pb.Bag(opts)
@@ -105,17 +223,24 @@ class mcFilter(tm.ThreadMsg):
 
         # Video
         self.on_video_callback = on_video if callable(on_video) else None
+        self.on_video_batch_callback = on_video_batch if callable(on_video_batch) else None
+        self.on_video_tile_callback = on_video_tile if callable(on_video_tile) else None
         self.video = None
         self.vshare = None
         self.vptr = 0
+        self.vfrs = []
+        self.vfis = []
         self.vbias = self.opts.get('vbias', 0)
         self.vwin = self.opts.get('vwin', 0.25)
 
         # Audio
         self.on_audio_callback = on_audio if callable(on_audio) else None
+        self.on_audio_batch_callback = on_audio_batch if callable(on_audio_batch) else None
         self.audio = None
         self.ashare = None
         self.aptr = 0
+        self.afrs = []
+        self.afis = []
         self.abias = self.opts.get('abias', 0)
         self.awin = self.opts.get('awin', 0.25)
 
@@ -161,10 +286,57 @@ class mcFilter(tm.ThreadMsg):
     def getAudioBias():
         return self.abias
 
+    ### Only plain state is sent to a filter process
+    def __getstate__(self):
+
+        # Errors are sent back to the parent, so on_error stays here
+        state = self.__dict__.copy()
+        for k in ['thread', 'lock', 'event', 'loop', 'vshare', 'ashare', 'eshare', 'vfrs', 'afrs', 'cProc', 'cErrQ', 'cStop', 'cStats', 'pool', 'on_error_callback']:
+            state.pop(k, None)
+
+        # Property bags don't pickle
+        bags = []
+        for k, v in state.items():
+            if isinstance(v, pb.Bag):
+                state[k] = v.as_dict()
+                bags.append(k)
+        state['_bags'] = bags
+
+        return state
+
+
+    ### Restore state in a filter process
+    def __setstate__(self, state):
+
+        for k in state.pop('_bags', []):
+            state[k] = pb.Bag(state[k])
+        self.__dict__.update(state)
+
+        tm.ThreadMsg.__init__(self, self.msgThread, start=False)
+        self.vshare = None
+        self.ashare = None
+        self.eshare = None
+        self.vfrs = []
+        self.afrs = []
+        self.cProc = None
+        self.cErrQ = None
+        self.cStop = None
+        self.cStats = None
+        self.nStatSlot = -1
+        self.aStats = self.aStats.copy()
+        self.pool = None
+        self.on_error_callback = None
+
+
     ### Release resources and prepare object for reuse
     def close(self):
 
         self.join(True)
+        self.stopProcess()
+        self.runEnd()
+        self.closeStats()
+        self.closeTiles()
+        self.closeReaders()
 
         if self.vshare:
             self.vshare.close()
@@ -177,8 +349,16 @@ class mcFilter(tm.ThreadMsg):
         self.opts = pb.Bag(self.iopts)
         self.vptr = 0
         self.aptr = 0
+        self.vfrs = []
+        self.vfis = []
+        self.afrs = []
+        self.afis = []
         self.video = None
         self.audio = None
+        self.bEvent = False
+        self.eshare = None
+        self.nStage = None
+        self.nAfter = 0
 
 
     ''' Creates the shared memory buffer
@@ -188,17 +368,34 @@ class mcFilter(tm.ThreadMsg):
         @param [in] on_error    - Called when the errors are detected
         @param [in] on_video    - Called when a new video frame is available
         @param [in] on_audio    - Called when a new audio frame is available
+        @param [in] on_video_batch  - Called with all pending video frames, replaces on_video
+        @param [in] on_audio_batch  - Called with all pending audio frames, replaces on_audio
+        @param [in] on_video_tile   - Called on a worker pool for each tile of a video frame
         @param [in] opts        - Options
                                     video   : The name of the video share
                                     audio   : The name of the audio share
                                     thread  : True if internal thread should run
-                                              If False, you must call run() yourself
+                                              If False, you must call runStep() yourself
                                     vbias   : Video buffer offset bias
                                     vwin    : Video buffer window size (0-1)
                                     abias   : Audio buffer offset bias
                                     awin    : Audio buffer window size (0-1)
+                                    wait    : 'timer' or 'event', see __init__()
+                                    process : Run the callbacks in a child process, see __init__()
+                                    pmethod : Process start method, default 'spawn'
+                                    stage   : Pipeline stage number, see __init__()
+                                    after   : Required stage bits, see __init__()
+                                    vdrop / vnth / vrate : Video drop policy, see __init__()
+                                    adrop / anth / arate : Audio drop policy, see __init__()
+                                    stats   : Name of an mcStats share, see __init__()
+                                    tiles   : Tiles for on_video_tile, see __init__()
+                                    workers : Tile worker threads, see __init__()
+                                    register: Publish the read position, see __init__()
+                                    infodict: Frame info as new dicts, see __init__()
+                                    cpus / sched / priority / nice : Thread scheduling, see __init__()
     '''
-    def create(self, on_init=None, on_idle=None, on_end=None, on_error=None, on_video=None, on_audio=None, opts={}):
+    def create(self, on_init=None, on_idle=None, on_end=None, on_error=None, on_video=None, on_audio=None, opts={},
+                     on_video_batch=None, on_audio_batch=None, on_video_tile=None):
 
         self.sErr = ""
         self.close()
@@ -228,19 +425,77 @@ class mcFilter(tm.ThreadMsg):
             self.on_video_callback = on_video
         if on_audio and callable(on_audio):
             self.on_audio_callback = on_audio
+        if on_video_batch and callable(on_video_batch):
+            self.on_video_batch_callback = on_video_batch
+        if on_audio_batch and callable(on_audio_batch):
+            self.on_audio_batch_callback = on_audio_batch
+        if on_video_tile and callable(on_video_tile):
+            self.on_video_tile_callback = on_video_tile
 
         if not self.video and not self.audio:
             self.sErr = "No audio or video share"
             self.close()
             return False
 
+        if not self.opts.name:
+            self.opts.name = f'Filter_{time.time()}'
+
+        # Frames are handed on by stage bits rather than bias offsets
+        self.nStage = self.opts.get('stage', None)
+        if None != self.nStage:
+            self.nStage = int(self.nStage)
+            if 0 > self.nStage or 31 < self.nStage:
+                self.sErr = f"Invalid stage {self.nStage}"
+                self.close()
+                return False
+            self.nAfter = int(self.opts.get('after', (1 << self.nStage) - 1))
+
+        self.vdp = self.createDropPolicy('v')
+        self.adp = self.createDropPolicy('a')
+        if not self.vdp or not self.adp:
+            self.close()
+            return False
+
+        self.sched = self.createSched()
+        if not self.sched:
+            self.close()
+            return False
+        self.bSched = False
+        self.tWake = None
+
+        if not self.openShares():
+            self.close()
+            return False
+
+        # Counters are published from where the callbacks run
+        self.aStats = mcStats.createSlot()
+        if not self.opts.get('process', False) or self.bChild:
+            if not self.openStats() or not self.openTiles() or not self.openReaders():
+                self.close()
+                return False
+
+        # Callbacks run in a child process, this thread relays errors
+        if self.opts.get('process', False) and not self.bChild:
+            if not self.startProcess():
+                self.close()
+                return False
+            super().start()
+
+        elif self.opts.get('thread', self.bThread) and self.delay:
+            super().start()
+
+        return True
+
+
+    ### Open the shares and calculate the read positions
+    def openShares(self):
+
         fps = 1
 
         if self.video:
             self.vshare = mcVideo()
             if not self.vshare.create(name=self.video, mode='existing'):
                 self.sErr = "Failed to open video share"
-                self.close()
                 return False
 
             self.vbufs = self.vshare.getBuffers()
@@ -251,11 +506,17 @@ class mcFilter(tm.ThreadMsg):
             self.vidx = -1
             fps = self.vfps
 
+            # Frame views and info records are reused every time round the ring
+            self.vfrs = self.vshare.getBufs()
+            if 'roi' in self.opts:
+                r = self.opts.roi
+                self.vfrs = [f[r.y:r.y+r.h, r.x:r.x+r.w] for f in self.vfrs]
+            self.vfis = [None if self.opts.get('infodict', False) else mcFrameInfo() for _ in range(self.vbufs)]
+
         if self.audio:
             self.ashare = mcAudio()
             if not self.ashare.create(name=self.audio, mode='existing'):
                 self.sErr = "Failed to open audio share"
-                self.close()
                 return False
 
             self.abufs = self.ashare.getBuffers()
@@ -264,21 +525,635 @@ class mcFilter(tm.ThreadMsg):
             self.awinf = int(self.awin * self.abufs)
             self.aptr = self.ashare.calcIdx(self.abiasf)
             self.aidx = -1
+            self.afrs = self.ashare.getBufs()
+            self.afis = [None if self.opts.get('infodict', False) else mcFrameInfo() for _ in range(self.abufs)]
             if fps < self.afps:
                 fps = self.afps
 
-        if not self.opts.name:
-            self.opts.name = f'Filter_{time.time()}'
+        # Wait on the share with the highest frame rate
+        self.bEvent = 'event' == self.opts.get('wait', 'timer')
+        self.eshare = self.vshare
+        if self.ashare and (not self.eshare or self.afps > self.vfps):
+            self.eshare = self.ashare
 
         self.delay = 1 / fps / 2
-        if self.thread and self.delay:
-            super().start()
 
         return True
 
 
-    ### Called to run the filter
-    def runLoop(self):
+    ### Start the child process
+    def startProcess(self):
+
+        try:
+            ctx = mp.get_context(self.opts.get('pmethod', 'spawn'))
+            self.cErrQ = ctx.Queue()
+            self.cStop = ctx.Event()
+            self.cProc = ctx.Process(target=mcFilter.processMain, args=(self, self.cErrQ, self.cStop),
+                                     name=self.getName(), daemon=True)
+            self.cProc.start()
+        except Exception as e:
+            self.sErr = f"Failed to start filter process : {e}"
+            self.cProc = None
+            return False
+
+        return True
+
+
+    ### Stop the child process and relay any remaining errors
+    def stopProcess(self):
+
+        if not self.cProc:
+            return
+
+        self.cStop.set()
+        self.cProc.join(5)
+        if self.cProc.is_alive():
+            self.cProc.terminate()
+            self.cProc.join()
+
+        self.relayErrors()
+
+        self.cProc = None
+        self.cErrQ = None
+        self.cStop = None
+
+
+    ### Pass errors from the child process to on_error
+    def relayErrors(self):
+
+        while self.cErrQ:
+            try:
+                e = self.cErrQ.get_nowait()
+            except Exception as ex:
+                break
+            if self.on_error_callback:
+                self.on_error_callback(self, e)
+
+
+    ### Sends errors from the child process to the parent
+    def sendError(self, ctx, e):
+        self.cErrQ.put(e if isinstance(e, str) else f'{type(e).__name__}: {e}')
+
+
+    ''' Entry point of the child process
+        @param [in] flt     - Filter object
+        @param [in] errq    - Queue for errors
+        @param [in] stop    - Set by the parent to stop the filter
+    '''
+    @staticmethod
+    def processMain(flt, errq, stop):
+
+        # The shares belong to the parent, don't let the tracker remove them
+        from . import remove_shm_from_resource_tracker
+        remove_shm_from_resource_tracker()
+
+        flt.bChild = True
+        flt.cErrQ = errq
+        flt.on_error_callback = flt.sendError
+
+        if not flt.openShares() or not flt.openStats() or not flt.openTiles() or not flt.openReaders():
+            flt.sendError(flt, flt.getError())
+            return
+
+        super(mcFilter, flt).start()
+
+        # Run until stopped or the parent goes away
+        ppid = os.getppid()
+        while not stop.wait(0.5):
+            if ppid != os.getppid() or not flt.thread.is_alive():
+                break
+
+        flt.join(True)
+        flt.cErrQ = None
+        flt.close()
+
+
+    ''' Returns the filter statistics
+        @returns dict
+                    pid / name  - Process and filter name
+                    time        - Time of the last update in ms
+                    vproc       - Video frames passed to the callbacks
+                    vdrop       - Video frames skipped by the drop policy
+                    vover       - Video overruns
+                    vwin        - Video window errors
+                    vdrift      - Frames the video pointer is behind its target
+                    vhist       - Video callback times, log2 microsecond buckets
+                    aproc ... ahist : The same for audio
+                    wakes       - Timed thread wake-ups measured.  With wait='event'
+                                  only waits that ran out without a new frame
+                                  count, wakes by the writer can't be timed.
+                    jitter      - Lateness of the last wake-up in microseconds
+                    jmax        - Largest lateness in microseconds
+                    whist       - Wake-up lateness, log2 microsecond buckets
+    '''
+    def getStats(self):
+        return mcStats.toDict(self.aStats)
+
+
+    ### Attach the counters to a slot in the stats share
+    def openStats(self):
+
+        s = mcStats.createSlot()
+        s[mcStats.PID] = os.getpid()
+        mcStats.setName(s, self.getName())
+        self.aStats = s
+
+        name = self.opts.get('stats', None)
+        if not name:
+            return True
+
+        self.cStats = mcStats()
+        if not self.cStats.create(name=name, mode='existing'):
+            self.sErr = f"Failed to open stats share : {self.cStats.getError()}"
+            self.cStats = None
+            return False
+
+        self.nStatSlot = self.cStats.claim(self.getName())
+        if 0 > self.nStatSlot:
+            self.sErr = self.cStats.getError()
+            self.cStats.close()
+            self.cStats = None
+            return False
+
+        self.aStats = self.cStats.getSlot(self.nStatSlot)
+        return True
+
+
+    ### Release the stats slot, the counters are kept
+    def closeStats(self):
+
+        if not self.cStats:
+            return
+
+        s = self.aStats.copy()
+        self.aStats = s
+        self.cStats.release(self.nStatSlot)
+        self.cStats.close()
+        self.cStats = None
+        self.nStatSlot = -1
+
+
+    ''' Time a callback into the stats
+        @param [in] base    - mcStats.VPROC or mcStats.APROC
+        @param [in] t       - time.perf_counter() before the callback
+        @param [in] n       - Frames the callback processed, a batch is
+                              recorded as n frames of an even share of the time
+    '''
+    def addCallTime(self, base, t, n=1):
+        s = self.aStats
+        s[base + mcStats.PROC] += n
+        mcStats.addTime(s, mcStats.VHIST if mcStats.VPROC == base else mcStats.AHIST, time.perf_counter() - t, n)
+
+
+    ''' Add a thread wake-up to the stats
+        @param [in] late    - Seconds the thread woke after the requested time
+    '''
+    def addWake(self, late):
+        s = self.aStats
+        us = int(late * 1000000)
+        s[mcStats.WAKES] += 1
+        s[mcStats.JITTER] = us
+        if us > s[mcStats.JMAX]:
+            s[mcStats.JMAX] = us
+        mcStats.addTime(s, mcStats.WHIST, late)
+
+
+    ''' Parse a cpu list
+        @param [in] cpus    - Number, list of numbers or string such as '0,2-3'
+
+        @returns Set of cpu numbers
+    '''
+    @staticmethod
+    def parseCpus(cpus):
+
+        if isinstance(cpus, int):
+            return {cpus}
+
+        if isinstance(cpus, str):
+            r = set()
+            for p in cpus.split(','):
+                p = p.strip()
+                if '-' in p:
+                    a, b = p.split('-', 1)
+                    r.update(range(int(a), int(b) + 1))
+                elif p:
+                    r.add(int(p))
+            return r
+
+        return set(int(c) for c in cpus)
+
+
+    ''' Read the thread scheduling options
+
+        @returns Scheduling settings or None if the options are invalid
+    '''
+    def createSched(self):
+
+        sc = pb.Bag({'cpus': None, 'policy': None, 'priority': 0, 'nice': None})
+
+        cpus = self.opts.get('cpus', None)
+        if None != cpus:
+            try:
+                sc.cpus = mcFilter.parseCpus(cpus)
+            except Exception as e:
+                self.sErr = f"Invalid cpu list : {cpus}"
+                return None
+            if not sc.cpus:
+                self.sErr = "Empty cpu list"
+                return None
+
+        sched = self.opts.get('sched', None)
+        if sched:
+            policies = {'other': 'SCHED_OTHER', 'fifo': 'SCHED_FIFO', 'rr': 'SCHED_RR',
+                        'batch': 'SCHED_BATCH', 'idle': 'SCHED_IDLE'}
+            if sched not in policies:
+                self.sErr = f"Invalid scheduling policy : {sched}"
+                return None
+            sc.policy = getattr(os, policies[sched], None)
+            if None == sc.policy:
+                self.sErr = f"Scheduling policy not supported on this platform : {sched}"
+                return None
+            sc.priority = int(self.opts.get('priority', 1 if sched in ('fifo', 'rr') else 0))
+            lo, hi = os.sched_get_priority_min(sc.policy), os.sched_get_priority_max(sc.policy)
+            if sc.priority < lo or sc.priority > hi:
+                self.sErr = f"Priority {sc.priority} out of range for {sched} : {lo}-{hi}"
+                return None
+
+        nice = self.opts.get('nice', None)
+        if None != nice:
+            sc.nice = int(nice)
+
+        return sc
+
+
+    ''' Apply the scheduling options to the calling thread
+
+        On Linux affinity, policy and nice level are per thread.
+
+        @returns True if all the settings were applied
+    '''
+    def applySched(self):
+
+        sc = self.sched
+        if not sc:
+            return True
+
+        errs = []
+        if sc.cpus:
+            try:
+                os.sched_setaffinity(0, sc.cpus)
+            except Exception as e:
+                errs.append(f'cpus {sorted(sc.cpus)} : {e}')
+
+        if None != sc.policy:
+            try:
+                os.sched_setscheduler(0, sc.policy, os.sched_param(sc.priority))
+            except Exception as e:
+                errs.append(f'sched {self.opts.sched}:{sc.priority} : {e}')
+
+        if None != sc.nice:
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), sc.nice)
+            except Exception as e:
+                errs.append(f'nice {sc.nice} : {e}')
+
+        if errs:
+            self.sErr = "Scheduling : " + ', '.join(errs)
+            return False
+
+        return True
+
+
+    ### Register in the reader tables of the shares
+    def openReaders(self):
+
+        if not self.opts.get('register', False):
+            return True
+
+        if self.vshare:
+            self.nVReader = self.vshare.registerReader(self.vptr)
+            if 0 > self.nVReader:
+                self.sErr = f"Video : {self.vshare.getError()}"
+                return False
+
+        if self.ashare:
+            self.nAReader = self.ashare.registerReader(self.aptr)
+            if 0 > self.nAReader:
+                self.sErr = f"Audio : {self.ashare.getError()}"
+                return False
+
+        return True
+
+
+    ### Leave the reader tables
+    def closeReaders(self):
+
+        if self.vshare and 0 <= self.nVReader:
+            self.vshare.releaseReader(self.nVReader)
+        if self.ashare and 0 <= self.nAReader:
+            self.ashare.releaseReader(self.nAReader)
+
+        self.nVReader = -1
+        self.nAReader = -1
+
+
+    ### Publish the read positions, also serves as the heartbeat
+    def setCursors(self):
+
+        if 0 <= self.nVReader:
+            self.vshare.setReaderCursor(self.nVReader, self.vptr)
+        if 0 <= self.nAReader:
+            self.ashare.setReaderCursor(self.nAReader, self.aptr)
+
+
+    ### Start the tile workers
+    def openTiles(self):
+
+        if not self.on_video_tile_callback:
+            return True
+
+        workers = int(self.opts.get('workers', os.cpu_count() or 1))
+        if 0 >= workers:
+            self.sErr = f"Invalid number of tile workers : {workers}"
+            return False
+
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{self.getName()}_tile')
+        self.nWorkers = workers
+        self.tiles = {}
+        return True
+
+
+    ### Stop the tile workers
+    def closeTiles(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+        self.tiles = {}
+
+
+    ''' Returns the tile regions for a frame size
+        @param [in] h   - Frame height
+        @param [in] w   - Frame width
+    '''
+    def getTiles(self, h, w):
+
+        if (h, w) not in self.tiles:
+
+            t = self.opts.get('tiles', self.nWorkers)
+            rows, cols = (int(t[0]), int(t[1])) if isinstance(t, (list, tuple)) else (int(t), 1)
+            ys = np.linspace(0, h, max(1, min(rows, h)) + 1).astype(int)
+            xs = np.linspace(0, w, max(1, min(cols, w)) + 1).astype(int)
+
+            self.tiles[(h, w)] = [{'x': int(xs[c]), 'y': int(ys[r]), 'w': int(xs[c+1] - xs[c]), 'h': int(ys[r+1] - ys[r])}
+                                  for r in range(0, len(ys) - 1) for c in range(0, len(xs) - 1)]
+
+        return self.tiles[(h, w)]
+
+
+    ''' Run on_video_tile for every tile of a frame and wait for them
+        @param [in] vfi     - Video frame information
+        @param [in] vfr     - Video frame
+
+        Raises the first exception from a tile after all tiles finish.
+    '''
+    def runTiles(self, vfi, vfr):
+
+        fs = []
+        for r in self.getTiles(vfr.shape[0], vfr.shape[1]):
+            tile = vfr[r['y']:r['y']+r['h'], r['x']:r['x']+r['w']]
+            fs.append(self.pool.submit(self.on_video_tile_callback, self, vfi, tile, r))
+
+        err = None
+        for f in fs:
+            e = f.exception()
+            if e and not err:
+                err = e
+
+        if err:
+            raise err
+
+
+    ### Returns the number of frames skipped by the drop policies
+    def getDropped(self):
+        return {'video': self.vdp.dropped, 'audio': self.adp.dropped}
+
+
+    ''' Read the drop policy options
+        @param [in] p   - Option prefix, 'v' or 'a'
+
+        @returns Policy state or None if the options are invalid
+    '''
+    def createDropPolicy(self, p):
+
+        dp = pb.Bag({'policy': self.opts.get(p + 'drop', 'all'), 'dropped': 0, 'seen': 0, 'next': None,
+                     'nth': int(self.opts.get(p + 'nth', 1)), 'rate': float(self.opts.get(p + 'rate', 0))})
+
+        if dp.policy not in ('all', 'latest', 'nth', 'fps'):
+            self.sErr = f"Invalid drop policy : {dp.policy}"
+            return None
+
+        if ('nth' == dp.policy and 1 > dp.nth) or ('fps' == dp.policy and 0 >= dp.rate):
+            self.sErr = f"Invalid {p}nth / {p}rate for the {dp.policy} policy"
+            return None
+
+        return dp
+
+
+    ''' Skip frames nobody needs before processing
+        @param [in] share   - Video or audio share
+        @param [in] ptr     - Read pointer
+        @param [in] i       - Target index
+        @param [in] win     - Window size in frames
+        @param [in] dp      - Drop policy
+
+        The latest policy jumps to the newest frame, the others jump back
+        into the window without raising an error.  The 'all' policy
+        never skips here.
+
+        @returns New read pointer
+    '''
+    def skipFrames(self, share, ptr, i, win, dp):
+
+        if 'all' == dp.policy:
+            return ptr
+
+        b = share.getBuffers()
+        lag = (i - ptr) % b
+
+        keep = 1 if 'latest' == dp.policy else win - 1
+        if 0 > keep or lag <= keep:
+            return ptr
+
+        skip = lag - keep
+        if None != self.nStage:
+            for k in range(0, skip):
+                share.setStage((ptr + k) % b, self.nStage)
+
+        dp.dropped += int(skip)
+        return (ptr + skip) % b
+
+
+    ''' Returns True if the drop policy wants a frame
+        @param [in] fi      - Frame information
+        @param [in] dp      - Drop policy
+        @param [in] fps     - Frame rate of the share
+    '''
+    def wantFrame(self, fi, dp, fps):
+
+        want = True
+
+        if 'nth' == dp.policy:
+            want = 0 == dp.seen % dp.nth
+            dp.seen += 1
+
+        elif 'fps' == dp.policy:
+
+            # clk is in ms, allow half a frame of rounding
+            clk = fi['clk']
+            period = 1000 / dp.rate
+            want = None == dp.next or clk + (500 / fps) >= dp.next
+            if want:
+                dp.next = clk + period if None == dp.next or clk - dp.next > period else dp.next + period
+
+        if not want:
+            dp.dropped += 1
+
+        return want
+
+
+    ### Returns True if the filter runs on its own thread or process
+    def isThreaded(self):
+        return self.thread.is_alive() or (self.cProc is not None)
+
+
+    ''' Hand a frame on to the next pipeline stage
+        @param [in] share   - Video or audio share
+        @param [in] n       - Frame index
+    '''
+    def markDone(self, share, n):
+        if None != self.nStage:
+            share.setStage(n, self.nStage)
+
+
+    ''' Returns True if the earlier pipeline stages are done with a frame
+        @param [in] share   - Video or audio share
+        @param [in] n       - Frame index
+    '''
+    def isReady(self, share, n):
+        if None == self.nStage:
+            return True
+        return self.nAfter == (share.getStages(n) & self.nAfter)
+
+
+    ''' Pass all the pending frames of a share to a batch callback
+        @param [in] share   - Video or audio share
+        @param [in] ptr     - Read pointer
+        @param [in] bias    - Buffer offset bias in frames
+        @param [in] win     - Window size in frames
+        @param [in] last    - Last frame idx processed
+        @param [in] head    - Share index, None to read it from the share
+        @param [in] cb      - Batch callback
+        @param [in] tag     - 'Video' or 'Audio'
+        @param [in] frs     - Frame views, one per buffer
+        @param [in] recs    - Frame info records, one per buffer
+        @param [in] dp      - Drop policy
+
+        If the pointer has fallen out of the window it jumps back in one
+        step, with a single error reporting the frames skipped.
+
+        @returns (ptr, last)
+    '''
+    def runBatch(self, share, ptr, bias, win, last, head, cb, tag, frs, recs, dp=None):
+
+        st = mcStats.VPROC if 'Video' == tag else mcStats.APROC
+
+        b = share.getBuffers()
+        i = share.calcIdx(bias) if None == head else (head + bias) % b
+        if dp:
+            ptr = self.skipFrames(share, ptr, i, win, dp)
+        lag = (i - ptr) % b
+        self.aStats[st + mcStats.DRIFT] = lag
+
+        # Out of the window, skip the oldest frames
+        if 0 < win and win <= lag:
+            self.aStats[st + mcStats.WIN] += 1
+            skip = lag - win + 1
+            if self.on_error_callback:
+                self.on_error_callback(self, f'{tag[0]}OWIN : {-win} > {-lag}, skipped {skip}')
+            for k in range(0, skip):
+                if None != self.nStage:
+                    share.setStage((ptr + k) % b, self.nStage)
+            ptr = (ptr + skip) % b
+            lag -= skip
+
+        fis = []
+        bfrs = []
+        done = []
+        while 0 < lag and self.isReady(share, ptr):
+
+            fi = share.getFrameInfo(ptr, recs[ptr])
+            fr = frs[ptr]
+            done.append(ptr)
+            ptr = (ptr + 1) % b
+            lag -= 1
+
+            # Ensure valid frame (this can happen normally sometimes)
+            if not fi:
+                continue
+
+            # Check for overrun
+            if fi['idx'] <= last:
+                self.aStats[st + mcStats.OVER] += 1
+                if self.on_error_callback:
+                    self.on_error_callback(self, f'{tag} overrun at {fi["clk"]}:{i}, - {fi["idx"]} <= {last}')
+                continue
+
+            last = fi['idx']
+
+            # Dropped by policy
+            if dp and not self.wantFrame(fi, dp, share.getFps()):
+                continue
+
+            fis.append(fi)
+            bfrs.append(fr)
+
+        if fis:
+            t = time.perf_counter()
+            try:
+                if 'Video' == tag and self.on_video_tile_callback:
+                    for fi, fr in zip(fis, bfrs):
+                        self.runTiles(fi, fr)
+                cb(self, fis, bfrs)
+            except Exception as e:
+                if self.on_error_callback:
+                    self.on_error_callback(self, e)
+            self.addCallTime(st, t, len(fis))
+
+        # Hand the frames on to the next stage
+        for n in done:
+            self.markDone(share, n)
+
+        return ptr, last
+
+
+    ''' Called to run the filter
+        @param [in] vhead   - Video share index, None to read it from the share
+        @param [in] ahead   - Audio share index, None to read it from the share
+
+        A scheduler driving many filters reads the index once and passes it in.
+    '''
+    def runLoop(self, vhead=None, ahead=None):
+
+        # Batch callbacks take all the pending frames at once
+        vbatch = self.on_video_batch_callback and self.vshare and self.vshare.isOpen()
+        if vbatch:
+            self.vptr, self.vidx = self.runBatch(self.vshare, self.vptr, self.vbiasf, self.vwinf, self.vidx, vhead,
+                                                 self.on_video_batch_callback, 'Video', self.vfrs, self.vfis, self.vdp)
+
+        abatch = self.on_audio_batch_callback and self.ashare and self.ashare.isOpen()
+        if abatch:
+            self.aptr, self.aidx = self.runBatch(self.ashare, self.aptr, self.abiasf, self.awinf, self.aidx, ahead,
+                                                 self.on_audio_batch_callback, 'Audio', self.afrs, self.afis, self.adp)
 
         # While we processed a buffer
         process = True
@@ -286,7 +1161,7 @@ class mcFilter(tm.ThreadMsg):
             process = False
 
             # If video
-            if self.vshare and self.vshare.isOpen():
+            if self.vshare and self.vshare.isOpen() and not vbatch:
 
                 vid = self.vshare
 
@@ -294,50 +1169,69 @@ class mcFilter(tm.ThreadMsg):
                 b = vid.getBuffers()
 
                 # Get current buffer offset
-                i = vid.calcIdx(self.vbiasf)
+                i = vid.calcIdx(self.vbiasf) if None == vhead else (vhead + self.vbiasf) % b
+
+                # Skip frames the drop policy doesn't want
+                self.vptr = self.skipFrames(vid, self.vptr, i, self.vwinf, self.vdp)
 
                 # Calculate drift
                 d = vid.calcDrift(i, self.vptr)
+                self.aStats[mcStats.VPROC + mcStats.DRIFT] = -d
 
                 # Make sure we're still in the window
                 if -self.vwinf >= d:
+                    self.aStats[mcStats.VPROC + mcStats.WIN] += 1
                     if self.on_error_callback:
                         self.on_error_callback(self, f'VOWIN : {-self.vwinf} > {d}')
+                    if None != self.nStage:
+                        vid.setStage(self.vptr, self.nStage)
                     self.vptr = (self.vptr + 1) % b
 
                 # If there is a frame to process
-                elif 0 > d:
+                elif 0 > d and self.isReady(vid, self.vptr):
 
                     process = True
-                    vfr = vid.getBuf(self.vptr)
-                    vfi = vid.getFrameInfo(self.vptr)
+                    n = self.vptr
+                    vfr = self.vfrs[n]
+                    vfi = vid.getFrameInfo(n, self.vfis[n])
                     self.vptr = (self.vptr + 1) % b
 
                     # Ensure valid frame (this can happen normally sometimes)
-                    if not vfi or 'idx' not in vfi:
+                    if not vfi:
                         pass
 
                     # Check for overrun
                     elif vfi['idx'] <= self.vidx:
+                        self.aStats[mcStats.VPROC + mcStats.OVER] += 1
                         if self.on_error_callback:
                             self.on_error_callback(self, f'Video overrun at {vfi["clk"]}:{i}, - {vfi["idx"]} <= {self.vidx}')
 
+                    # Dropped by policy
+                    elif not self.wantFrame(vfi, self.vdp, vid.getFps()):
+                        self.vidx = vfi['idx']
+
                     # Good to go!
                     else:
                         self.vidx = vfi['idx']
-                        if 'roi' in self.opts:
-                            r = self.opts.roi
-                            vfr = vfr[r.y:r.y+r.h, r.x:r.x+r.w]
+                        t = time.perf_counter()
                         try:
+                            if self.on_video_tile_callback:
+                                self.runTiles(vfi, vfr)
                             if self.on_video_callback:
                                 self.on_video_callback(self, vfi, vfr)
                         except Exception as e:
                             if self.on_error_callback:
                                 self.on_error_callback(self, e)
+                        self.addCallTime(mcStats.VPROC, t)
+
+                    # Hand the frame on to the next stage
+                    self.markDone(vid, n)
+                    if 0 <= self.nVReader:
+                        vid.setReaderCursor(self.nVReader, self.vptr)
 
 
             # If Audio
-            if self.ashare and self.ashare.isOpen():
+            if self.ashare and self.ashare.isOpen() and not abatch:
 
                 aud = self.ashare
 
@@ -345,52 +1239,115 @@ class mcFilter(tm.ThreadMsg):
                 b = aud.getBuffers()
 
                 # Get current buffer offset
-                i = aud.calcIdx(self.abiasf)
+                i = aud.calcIdx(self.abiasf) if None == ahead else (ahead + self.abiasf) % b
+
+                # Skip frames the drop policy doesn't want
+                self.aptr = self.skipFrames(aud, self.aptr, i, self.awinf, self.adp)
 
                 # Calculate drift
                 d = aud.calcDrift(i, self.aptr)
+                self.aStats[mcStats.APROC + mcStats.DRIFT] = -d
 
                 # Ensure we're still in the window
                 if -self.awinf >= d:
+                    self.aStats[mcStats.APROC + mcStats.WIN] += 1
                     if self.on_error_callback:
                         self.on_error_callback(self, f'AOWIN : {-self.awinf} > {d}')
+                    if None != self.nStage:
+                        aud.setStage(self.aptr, self.nStage)
                     self.aptr = (self.aptr + 1) % b
 
                 # If there is a frame to process
-                elif 0 > d:
+                elif 0 > d and self.isReady(aud, self.aptr):
 
                     process = True
-                    afr = aud.getBuf(self.aptr)
-                    afi = aud.getFrameInfo(self.aptr)
+                    n = self.aptr
+                    afr = self.afrs[n]
+                    afi = aud.getFrameInfo(n, self.afis[n])
                     self.aptr = (self.aptr + 1) % b
 
                     # Ensure valid frame (this can happen normally sometimes)
-                    if not afi or 'idx' not in afi:
+                    if not afi:
                         pass
 
                     # Check for overrun
                     elif afi['idx'] <= self.aidx:
+                        self.aStats[mcStats.APROC + mcStats.OVER] += 1
                         if self.on_error_callback:
                             self.on_error_callback(self, f'Audio overrun at {afi["clk"]}:{i}, - {afi["idx"]} <= {self.aidx}')
 
+                    # Dropped by policy
+                    elif not self.wantFrame(afi, self.adp, aud.getFps()):
+                        self.aidx = afi['idx']
+
                     # Good to go!
                     else:
                         self.aidx = afi['idx']
+                        t = time.perf_counter()
                         try:
                             if self.on_audio_callback:
                                 self.on_audio_callback(self, afi, afr)
                         except Exception as e:
                             if self.on_error_callback:
                                 self.on_error_callback(self, e)
+                        self.addCallTime(mcStats.APROC, t)
 
+                    # Hand the frame on to the next stage
+                    self.markDone(aud, n)
+                    if 0 <= self.nAReader:
+                        aud.setReaderCursor(self.nAReader, self.aptr)
 
-    @staticmethod
-    async def msgThread(self):
+        self.setCursors()
+
+        # Publish the counters
+        st = self.aStats
+        st[mcStats.VPROC + mcStats.DROP] = self.vdp.dropped
+        st[mcStats.APROC + mcStats.DROP] = self.adp.dropped
+        st[mcStats.TIME] = int(time.time() * 1000)
+
+
+    ### Wake the thread, including a wait for the next frame
+    def notify(self):
+        super().notify()
+        if self.bEvent and self.eshare:
+            self.eshare.notifyIdx()
+
+
+    ''' Block until the writer advances to the next frame
+        @param [in] timeout - Maximum time to wait in seconds,
+                              defaults to two frame periods
+    '''
+    def waitFrame(self, timeout=None):
+
+        if not self.eshare:
+            return
+
+        if None == timeout:
+            timeout = 4 * self.delay
+        elif 0 >= timeout:
+            return
+
+        # Lateness of a wait that ran out, early wakes are ignored
+        end = time.perf_counter() + timeout
+        if self.nEventIdx == self.eshare.waitIdx(self.nEventIdx, timeout):
+            late = time.perf_counter() - end
+            if 0 <= late:
+                self.addWake(late)
+
+
+    ''' Run one pass of the filter, init / frames / idle
+        @param [in] vhead   - Video share index, None to read it from the share
+        @param [in] ahead   - Audio share index, None to read it from the share
+
+        @returns Time in seconds until the filter wants to run again
+    '''
+    def runStep(self, vhead=None, ahead=None):
 
         delay = self.delay
 
         # Init
-        if not self.loops:
+        if not self.bInit:
+            self.bInit = True
             if self.on_init_callback:
                 try:
                     self.on_init_callback(self)
@@ -399,8 +1356,9 @@ class mcFilter(tm.ThreadMsg):
                         self.on_error_callback(self, e)
 
         # Run
-        if self.on_video_callback or self.on_audio_callback:
-            self.runLoop()
+        if self.on_video_callback or self.on_audio_callback or self.on_video_tile_callback \
+           or self.on_video_batch_callback or self.on_audio_batch_callback:
+            self.runLoop(vhead, ahead)
 
         # Idle
         if self.on_idle_callback:
@@ -410,15 +1368,71 @@ class mcFilter(tm.ThreadMsg):
                 if self.on_error_callback:
                     self.on_error_callback(self, e)
 
+        return delay
+
+
+    ### Call on_end if the filter was started
+    def runEnd(self):
+
+        if not self.bInit:
+            return
+        self.bInit = False
+
+        if self.on_end_callback:
+            try:
+                self.on_end_callback(self)
+            except Exception as e:
+                if self.on_error_callback:
+                    self.on_error_callback(self, e)
+
+
+    @staticmethod
+    async def msgThread(self):
+
+        # Relay for a child process
+        if self.cProc:
+            self.relayErrors()
+            if self.run and not self.cProc.is_alive():
+                if self.on_error_callback:
+                    self.on_error_callback(self, f'Filter process exited : {self.cProc.exitcode}')
+                return -1
+            return 0.1
+
+        # Scheduling options apply to the thread running the callbacks
+        if not self.bSched:
+            self.bSched = True
+            if not self.applySched() and self.on_error_callback:
+                self.on_error_callback(self, self.sErr)
+
+        # Lateness of the last timed sleep, early wakes from notify() are ignored
+        if None != self.tWake:
+            late = time.perf_counter() - self.tWake
+            self.tWake = None
+            if 0 <= late:
+                self.addWake(late)
+
+        # Already ended, the last call after a stop must not start it again
+        if not self.run and not self.bInit:
+            return
+
+        # Index before processing, so a frame written meanwhile isn't missed
+        if self.eshare:
+            self.nEventIdx = self.eshare.getIdx()
+
+        delay = self.runStep()
+
         # Cleanup
         if not self.run:
-            if self.on_end_callback:
-                try:
-                    self.on_end_callback(self)
-                except Exception as e:
-                    if self.on_error_callback:
-                        self.on_error_callback(self, e)
+            self.runEnd()
             return
 
+        # Sleep until the writer advances, on_idle may shorten the wait
+        if self.bEvent and self.eshare:
+            self.waitFrame(delay if self.on_idle_callback else None)
+            return 0
+
+        if delay:
+            self.tWake = time.perf_counter() + delay
+
         return delay
 
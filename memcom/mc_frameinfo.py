@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Reusable frame info record
+
+    Filled in place by getFrameInfo(n, fi) so the filter loop doesn't
+    build a new dict for every frame.  Supports the same read access as
+    the dict, vfi['idx'], 'idx' in vfi, vfi.get('clk'), as well as
+    attributes, vfi.idx.
+
+    A filter keeps one record per buffer, so a record handed to a
+    callback stays valid until the writer comes round the ring again.
+    Use toDict() to keep a copy.
+'''
+class mcFrameInfo:
+
+    # Fields in frame header order
+    KEYS = ('buf', 'pts', 'idx', 'clk', 'rds', 'wts')
+
+    __slots__ = KEYS + ('valid',)
+
+
+    ### Initialize object
+    def __init__(self):
+        self.buf = self.pts = self.idx = self.clk = self.rds = self.wts = 0
+        self.valid = False
+
+
+    ''' Fill the record from a frame header
+        @param [in] n   - Buffer index
+        @param [in] fh  - Frame header values [id, pts, idx, clk, rds, wts]
+    '''
+    def set(self, n, fh):
+        self.buf = n
+        self.pts = fh[1]
+        self.idx = fh[2]
+        self.clk = fh[3]
+        self.rds = fh[4]
+        self.wts = fh[5]
+        self.valid = True
+        return self
+
+
+    ### Mark the record empty, the frame header was not valid
+    def clear(self):
+        self.valid = False
+        return self
+
+
+    ### Returns a dict copy, as the one returned by getFrameInfo(n)
+    def toDict(self):
+        if not self.valid:
+            return {}
+        return {k: getattr(self, k) for k in mcFrameInfo.KEYS}
+
+
+    def __getitem__(self, k):
+        if not self.valid or k not in mcFrameInfo.KEYS:
+            raise KeyError(k)
+        return getattr(self, k)
+
+
+    def __contains__(self, k):
+        return self.valid and k in mcFrameInfo.KEYS
+
+
+    def __bool__(self):
+        return self.valid
+
+
+    def __len__(self):
+        return len(mcFrameInfo.KEYS) if self.valid else 0
+
+
+    def __iter__(self):
+        return iter(mcFrameInfo.KEYS if self.valid else ())
+
+
+    def __repr__(self):
+        return repr(self.toDict())
+
+
+    def get(self, k, default=None):
+        return getattr(self, k) if k in self else default
+
+
+    def keys(self):
+        return list(self)
+
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self]
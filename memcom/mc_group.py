@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+import time
+import propertybag as pb
+import threadmsg as tm
+from concurrent.futures import ThreadPoolExecutor
+
+from . mc_filter import *
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Drives many filters from one thread
+
+    Every mcFilter normally owns a thread that polls its shares on a
+    timer.  A group runs any number of filters from a single loop.  The
+    index of each share is read once per tick and passed to every filter
+    attached to it, then the ready frames are dispatched.  With the
+    workers option the filters of a tick are spread over a small pool.
+
+    Filters must be created with thread=False before being added.
+
+    @begincode
+
+        grp = mcGroup(opts={'wait': 'event'})
+        blank = mcBlank(opts={'video': 'cam', 'thread': False})
+        blank.create()
+        grp.add(blank)
+        grp.create()
+
+    @endcode
+'''
+class mcGroup(tm.ThreadMsg):
+
+    ''' Initialize object
+        @param [in] on_error    - Called when the errors are detected
+        @param [in] opts        - Options
+                                    workers : Number of worker threads, 0 to run
+                                              the filters on the group thread
+                                    wait    : How the thread waits for frames
+                                                timer = [default] Poll twice per frame
+                                                event = Wake when a writer advances the index
+    '''
+    def __init__(self, on_error=None, opts={}):
+
+        super().__init__(self.msgThread, start=False)
+
+        self.sErr = ""
+        self.iopts = opts
+        self.opts = pb.Bag(opts)
+        self.on_error_callback = on_error if callable(on_error) else None
+
+        self.filters = []
+        self.ending = []
+        self.pool = None
+        self.eshare = None
+        self.nEventIdx = -1
+        self.nTicks = 0
+
+
+    ### Destructor
+    def __del__(self):
+        super().__del__()
+        self.close()
+
+
+    ### Returns the last error string
+    def getError(self):
+        return self.sErr
+
+
+    ### Returns the filters in the group
+    def getFilters(self):
+        return self.filters
+
+
+    ### Returns the number of passes run
+    def getTicks(self):
+        return self.nTicks
+
+
+    ''' Add a filter to the group
+        @param [in] flt     - Filter created with thread=False
+
+        @returns True if success
+    '''
+    def add(self, flt):
+
+        if flt.isThreaded():
+            self.sErr = f"Filter {flt.getName()} has its own thread, create it with thread=False"
+            return False
+
+        if not flt.vshare and not flt.ashare:
+            self.sErr = f"Filter {flt.getName()} is not attached to a share"
+            return False
+
+        with self.lock:
+            if flt not in self.filters:
+                self.filters.append(flt)
+            self.eshare = self.findEventShare()
+
+        self.notify()
+        return True
+
+
+    ''' Remove a filter from the group
+        @param [in] flt     - Filter to remove
+
+        on_end is called for the filter.  While the group is running the
+        filter may still be inside a tick, so on_end is queued and called
+        from the group thread before the next tick starts.
+    '''
+    def remove(self, flt):
+
+        with self.lock:
+            if flt not in self.filters:
+                return False
+            self.filters.remove(flt)
+            self.eshare = self.findEventShare()
+            running = self.run and self.thread.is_alive()
+            if running:
+                self.ending.append(flt)
+
+        if running:
+            self.notify()
+        else:
+            flt.runEnd()
+
+        return True
+
+
+    ''' Start the group
+        @param [in] opts    - Options, see __init__()
+    '''
+    def create(self, opts={}):
+
+        self.sErr = ""
+        self.opts.merge(opts)
+
+        workers = int(self.opts.get('workers', 0))
+        if 0 < workers:
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mcGroup')
+
+        super().start()
+
+        return True
+
+
+    ### Stop the group, the filters are not closed
+    def close(self):
+
+        self.join(True)
+
+        with self.lock:
+            for f in self.ending + self.filters:
+                f.runEnd()
+            self.ending = []
+            self.eshare = None
+
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
+
+    ### Returns the share with the highest frame rate, used for event waits
+    def findEventShare(self):
+
+        es = None
+        for f in self.filters:
+            for sh in (f.vshare, f.ashare):
+                if sh and (not es or sh.getFps() > es.getFps()):
+                    es = sh
+        return es
+
+
+    ### Wake the thread, including a wait for the next frame
+    def notify(self):
+        super().notify()
+        es = self.eshare
+        if es and es.isOpen():
+            es.notifyIdx()
+
+
+    ''' Read the index of each share once
+        @param [in] filters - Filters to read
+
+        @returns dict of share name to index
+    '''
+    def readHeads(self, filters):
+
+        heads = {}
+        for f in filters:
+            if f.vshare and f.video not in heads:
+                heads[f.video] = f.vshare.getIdx()
+            if f.ashare and f.audio not in heads:
+                heads[f.audio] = f.ashare.getIdx()
+        return heads
+
+
+    ''' Run one pass of a filter
+        @param [in] flt     - Filter
+        @param [in] heads   - Share indexes from readHeads()
+    '''
+    def runFilter(self, flt, heads):
+
+        try:
+            return flt.runStep(heads.get(flt.video) if flt.vshare else None,
+                               heads.get(flt.audio) if flt.ashare else None)
+        except Exception as e:
+            if self.on_error_callback:
+                self.on_error_callback(self, e)
+        return flt.delay
+
+
+    ### Run one pass of every filter in the group
+    def runTick(self):
+
+        with self.lock:
+            ending, self.ending = self.ending, []
+            filters = list(self.filters)
+            es = self.eshare
+
+        # The last tick has finished, removed filters can be ended
+        for f in ending:
+            f.runEnd()
+
+        if es:
+            self.nEventIdx = es.getIdx()
+
+        heads = self.readHeads(filters)
+
+        if self.pool and 1 < len(filters):
+            delays = list(self.pool.map(lambda f: self.runFilter(f, heads), filters))
+        else:
+            delays = [self.runFilter(f, heads) for f in filters]
+
+        self.nTicks += 1
+
+        delays = [d for d in delays if d is not None]
+        return min(delays) if delays else 0.1
+
+
+    @staticmethod
+    async def msgThread(self):
+
+        if not self.run:
+            return
+
+        delay = self.runTick()
+
+        # Sleep until a writer advances, idle callbacks may shorten the wait
+        es = self.eshare
+        if 'event' == self.opts.get('wait', 'timer') and es:
+            idle = any(f.on_idle_callback for f in self.filters)
+            es.waitIdx(self.nEventIdx, delay if idle else 4 * delay)
+            return 0
+
+        return delay
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+import time
+import numpy as np
+import propertybag as pb
+
+from . mc_filter import *
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Stores audio levels in the packet headers
+
+    Place after the last stage that writes audio, the audio share must be
+    created with levels=True.  Monitors can then read the levels of the
+    whole ring with mcAudio.getLevelTable() instead of scanning samples.
+'''
+class mcLevels(mcFilter):
+
+    ''' Initialize object
+        @param [in] opts    - Options
+                                audio   : The name of the audio share
+    '''
+    def __init__(self, on_error=None, opts={}):
+        super().__init__(on_error=on_error, on_audio=self.on_audio, opts=opts)
+
+
+    ### Delete
+    def __del__(self):
+        super().__del__()
+        self.close()
+
+
+    ### Release resources and prepare object for reuse
+    def close(self):
+        super().close()
+
+
+    def on_audio(self, ctx, afi, afr):
+        if self.ashare.setLevels(afi['buf'], afr) is None:
+            raise Exception(self.ashare.getError())
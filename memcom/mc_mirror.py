@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import mmap
+import ctypes
+import ctypes.util
+import numpy as np
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Mirrored ring buffer mapping
+
+    Maps one region of a shared memory file twice, back to back, in the
+    virtual address space.  Reading past the end of the first mapping
+    continues at the start of the region, so any window of up to the
+    region size can be accessed as one contiguous array without copying.
+
+    The region offset and size must be multiples of mmap.PAGESIZE.
+    Only available on POSIX systems where the value of MAP_FIXED is known.
+'''
+class mcMirror:
+
+    # Not exported by the mmap module.  The value is the same on Linux,
+    # macOS and the BSDs, except Linux on alpha and parisc.
+    MAP_FIXED = getattr(mmap, 'MAP_FIXED', None)
+    if None == MAP_FIXED and sys.platform.startswith(('linux', 'darwin', 'freebsd', 'netbsd', 'openbsd')) \
+            and not os.uname().machine.startswith(('alpha', 'parisc')):
+        MAP_FIXED = 0x10
+
+    ### Initialize object
+    def __init__(self):
+        self.sErr = ""
+        self.nBase = 0
+        self.nSize = 0
+        self.aBuf = None
+        self.close()
+
+
+    ### Delete
+    def __del__(self):
+        self.close()
+
+
+    ### Returns the last error string
+    def getError(self):
+        return self.sErr
+
+
+    ### Returns True if the mirror is mapped
+    def isOpen(self):
+        return True if self.nBase else False
+
+
+    ### Returns the size of the mirrored region in bytes
+    def getSize(self):
+        return self.nSize
+
+
+    ### Returns True if mirrored mappings are supported on this platform
+    @staticmethod
+    def isSupported():
+        return 'posix' == os.name and hasattr(mmap, 'MAP_ANONYMOUS') and None != mcMirror.MAP_FIXED
+
+
+    ### Returns the libc mmap / munmap functions
+    @staticmethod
+    def getLibc():
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+        libc.munmap.restype = ctypes.c_int
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        return libc
+
+
+    ### Returns the shm_open function, older glibc keeps it in librt
+    @staticmethod
+    def getShmOpen():
+        for lib in (None, ctypes.util.find_library('rt')):
+            try:
+                fn = ctypes.CDLL(lib, use_errno=True).shm_open
+                fn.restype = ctypes.c_int
+                fn.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+                return fn
+            except Exception as e:
+                pass
+        return None
+
+
+    ### Unmap the region
+    #   Any array returned by getBuf() is invalid after this call
+    def close(self):
+
+        self.aBuf = None
+        if self.nBase:
+            mcMirror.getLibc().munmap(self.nBase, 2 * self.nSize)
+
+        self.nBase = 0
+        self.nSize = 0
+
+
+    ''' Map a region of a file twice
+        @param [in] fd      - File descriptor of the shared memory
+        @param [in] off     - Offset of the region in the file
+        @param [in] size    - Size of the region in bytes
+
+        @returns True if success
+    '''
+    def create(self, fd, off, size):
+
+        self.sErr = ""
+        self.close()
+
+        fd = int(fd)
+        off = int(off)
+        size = int(size)
+
+        if not mcMirror.isSupported():
+            self.sErr = "Mirrored mapping is not supported on this platform"
+            return False
+
+        if 0 >= size or size % mmap.PAGESIZE or off % mmap.PAGESIZE:
+            self.sErr = f"Region is not page aligned : {off} : {size}"
+            return False
+
+        libc = mcMirror.getLibc()
+        fail = ctypes.c_void_p(-1).value
+
+        # Reserve address space for both copies
+        base = libc.mmap(None, 2 * size, mmap.PROT_READ, mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS, -1, 0)
+        if not base or fail == base:
+            self.sErr = f"Failed to reserve address space : {os.strerror(ctypes.get_errno())}"
+            return False
+
+        # Map the region into each half
+        prot = mmap.PROT_READ | mmap.PROT_WRITE
+        flags = mmap.MAP_SHARED | mcMirror.MAP_FIXED
+        for p in (base, base + size):
+            if p != libc.mmap(p, size, prot, flags, fd, off):
+                self.sErr = f"Failed to map region : {os.strerror(ctypes.get_errno())}"
+                libc.munmap(base, 2 * size)
+                return False
+
+        self.nBase = base
+        self.nSize = size
+        self.aBuf = np.ctypeslib.as_array((ctypes.c_uint8 * (2 * size)).from_address(base))
+
+        return True
+
+
+    ''' Map a region of a named shared memory twice
+        @param [in] name    - Name of the shared memory, as SharedMemory.name
+        @param [in] off     - Offset of the region in the share
+        @param [in] size    - Size of the region in bytes
+
+        The share is opened again by name, the descriptor is only needed
+        while mapping.
+
+        @returns True if success
+    '''
+    def createShm(self, name, off, size):
+
+        self.sErr = ""
+        self.close()
+
+        if not mcMirror.isSupported():
+            self.sErr = "Mirrored mapping is not supported on this platform"
+            return False
+
+        shm_open = mcMirror.getShmOpen()
+        if not shm_open:
+            self.sErr = "shm_open() is not available"
+            return False
+
+        fd = shm_open(('/' + name.lstrip('/')).encode(), os.O_RDWR, 0)
+        if 0 > fd:
+            self.sErr = f"Failed to open share {name} : {os.strerror(ctypes.get_errno())}"
+            return False
+
+        try:
+            return self.create(fd, off, size)
+        finally:
+            os.close(fd)
+
+
+    ### Returns both copies of the region as a uint8 numpy array
+    def getBuf(self):
+        return self.aBuf
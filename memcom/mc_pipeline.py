@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import time
+import propertybag as pb
+
+from . mc_filter import *
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Filter pipeline with per frame stage completion
+
+    Instead of spacing the filters around the ring with fractional
+    vbias / abias offsets, the stages are declared in order.  Every
+    filter owns a bit in the stage field of the frame header and sets it
+    when it is done with a frame.  A stage runs a frame as soon as all
+    the filters of the earlier stages have marked it, so the latency is
+    the actual processing time rather than a fraction of the ring.
+
+    A stage may hold several filters, for example drawing into separate
+    regions of the frame, which run in parallel.  Up to 32 filters.
+
+    The writer clears the stage bits when it publishes a frame with
+    setFrameInfo(), as mcClock does.
+
+    @begincode
+
+        pl = mcPipeline(opts={'video': vsname, 'audio': asname})
+        pl.add(mcTestVid())
+        pl.add(mcSync(on_video=show), mcLevels())
+        pl.add(mcBlank())
+        if not pl.create():
+            raise Exception(pl.getError())
+
+    @endcode
+'''
+class mcPipeline:
+
+    # Options passed on to the filters
+    FILTER_OPTS = ['video', 'audio', 'wait', 'thread', 'process', 'pmethod', 'vwin', 'awin']
+
+    ''' Initialize object
+        @param [in] on_error    - Called when the errors are detected
+        @param [in] opts        - Options
+                                    video   : The name of the video share
+                                    audio   : The name of the audio share
+                                    wait    : How the filters wait for frames, default 'event'
+                                    vwin    : Video window, the furthest a stage may lag
+                                              the writer (0-1), default 0.75
+                                    awin    : Audio window (0-1), default 0.75
+                                    thread / process / pmethod are passed to the filters
+    '''
+    def __init__(self, on_error=None, opts={}):
+        self.sErr = ""
+        self.opts = pb.Bag(opts)
+        self.on_error_callback = on_error if callable(on_error) else None
+        self.stages = []
+        self.bRunning = False
+
+
+    ### Destructor
+    def __del__(self):
+        self.close()
+
+
+    ### Returns the last error string
+    def getError(self):
+        return self.sErr
+
+
+    ### Returns the list of stages, each a list of filters
+    def getStages(self):
+        return self.stages
+
+
+    ### Returns the number of filters
+    def getCount(self):
+        return sum([len(s) for s in self.stages])
+
+
+    ### Returns the stage bits of all filters, set once a frame is through the pipeline
+    def getMask(self):
+        return (1 << self.getCount()) - 1
+
+
+    ''' Add a stage
+        @param [in] filters - One or more filters that run in parallel
+
+        Filters are created by create(), not before.
+
+        @returns Stage number or -1 on error
+    '''
+    def add(self, *filters):
+
+        if self.bRunning:
+            self.sErr = "Pipeline is running"
+            return -1
+
+        if not filters:
+            self.sErr = "Empty stage"
+            return -1
+
+        if 32 < self.getCount() + len(filters):
+            self.sErr = "Too many filters, the stage bits hold 32"
+            return -1
+
+        self.stages.append(list(filters))
+        return len(self.stages) - 1
+
+
+    ''' Create the filters and start the pipeline
+        @param [in] opts    - Options, see __init__()
+    '''
+    def create(self, opts={}):
+
+        self.sErr = ""
+        self.close()
+        self.opts.merge(opts)
+
+        if not self.opts.video and not self.opts.audio:
+            self.sErr = "No audio or video share"
+            return False
+
+        fo = {'wait': 'event', 'vwin': 0.75, 'awin': 0.75}
+        for k in mcPipeline.FILTER_OPTS:
+            if k in self.opts:
+                fo[k] = self.opts[k]
+
+        self.bRunning = True
+
+        bit = 0
+        after = 0
+        for si, s in enumerate(self.stages):
+            mask = 0
+            for f in s:
+                o = dict(fo)
+                o.update({'stage': bit, 'after': after, 'vbias': 0, 'abias': 0})
+                if not f.opts.name:
+                    o['name'] = f'Stage{si}_{bit}'
+                if self.on_error_callback and not f.on_error_callback:
+                    f.on_error_callback = self.on_error_callback
+                if not f.create(opts=o):
+                    self.sErr = f"Stage {si} : {f.getError()}"
+                    self.close()
+                    return False
+                mask |= 1 << bit
+                bit += 1
+
+            # Later stages wait for all the filters before them
+            after |= mask
+
+        return True
+
+
+    ### Stop the filters, last stage first
+    def close(self):
+
+        if not self.bRunning:
+            return
+        self.bRunning = False
+
+        for s in reversed(self.stages):
+            for f in s:
+                f.close()
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import mmap
+import numpy as np
+
+from . mc_frameinfo import *
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Raw capture file
+
+    Frames are copied straight from a share into a preallocated, memory
+    mapped file, with no encoding.  A frame index next to the data holds
+    the frame header of every frame and the time it was written, so a
+    capture can be searched by clock without touching the frames.
+
+    The file may be opened for reading while it is being written, the
+    frame counts in the header are only advanced once a frame and its
+    index entry are in place.
+
+    Layout, data regions are page aligned
+        Header      - nOvInts int64, then one stream block per stream
+        Index       - Per stream, frames x nIdxInts int64
+        Data        - Per stream, frames x frame bytes
+
+    @begincode
+
+        raw = mcRawFile()
+        raw.open('capture.raw')
+        vid = raw.getVideo()
+        for n in range(0, vid.getIdx()):
+            print(vid.getFrameInfo(n), vid.getBuf(n).shape)
+
+    @endcode
+'''
+class mcRawFile:
+
+    # Streams in file order
+    STREAMS = ('video', 'audio')
+
+    # Stream block
+    # [0] = Frames allocated
+    # [1] = Frames written
+    # [2] = Frame bytes
+    # [3] = Frame shape, up to three dimensions, 0 if unused
+    # [6] = Sample type, numpy dtype character
+    # [7] = Index offset
+    # [8] = Data offset
+    # [9] = FPS x 1000
+    # [10] = Channels, audio
+    # [11] = Bps, audio
+    # [12] = Bitrate, audio
+    # [13..15] = Reserved
+    STM_INTS = 16
+    STM_ALLOC = 0
+    STM_COUNT = 1
+    STM_BYTES = 2
+    STM_SHAPE = 3
+    STM_DTYPE = 6
+    STM_IDX = 7
+    STM_DATA = 8
+    STM_FPS = 9
+    STM_CH = 10
+    STM_BPS = 11
+    STM_BITRATE = 12
+
+    ### Initialize object
+    def __init__(self):
+
+        # File header
+        # [0] = Id
+        # [1] = Version
+        # [2] = Streams
+        # [3] = Creation time in ns
+        # [4..7] = Reserved
+        self.nOvInts = 8
+        self.nOvBytes = (self.nOvInts + len(mcRawFile.STREAMS) * mcRawFile.STM_INTS) * 8
+
+        # Index entry
+        # [0..5] = Frame header, as mcFrameInfo, buf is the frame number
+        # [6] = Write time in ns
+        # [7] = Reserved
+        self.nIdxInts = 8
+
+        self.nBufferId = 0x5A3C9E11D7B24F60
+        self.nVersion = 1
+
+        self.cMap = None
+        self.nFd = -1
+        self.sErr = ""
+        self.close()
+
+
+    ### Delete
+    def __del__(self):
+        self.close()
+
+
+    ### Returns the last error string
+    def getError(self):
+        return self.sErr
+
+
+    ### Returns True if the file is open
+    def isOpen(self):
+        return True if self.cMap else False
+
+
+    ### Returns the file name
+    def getName(self):
+        return self.sName
+
+
+    ### Returns the size of the file in bytes
+    def getSize(self):
+        return self.nSize
+
+
+    ### Returns True if the file was opened for writing
+    def isWriter(self):
+        return self.bWrite
+
+
+    ### Unmap and close the file
+    #   Any array returned by the views is invalid after this call
+    def close(self):
+
+        self.cHdr = None
+        self.views = {}
+
+        if self.cMap:
+            try:
+                if self.bWrite:
+                    self.cMap.flush()
+                self.cMap.close()
+            except Exception as e:
+                # Arrays still referencing the map keep it alive
+                pass
+            self.cMap = None
+
+        if 0 <= self.nFd:
+            os.close(self.nFd)
+            self.nFd = -1
+
+        self.sName = ""
+        self.nSize = 0
+        self.bWrite = False
+
+
+    ''' Creates a capture file for writing
+        @param [in] fname   - File name, an existing file is replaced
+        @param [in] video   - Video stream {'frames', 'shape', 'dtype', 'fps'}, or None
+        @param [in] audio   - Audio stream {'frames', 'shape', 'dtype', 'fps', 'ch', 'bps', 'bitrate'}, or None
+
+        The whole file is allocated up front, so running out of disk shows
+        up here instead of as a bus error part way through a capture.
+    '''
+    def create(self, fname, video=None, audio=None):
+
+        self.sErr = ""
+        self.close()
+
+        # Stream blocks
+        blks = []
+        off = self.nOvBytes
+        for s in (video, audio):
+            b = np.zeros(mcRawFile.STM_INTS, dtype=np.int64)
+            if s:
+                shape = tuple(int(v) for v in s['shape'])
+                dt = np.dtype(s.get('dtype', np.uint8))
+                frames = int(s.get('frames', 0))
+                if 0 >= frames or not shape or 3 < len(shape) or 0 in shape:
+                    self.sErr = f"Invalid stream : {frames} x {shape}"
+                    return False
+                b[mcRawFile.STM_ALLOC] = frames
+                b[mcRawFile.STM_BYTES] = int(np.prod(shape)) * dt.itemsize
+                b[mcRawFile.STM_SHAPE:mcRawFile.STM_SHAPE+len(shape)] = shape
+                b[mcRawFile.STM_DTYPE] = ord(dt.char)
+                b[mcRawFile.STM_FPS] = int(round(float(s.get('fps', 0)) * 1000))
+                b[mcRawFile.STM_CH] = int(s.get('ch', 0))
+                b[mcRawFile.STM_BPS] = int(s.get('bps', 0))
+                b[mcRawFile.STM_BITRATE] = int(s.get('bitrate', 0))
+                b[mcRawFile.STM_IDX] = off
+                off += frames * self.nIdxInts * 8
+            blks.append(b)
+
+        if not any(b[mcRawFile.STM_ALLOC] for b in blks):
+            self.sErr = "No streams to capture"
+            return False
+
+        # Page aligned frame data
+        for b in blks:
+            if b[mcRawFile.STM_ALLOC]:
+                off = mcRawFile.pageAlign(off)
+                b[mcRawFile.STM_DATA] = off
+                off += int(b[mcRawFile.STM_ALLOC] * b[mcRawFile.STM_BYTES])
+        size = mcRawFile.pageAlign(off)
+
+        try:
+            self.nFd = os.open(fname, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(self.nFd, 0, size)
+            else:
+                os.ftruncate(self.nFd, size)
+            self.cMap = mmap.mmap(self.nFd, size, access=mmap.ACCESS_WRITE)
+        except Exception as e:
+            self.sErr = f"Failed to create raw file : {fname} : {e}"
+            self.close()
+            return False
+
+        self.sName = fname
+        self.nSize = size
+        self.bWrite = True
+
+        hdr = self.getHeader()
+        hdr[1] = self.nVersion
+        hdr[2] = len(mcRawFile.STREAMS)
+        hdr[3] = time.time_ns()
+        for k, b in enumerate(blks):
+            self.getStreamBlock(k)[:] = b
+        hdr[0] = self.nBufferId
+
+        return self.openViews()
+
+
+    ''' Opens a capture file for reading
+        @param [in] fname   - File name
+    '''
+    def open(self, fname):
+
+        self.sErr = ""
+        self.close()
+
+        try:
+            self.nFd = os.open(fname, os.O_RDONLY)
+            size = os.fstat(self.nFd).st_size
+            if size < self.nOvBytes:
+                raise Exception(f"File too small : {size}")
+            self.cMap = mmap.mmap(self.nFd, size, access=mmap.ACCESS_READ)
+        except Exception as e:
+            self.sErr = f"Failed to open raw file : {fname} : {e}"
+            self.close()
+            return False
+
+        self.sName = fname
+        self.nSize = size
+
+        hdr = self.getHeader()
+        if hdr[0] != self.nBufferId or hdr[1] != self.nVersion:
+            self.sErr = f"Invalid raw file header : {hdr[0]} : {hdr[1]}"
+            self.close()
+            return False
+
+        return self.openViews()
+
+
+    ### Returns the file header
+    def getHeader(self):
+        if self.cHdr is None:
+            self.cHdr = np.ndarray(shape=(self.nOvInts + len(mcRawFile.STREAMS) * mcRawFile.STM_INTS,),
+                                   dtype=np.int64, buffer=self.cMap)
+        return self.cHdr[0:self.nOvInts]
+
+
+    ''' Returns the block of a stream
+        @param [in] k   - Stream, 0 = video, 1 = audio
+    '''
+    def getStreamBlock(self, k):
+        self.getHeader()
+        off = self.nOvInts + k * mcRawFile.STM_INTS
+        return self.cHdr[off:off+mcRawFile.STM_INTS]
+
+
+    ### Returns the time the file was created in ns
+    def getTime(self):
+        return int(self.getHeader()[3])
+
+
+    ### Create the stream views
+    def openViews(self):
+
+        self.views = {}
+        for k, s in enumerate(mcRawFile.STREAMS):
+            b = self.getStreamBlock(k)
+            if not b[mcRawFile.STM_ALLOC]:
+                continue
+            if b[mcRawFile.STM_DATA] + b[mcRawFile.STM_ALLOC] * b[mcRawFile.STM_BYTES] > self.nSize:
+                self.sErr = f"Raw file is truncated : {self.sName}"
+                self.close()
+                return False
+            self.views[s] = mcRawView(self, b)
+
+        return True
+
+
+    ### Returns the video stream as an mcRawView, or None
+    def getVideo(self):
+        return self.views.get('video', None)
+
+
+    ### Returns the audio stream as an mcRawView, or None
+    def getAudio(self):
+        return self.views.get('audio', None)
+
+
+    ### Rounds up to a multiple of the page size
+    @staticmethod
+    def pageAlign(n):
+        return int((n + mmap.PAGESIZE - 1) / mmap.PAGESIZE) * mmap.PAGESIZE
+
+
+''' One stream of a raw capture file
+
+    Has the read calls of mcVideo / mcAudio, getBuf(), getFrameInfo()
+    and so on, over the frames written so far.  getIdx() is the number
+    of frames written.
+'''
+class mcRawView:
+
+    ''' Initialize object
+        @param [in] raw - mcRawFile
+        @param [in] blk - Stream block
+    '''
+    def __init__(self, raw, blk):
+
+        self.raw = raw
+        self.blk = blk
+        self.nBuffers = int(blk[mcRawFile.STM_ALLOC])
+        self.nFrameSize = int(blk[mcRawFile.STM_BYTES])
+        self.shape = tuple(int(v) for v in blk[mcRawFile.STM_SHAPE:mcRawFile.STM_SHAPE+3] if v)
+        self.dtype = np.dtype(chr(int(blk[mcRawFile.STM_DTYPE])))
+
+        off = int(blk[mcRawFile.STM_IDX])
+        self.aIdx = np.ndarray(shape=(self.nBuffers, raw.nIdxInts), dtype=np.int64,
+                               buffer=raw.cMap, offset=off)
+
+        off = int(blk[mcRawFile.STM_DATA])
+        self.aData = np.ndarray(shape=(self.nBuffers,) + self.shape, dtype=self.dtype,
+                                buffer=raw.cMap, offset=off)
+
+
+    ### Returns the number of frames allocated
+    def getBuffers(self):
+        return self.nBuffers
+
+
+    ### Returns the number of frames written
+    def getIdx(self):
+        return int(self.blk[mcRawFile.STM_COUNT])
+
+
+    ### Returns True if every frame has been written
+    def isFull(self):
+        return self.getIdx() >= self.nBuffers
+
+
+    ### Returns the frame shape
+    def getShape(self):
+        return self.shape
+
+
+    ### Returns the video width
+    def getWidth(self):
+        return self.shape[1] if 1 < len(self.shape) else 0
+
+
+    ### Returns the video height
+    def getHeight(self):
+        return self.shape[0]
+
+
+    ### Returns the frame rate
+    def getFps(self):
+        v = int(self.blk[mcRawFile.STM_FPS])
+        return int(v / 1000) if 0 == v % 1000 else v / 1000
+
+
+    ### Returns the number of audio channels
+    def getChannels(self):
+        return int(self.blk[mcRawFile.STM_CH])
+
+
+    ### Returns the audio bits per sample
+    def getBps(self):
+        return int(self.blk[mcRawFile.STM_BPS])
+
+
+    ### Returns the audio bitrate
+    def getBitrate(self):
+        return int(self.blk[mcRawFile.STM_BITRATE])
+
+
+    ### Returns all frames allocated, [frames, ...shape]
+    def getBufs(self):
+        return self.aData
+
+
+    ''' Returns a frame
+        @param [in] n   - Frame number
+    '''
+    def getBuf(self, n):
+        if 0 > n or n >= self.nBuffers:
+            return None
+        return self.aData[n]
+
+
+    ### Returns the index of the frames written, [frames, 8] int64
+    def getIndex(self):
+        return self.aIdx[0:self.getIdx()]
+
+
+    ''' Returns the index entry of a frame, [n, pts, idx, clk, rds, wts, time, 0]
+        @param [in] n   - Frame number
+    '''
+    def getFrameHeader(self, n):
+        return self.aIdx[n]
+
+
+    ''' Get frame info
+        @param [in] n   - Frame number
+        @param [in] fi  - Optional mcFrameInfo record to fill instead of
+                          creating a dict
+
+        @returns Frame info as mcVideo.getFrameInfo(), empty if the frame
+                 hasn't been written
+    '''
+    def getFrameInfo(self, n, fi=None):
+
+        ok = 0 <= n < self.getIdx()
+        if None != fi:
+            return fi.set(n, self.aIdx[n].tolist()) if ok else fi.clear()
+
+        if not ok:
+            return {}
+        fh = self.aIdx[n].tolist()
+        return {'buf': n, 'pts': fh[1], 'idx': fh[2], 'clk': fh[3], 'rds': fh[4], 'wts': fh[5]}
+
+
+    ''' Returns the time a frame was written in ns
+        @param [in] n   - Frame number
+    '''
+    def getTime(self, n):
+        return int(self.aIdx[n, 6])
+
+
+    ''' Returns the last frame at or before a clock value
+        @param [in] clk - Clock in ms, as in the frame info
+
+        @returns Frame number or -1 if every frame is later
+    '''
+    def findFrame(self, clk):
+        return int(np.searchsorted(self.aIdx[0:self.getIdx(), 3], clk, side='right')) - 1
+
+
+    ''' Append a frame
+        @param [in] fr  - Frame, same shape as the stream
+        @param [in] fi  - Frame info from the share, mcFrameInfo or dict
+
+        @returns False if the file is full
+    '''
+    def addFrame(self, fr, fi):
+
+        n = int(self.blk[mcRawFile.STM_COUNT])
+        if n >= self.nBuffers:
+            return False
+
+        np.copyto(self.aData[n], fr)
+        self.aIdx[n] = (n, fi['pts'], fi['idx'], fi['clk'], fi['rds'], fi['wts'], time.time_ns(), 0)
+
+        # Publish after the frame is in place
+        self.blk[mcRawFile.STM_COUNT] = n + 1
+        return True
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import numpy as np
+
+from . mc_event import *
+from . mc_stats import *
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Reader table shared by mcVideo and mcAudio
+
+    A table of slots after the main header where readers publish the
+    next frame they will read.  Writers check it with canWrite() before
+    publishing a frame, so they can block or drop instead of lapping a
+    slow reader, or wait for the readers with waitReaders().
+
+    Each slot holds four int64
+        [0] = Cursor, ring index of the next frame the reader needs
+        [1] = PID of the reader, 0 if the slot is free
+        [2] = Heartbeat, time of the last update in ms
+        [3] = Reserved
+
+    The share must provide getHeader(), getIdx(), getBuffers() and set
+    nRdrOff / nReaders.
+'''
+class mcReaders:
+
+    # Int64 per reader slot
+    RDR_INTS = 4
+
+    # Readers that haven't updated for this long in seconds are ignored
+    RDR_TIMEOUT = 5
+
+
+    ### Returns the number of reader slots
+    def getReaders(self):
+        return self.nReaders
+
+
+    ### Returns the reader table as a (readers, 4) int64 numpy array
+    def getReaderTable(self):
+        if not self.nReaders:
+            return None
+        sz = self.nReaders * mcReaders.RDR_INTS * 8
+        return np.ndarray(shape=(self.nReaders, mcReaders.RDR_INTS), dtype=np.int64,
+                          buffer=self.cShm.buf[self.nRdrOff:self.nRdrOff+sz])
+
+
+    ''' Claim a reader slot
+        @param [in] cursor  - Next frame the reader needs, defaults to the current index
+
+        Slots of processes that no longer exist are reused.  Claims are
+        locked like mcStats.claim(), so two readers never take one slot.
+
+        @returns Slot index or -1 if the table is full
+    '''
+    def registerReader(self, cursor=None):
+
+        t = self.getReaderTable()
+        if t is None:
+            self.sErr = "Share has no reader table"
+            return -1
+
+        pid = os.getpid()
+        sz = self.nReaders * mcReaders.RDR_INTS * 8
+        with mcStats.cClaimLock:
+            fd = mcStats.lockShm(self.cShm, sz, self.nRdrOff)
+            try:
+                for n in range(0, self.nReaders):
+                    if t[n, 1] and mcStats.isAlive(int(t[n, 1])):
+                        continue
+                    t[n, 0] = self.getIdx() if None == cursor else cursor
+                    t[n, 2] = int(time.time() * 1000)
+                    t[n, 1] = pid
+                    return n
+            finally:
+                mcStats.unlockShm(fd, sz, self.nRdrOff)
+
+        self.sErr = "Reader table is full"
+        return -1
+
+
+    ''' Release a reader slot
+        @param [in] n   - Slot from registerReader()
+    '''
+    def releaseReader(self, n):
+        t = self.getReaderTable()
+        if t is not None and 0 <= n < self.nReaders:
+            t[n, :] = 0
+
+
+    ### Returns the address of the low 32 bits of a reader cursor
+    @staticmethod
+    def getCursorAddr(t, n):
+        return t[n].ctypes.data + (4 if 'big' == sys.byteorder else 0)
+
+
+    ''' Publish the position of a reader
+        @param [in] n       - Slot from registerReader()
+        @param [in] cursor  - Next frame the reader needs
+
+        Wakes a writer blocked in waitReaders().
+    '''
+    def setReaderCursor(self, n, cursor):
+        t = self.getReaderTable()
+        if t is not None and 0 <= n < self.nReaders:
+            t[n, 0] = cursor % self.nBuffers
+            t[n, 2] = int(time.time() * 1000)
+            mcEvent.wake(mcReaders.getCursorAddr(t, n))
+
+
+    ''' Block until the slowest live reader moves its cursor
+        @param [in] timeout - Maximum time to wait in seconds, None for no limit
+        @param [in] stale   - Ignore readers without a heartbeat for this long
+
+        Returns straight away if there are no readers.  May return early,
+        the caller should check the readers again.
+    '''
+    def waitReaders(self, timeout=None, stale=RDR_TIMEOUT):
+
+        t = self.getReaderTable()
+        if t is None:
+            return
+
+        live = (0 != t[:, 1]) & ((int(time.time() * 1000) - t[:, 2]) < (stale * 1000))
+        if not live.any():
+            return
+
+        pend = (self.getIdx() - t[:, 0]) % self.nBuffers
+        pend[~live] = -1
+        n = int(pend.argmax())
+
+        mcEvent.wait(mcReaders.getCursorAddr(t, n), int(t[n, 0]), timeout)
+
+
+    ''' Returns the number of frames the slowest live reader has pending
+        @param [in] timeout - Ignore readers without a heartbeat for this long
+
+        @returns Frames pending or -1 if there are no readers
+    '''
+    def getSlowestReader(self, timeout=RDR_TIMEOUT):
+
+        t = self.getReaderTable()
+        if t is None:
+            return -1
+
+        live = (0 != t[:, 1]) & ((int(time.time() * 1000) - t[:, 2]) < (timeout * 1000))
+        if not live.any():
+            return -1
+
+        return int(((self.getIdx() - t[live, 0]) % self.nBuffers).max())
+
+
+    ''' Returns True if publishing the next frame won't lap a reader
+        @param [in] timeout - Ignore readers without a heartbeat for this long
+    '''
+    def canWrite(self, timeout=RDR_TIMEOUT):
+        return self.getSlowestReader(timeout) < self.nBuffers - 1
@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 
+import os
+import math
 import time
 import string
 import random
 import json
+import queue
+import threading
+import collections
+import fractions
 import numpy as np
 import av
 import propertybag as pb
+import threadmsg as tm
 
 from . mc_filter import *
+from . mc_message import *
+from . mc_rawfile import *
+from . mc_yuv import *
 
 try:
     import sparen
@@ -31,12 +41,49 @@ class mcRecord(mcFilter):
         self.avf = pb.Bag()
         self.fname = None
 
+        # Encoder thread
+        self.cEnc = None
+        self.vpool = None
+        self.apool = None
+        self.nQueue = 0
+        self.enc = pb.Bag()
+
+        # Outputs, [(id, fname, opts)], and the ones being written
+        self.outcfg = []
+        self.outs = []
+        self.nOutId = 0
+        self.cOutLock = threading.Lock()
+
+        # Trigger share
+        self.cTrig = None
+
+        # Raw capture
+        self.raw = None
+        self.nRawDrop = 0
+
+        # Time stamp gaps
+        self.pst = pb.Bag()
+
+        # Colour conversion
+        self.yuv = None
+
 
     def __del__(self):
         super().__del__()
         self.close()
 
 
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('cOutLock', None)
+        return state
+
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.cOutLock = threading.Lock()
+
+
     ### Release resources and prepare object for reuse
     def close(self):
 
@@ -46,22 +93,33 @@ class mcRecord(mcFilter):
     ### Closes any open file
     def closeFile(self):
 
+        if self.yuv:
+            self.yuv.close()
+            self.yuv = None
+
+        if self.raw:
+            self.raw.close()
+            self.raw = None
+
         # Close any open file
         if self.avf.file:
 
             # Finalize audio stream
             if self.avf.astream:
-                for pkt in self.avf.astream.encode():
-                    self.avf.file.mux(pkt)
+                self.muxPackets(self.avf.astream.encode())
                 del self.avf.astream
 
             # Finalize video stream
             if self.avf.vstream:
-                for pkt in self.avf.vstream.encode():
-                    self.avf.file.mux(pkt)
+                self.muxPackets(self.avf.vstream.encode())
                 del self.avf.vstream
 
-            # Close file
+            # Close the outputs, they keep their segment and clip lists
+            with self.cOutLock:
+                for o in self.outs:
+                    self.closeOutput(o)
+
+            # Close encoders
             self.avf.file.close()
             del self.avf.file
 
@@ -69,7 +127,7 @@ class mcRecord(mcFilter):
 
 
     ''' Creates the shared memory buffer
-        @param [in] fname   - File name
+        @param [in] fname   - File name, may be None if outputs are given
         @param [in] opts    - Options
                                 video   : The name of the video share
                                 audio   : The name of the audio share
@@ -77,35 +135,148 @@ class mcRecord(mcFilter):
                                 pixfmt  : Pixel format, default "yuv420p"
                                 atype   : Audio encoding, default "aac"
                                 alayout : Audio layout, defualt [1:'mono', 2:'stereo', ...:'multi']
+                                bitrate : Video bit rate, default w * h * 2 unless crf is set
+                                crf     : Constant rate factor, quality based rate control
+                                preset  : Encoder preset, e.g. 'veryfast'
+                                tune    : Encoder tuning, e.g. 'zerolatency'
+                                gop     : Frames between keyframes
+                                threads : Encoder threads, 0 for automatic
+                                thread_type : 'frame', 'slice' or 'auto'
+                                copts   : Dict of further codec options passed to the encoder
+                                          See benchmark() to compare settings on a machine.
+                                convert : Threads converting rgb24 frames to yuv420p before the
+                                          encoder, instead of swscale in the encoder.  0 [default]
+                                          leaves it to the encoder.  Frame size must be even.
+                                          See mcYuv.benchmark() to compare on a machine.
+                                queue   : Frames per stream buffered for an encoder thread.
+                                          Frames are copied into a preallocated pool and
+                                          encoded on a separate thread, so encoder spikes
+                                          don't hold up the share.  0 [default] encodes
+                                          on the filter thread.
+                                overflow: What to do when the queue is full
+                                            block = [default] Wait for the encoder
+                                            drop  = Skip the frame, see getQueueStats()
+                                outputs : List of further outputs, each a dict with fname
+                                          and the output options below.  Every output is
+                                          muxed from the same encoded packets, see addOutput()
+                                pts     : Where the time stamps in the file come from
+                                            count = [default] Every frame is one frame
+                                                    after the last one
+                                            idx   = The frame index in the share header
+                                            clk   = The clock in the share header, snapped
+                                                    to the frame rate.  Keeps audio and
+                                                    video in step when frames are dropped.
+                                gaps    : What to do with frames missing from idx / clk
+                                            skip = [default] Leave a gap in the time stamps
+                                            dup  = Repeat the last video frame, silence for
+                                                   audio, up to maxdup seconds
+                                maxdup  : Longest gap in seconds filled by gaps='dup', default 1
+                                          Frames that arrive with a time stamp before the
+                                          last are dropped, see getPtsStats()
+                                raw     : True to copy frames into a preallocated memory
+                                          mapped file instead of encoding, see mcRawFile.
+                                          Encoder and output options are ignored.
+                                rawsecs : Seconds of media to allocate for raw capture,
+                                          default 10.  Frames past the end are dropped,
+                                          see getRawDropped()
+
+                              Output options, for fname these are taken from opts
+                                segment : Start a new file every this many seconds of media.
+                                          The encoder keeps running across files, so no
+                                          frames are lost.  fname may hold a %d for the
+                                          segment number, otherwise _00000 is added before
+                                          the extension.  Use .ts for HLS.
+                                segkeys : Cut at the first keyframe after segment seconds
+                                          instead of forcing a keyframe, see gop
+                                keep    : Segments to keep on disk, older ones are deleted
+                                maxbytes: Total bytes of segments to keep on disk
+                                playlist: File name of an HLS playlist to keep up to date
+                                preroll : Keep this many seconds of encoded packets in memory
+                                          instead of writing a file.  trigger() writes them
+                                          out as a clip, named like segments, followed by
+                                          postroll seconds.  The ring starts at a keyframe,
+                                          so it holds up to one GOP more, see gop.  Can't
+                                          be combined with segment.
+                                postroll: Seconds recorded after a trigger, default 0
+                                trigger : Name of an mcMessage share, a 'trigger' message,
+                                          or {"cmd": "trigger", "fname": ...} starts a clip
     '''
     def create(self, fname, opts={}):
 
         self.close()
 
         self.fname = fname
+        self.outcfg = []
+
+        # The outputs open on the filter thread, check them here
+        cfg = pb.Bag(self.iopts)
+        cfg.merge(opts)
+        for o in [cfg] + [pb.Bag(v) for v in (cfg.get('outputs', None) or [])]:
+            if not self.checkOutput(o):
+                return False
 
         return super().create(opts=opts)
 
 
+    ### Returns the output list from the options, the primary output first
+    def getOutputConfig(self):
+
+        cfg = []
+        if self.fname:
+            cfg.append((0, self.fname, self.opts))
+        for n, o in enumerate(self.opts.get('outputs', None) or []):
+            o = pb.Bag(o)
+            cfg.append((n + 1, o.get('fname', None), o))
+        return cfg
+
+
     ### Creates video file
     def createFile(self):
 
         self.closeFile()
 
-        if not self.fname:
+        if self.opts.get('raw', False):
+            return self.createRaw()
+
+        if not self.outcfg:
+            self.outcfg = self.getOutputConfig()
+            self.nOutId = max([c[0] for c in self.outcfg] + [0]) + 1
+
+        if not self.outcfg:
             self.sErr = f"File name not specified"
             self.close()
             return False
 
-        # Attempt to create a video writer
-        self.avf.file = av.open(file=self.fname, format=None, mode="w", options={})
+        # Encoders aren't tied to a file, each output gets streams copied from them
+        self.avf.file = av.open(file=os.devnull, format='null', mode="w")
         if not self.avf.file:
-            self.sErr = f"Failed to create file : {self.fname}"
+            self.sErr = f"Failed to create encoders : {self.fname}"
             self.close()
             return False
 
         self.avf.vpts = 0
         self.avf.apts = 0
+        self.avf.tlast = 0
+        self.avf.forcekey = False
+
+        # Time stamps from the frame headers
+        self.avf.ptsmode = self.opts.get('pts', 'count')
+        if self.avf.ptsmode not in ('count', 'idx', 'clk'):
+            self.sErr = f"Invalid pts mode : {self.avf.ptsmode}"
+            self.close()
+            return False
+        self.avf.gaps = self.opts.get('gaps', 'skip')
+        if self.avf.gaps not in ('skip', 'dup'):
+            self.sErr = f"Invalid gap policy : {self.avf.gaps}"
+            self.close()
+            return False
+        self.avf.maxdup = float(self.opts.get('maxdup', 1))
+        self.avf.vidx0 = None
+        self.avf.aidx0 = None
+        self.avf.clk0 = None
+        self.avf.vlast = None
+        self.avf.silence = None
+        self.pst = pb.Bag({'late': 0, 'gaps': 0, 'dups': 0, 'skipped': 0})
 
         if self.ashare:
 
@@ -149,15 +320,17 @@ class mcRecord(mcFilter):
                     return False
 
             # Add audio stream
-            self.avf.astream = self.avf.file.add_stream(self.opts.atype, rate=brate, layout=self.opts.alayout)
+            self.avf.astream = self.avf.file.add_stream(self.opts.atype, rate=int(brate), layout=self.opts.alayout)
             if not self.avf.astream:
                 self.sErr = f"Failed to create audio stream : {self.fname}"
                 self.close()
                 return False
 
+            self.avf.astream.codec_context.flags |= av.codec.context.Flags.global_header
+
             self.avf.afps = afps
             self.avf.asr = brate
-            self.avf.time_base = "1/" + str(brate)
+            self.avf.time_base = fractions.Fraction(1, brate)
 
             # Number of audio samples per interval
             self.avf.isamples = int(brate / afps)
@@ -176,7 +349,6 @@ class mcRecord(mcFilter):
             w = self.vshare.getWidth()
             h = self.vshare.getHeight()
             vfps = self.vshare.getFps()
-            brate = int(w * h * 2)
 
             # Adjust for roi
             if 'roi' in self.opts:
@@ -207,21 +379,973 @@ class mcRecord(mcFilter):
                 self.close()
                 return False
 
-            self.avf.vstream.pix_fmt = self.opts.pixfmt
-            self.avf.vstream.width = w
-            self.avf.vstream.height = h
-            self.avf.vstream.bit_rate = brate
-            self.avf.vstream.bit_rate_tolerance = int(brate)
-            self.avf.vstream.time_base = "1/" + str(vfps)
-            # self.avf.vstream.thread_type = 'AUTO'
+            self.avf.vstream.time_base = fractions.Fraction(1, int(vfps))
+            self.avf.vfps = vfps
+            try:
+                mcRecord.setEncoderOpts(self.avf.vstream.codec_context, self.opts, w, h, vfps)
+            except Exception as e:
+                self.sErr = f"Invalid encoder options : {e}"
+                self.close()
+                return False
 
+            # Colour conversion on a thread pool
+            if int(self.opts.get('convert', 0) or 0):
+                if 'rgb24' != self.opts.pixbuf or 'yuv420p' != self.opts.pixfmt:
+                    self.sErr = f"Conversion needs rgb24 to yuv420p : {self.opts.pixbuf} to {self.opts.pixfmt}"
+                    self.close()
+                    return False
+                try:
+                    self.yuv = mcYuv(w, h, workers=int(self.opts.convert))
+                except Exception as e:
+                    self.sErr = f"Invalid conversion : {e}"
+                    self.close()
+                    return False
+
+            # Codec headers go in the stream so outputs can copy them
+            cc = self.avf.vstream.codec_context
+            cc.flags |= av.codec.context.Flags.global_header
+
+            # Forced keyframes must be IDR frames for a clean cut
+            if 'libx264' == self.opts.vtype:
+                cc.options = dict(cc.options, **{'forced-idr': '1'})
+
+        # Open the encoders
+        try:
+            self.avf.file.start_encoding()
+        except Exception as e:
+            self.sErr = f"Failed to open encoders : {e}"
+            self.close()
+            return False
+
+        # close() takes the lock, so fail after releasing it
+        ok = True
+        with self.cOutLock:
+            self.outs = []
+            for n, fname, opts in self.outcfg:
+                o = self.openOutput(n, fname, opts)
+                if not o:
+                    ok = False
+                    break
+                self.outs.append(o)
+
+        if not ok:
+            self.close()
+            return False
+
+        return True
+
+
+    ### Creates the raw capture file
+    def createRaw(self):
+
+        if not self.fname:
+            self.sErr = f"File name not specified"
+            self.close()
+            return False
+
+        secs = float(self.opts.get('rawsecs', 10) or 0)
+        if 0 >= secs:
+            self.sErr = f"Invalid raw capture length : {secs}"
+            self.close()
+            return False
+
+        video = None
+        if self.vshare:
+            fps = self.vshare.getFps()
+            video = {'frames': int(math.ceil(secs * fps)), 'shape': self.vfrs[0].shape,
+                     'dtype': self.vfrs[0].dtype, 'fps': fps}
+
+        audio = None
+        if self.ashare:
+            fps = self.ashare.getFps()
+            audio = {'frames': int(math.ceil(secs * fps)), 'shape': self.afrs[0].shape,
+                     'dtype': self.afrs[0].dtype, 'fps': fps, 'ch': self.ashare.getChannels(),
+                     'bps': self.ashare.getBps(), 'bitrate': self.ashare.getBitrate()}
+
+        raw = mcRawFile()
+        if not raw.create(self.fname, video, audio):
+            self.sErr = raw.getError()
+            self.close()
+            return False
+
+        self.raw = raw
+        self.nRawDrop = 0
         return True
 
 
+    ### Returns the number of frames dropped because the raw file was full
+    def getRawDropped(self):
+        return self.nRawDrop
+
+
+    ''' Append a frame to the raw capture file
+        @param [in] view    - Stream of the raw file
+        @param [in] fr      - Frame from the share
+        @param [in] fi      - Frame info
+    '''
+    def writeRaw(self, view, fr, fi):
+
+        if not view or not fi:
+            return False
+
+        if not view.addFrame(fr, fi):
+            self.nRawDrop += 1
+            if 1 == self.nRawDrop and self.on_error_callback:
+                self.on_error_callback(self, f"Raw file is full : {self.fname}")
+            return False
+
+        return True
+
+
+    ''' Add an output, may be called while recording
+        @param [in] fname   - File name
+        @param [in] opts    - Output options, see create()
+
+        An output added while recording starts on a forced keyframe.
+
+        @returns Output id or -1 on error
+    '''
+    def addOutput(self, fname, opts={}):
+
+        if not fname:
+            self.sErr = f"File name not specified"
+            return -1
+
+        opts = pb.Bag(opts)
+        if not self.checkOutput(opts):
+            return -1
+
+        with self.cOutLock:
+
+            if not self.outcfg:
+                self.outcfg = self.getOutputConfig()
+                self.nOutId = max([c[0] for c in self.outcfg] + [0]) + 1
+
+            n = self.nOutId
+            if self.avf.file:
+                o = self.openOutput(n, fname, opts)
+                if not o:
+                    return -1
+                self.outs.append(o)
+                self.avf.forcekey = True
+
+            self.outcfg.append((n, fname, opts))
+            self.nOutId += 1
+
+        return n
+
+
+    ''' Close an output and stop writing to it, the others carry on
+        @param [in] n   - Output id, 0 is the fname given to create()
+    '''
+    def removeOutput(self, n):
+
+        with self.cOutLock:
+
+            cfg = [c for c in self.outcfg if n == c[0]]
+            if not cfg:
+                self.sErr = f"Invalid output : {n}"
+                return False
+            self.outcfg.remove(cfg[0])
+
+            for o in [o for o in self.outs if n == o.id]:
+                self.outs.remove(o)
+                self.closeOutput(o)
+
+        return True
+
+
+    ### Returns the outputs, [{'id', 'fname', 'mode', 'open', 'segments', 'clips'}]
+    def getOutputs(self):
+
+        with self.cOutLock:
+            outs = {o.id: o for o in self.outs}
+            r = []
+            for n, fname, _ in self.outcfg:
+                o = outs.get(n, None)
+                r.append({'id': n, 'fname': fname, 'mode': o.mode if o else None, 'open': bool(o and not o.closed),
+                          'segments': [dict(sg) for sg in o.segs] if o else [],
+                          'clips': [dict(c) for c in o.clips] if o else []})
+        return r
+
+
+    ''' Returns an output by id
+        @param [in] n   - Output id
+
+        The caller must hold cOutLock, the encoder thread changes the outputs.
+    '''
+    def getOutput(self, n):
+        for o in self.outs:
+            if n == o.id:
+                return o
+        return None
+
+
+    ''' Check the options of an output
+        @param [in] opts    - Output options, see create()
+
+        @returns True if the options can be used together
+    '''
+    def checkOutput(self, opts):
+
+        if float(opts.get('segment', 0) or 0) and float(opts.get('preroll', 0) or 0):
+            self.sErr = f"segment and preroll can't be combined"
+            return False
+
+        return True
+
+
+    ''' Create the state of an output and open its file
+        @param [in] n       - Output id
+        @param [in] fname   - File name
+        @param [in] opts    - Output options, see create()
+
+        @returns Output or None on error
+    '''
+    def openOutput(self, n, fname, opts):
+
+        if not fname:
+            self.sErr = f"File name not specified for output {n}"
+            return None
+
+        if not self.checkOutput(opts):
+            self.sErr = f"Output {n} : {self.sErr}"
+            return None
+
+        segment = float(opts.get('segment', 0) or 0)
+        preroll = float(opts.get('preroll', 0) or 0)
+
+        o = pb.Bag({'id': n, 'fname': fname, 'mode': 'segment' if segment else 'preroll' if preroll else 'file',
+                    'segment': segment, 'segkeys': bool(opts.get('segkeys', False)),
+                    'keep': int(opts.get('keep', 0) or 0), 'maxbytes': int(opts.get('maxbytes', 0) or 0),
+                    'playlist': opts.get('playlist', None), 'preroll': preroll,
+                    'postroll': float(opts.get('postroll', 0) or 0),
+                    'out': None, 'seg': None, 'segs': [], 'nextkey': None,
+                    'ring': None, 'kts': None, 'clip': None, 'clips': [], 'trig': None,
+                    'wait': True, 'closed': False})
+
+        if segment:
+            o.nextkey = self.avf.tlast + segment
+
+        elif preroll:
+            o.ring = collections.deque()
+            o.kts = collections.deque()
+
+        else:
+            o.out = self.openContainer(fname)
+            if not o.out:
+                return None
+
+        return o
+
+
+    ''' Close an output
+        @param [in] o   - Output
+    '''
+    def closeOutput(self, o):
+
+        if o.closed:
+            return
+        o.closed = True
+
+        t = self.avf.tlast
+
+        # Last segment
+        if o.seg:
+            self.closeSegment(o, t)
+            self.writePlaylist(o, True)
+
+        # Clip still in its post-roll
+        if o.clip:
+            self.closeClip(o, t)
+
+        if o.out:
+            o.out.file.close()
+            o.out = None
+
+        o.ring = None
+        o.kts = None
+
+
+    ''' Open a file with streams copied from the encoders
+        @param [in] name    - File name
+
+        @returns Bag with file, vstream and astream or None on error
+    '''
+    def openContainer(self, name):
+
+        try:
+            f = av.open(file=name, mode="w")
+            c = pb.Bag({'file': f, 'vstream': None, 'astream': None})
+            if self.avf.vstream:
+                c.vstream = f.add_stream_from_template(self.avf.vstream)
+            if self.avf.astream:
+                c.astream = f.add_stream_from_template(self.avf.astream)
+        except Exception as e:
+            self.sErr = f"Failed to create file : {name} : {e}"
+            return None
+
+        return c
+
+
+    ''' Returns the file name of a segment
+        @param [in] n       - Segment number
+        @param [in] fname   - Output file name, defaults to the create() fname
+    '''
+    def getSegmentName(self, n, fname=None):
+        fname = fname if fname else self.fname
+        if '%' in fname:
+            return fname % n
+        root, ext = os.path.splitext(fname)
+        return f'{root}_{n:05d}{ext}'
+
+
+    ''' Returns the closed segments still on disk, [{'n', 'name', 'start', 'dur', 'size'}]
+        @param [in] n   - Output id, 0 is the fname given to create()
+    '''
+    def getSegments(self, n=0):
+        with self.cOutLock:
+            o = self.getOutput(n)
+            return [dict(sg) for sg in o.segs] if o else []
+
+
+    ''' Open a segment file with streams copied from the encoders
+        @param [in] o   - Output
+        @param [in] n   - Segment number
+        @param [in] t   - Media time of the first frame in seconds
+    '''
+    def openSegment(self, o, n, t):
+
+        name = self.getSegmentName(n, o.fname)
+        c = self.openContainer(name)
+        if not c:
+            self.sErr = f"Failed to create segment : {name} : {self.sErr}"
+            return False
+
+        c.n = n
+        c.name = name
+        c.start = t
+        o.seg = c
+        o.segend = t + o.segment
+        return True
+
+
+    ''' Close the current segment and apply the retention policy
+        @param [in] o   - Output
+        @param [in] t   - Media time the segment ends
+    '''
+    def closeSegment(self, o, t):
+
+        seg = o.seg
+        if not seg:
+            return
+        o.seg = None
+
+        seg.file.close()
+        o.segs.append({'n': seg.n, 'name': seg.name, 'start': seg.start, 'dur': max(0, t - seg.start),
+                       'size': os.path.getsize(seg.name) if os.path.exists(seg.name) else 0})
+
+        # Oldest first
+        while o.segs and ((o.keep and len(o.segs) > o.keep) or
+                          (o.maxbytes and sum(sg['size'] for sg in o.segs) > o.maxbytes)):
+            old = o.segs.pop(0)
+            try:
+                os.remove(old['name'])
+            except Exception as e:
+                if self.on_error_callback:
+                    self.on_error_callback(self, f"Failed to remove segment : {old['name']} : {e}")
+
+
+    ''' Rewrite the HLS playlist with the segments on disk
+        @param [in] o   - Output
+        @param [in] end - True if the recording is finished
+    '''
+    def writePlaylist(self, o, end=False):
+
+        pl = o.playlist
+        if not pl:
+            return
+
+        d = os.path.dirname(os.path.abspath(pl))
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3',
+                 f"#EXT-X-TARGETDURATION:{int(math.ceil(max([sg['dur'] for sg in o.segs] + [o.segment])))}",
+                 f"#EXT-X-MEDIA-SEQUENCE:{o.segs[0]['n'] if o.segs else 0}"]
+        for sg in o.segs:
+            lines.append(f"#EXTINF:{sg['dur']:.3f},")
+            lines.append(os.path.relpath(os.path.abspath(sg['name']), d))
+        if end:
+            lines.append('#EXT-X-ENDLIST')
+
+        tmp = pl + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, pl)
+
+
+    ''' Write a clip of the pre-roll ring followed by the post-roll
+        @param [in] fname   - File name, defaults to the next name from the output fname
+        @param [in] n       - Output id, None for every pre-roll output
+
+        May be called from any thread, the clip starts with the next packet.
+        A trigger during the post-roll extends the clip.
+    '''
+    def trigger(self, fname=None, n=None):
+        hit = False
+        with self.cOutLock:
+            for o in self.outs:
+                if o.preroll and (None == n or n == o.id):
+                    o.trig = fname if fname else ''
+                    hit = True
+        return hit
+
+
+    ''' Returns the clips written, [{'n', 'name', 'start', 'dur'}]
+        @param [in] n   - Output id, 0 is the fname given to create()
+    '''
+    def getClips(self, n=0):
+        with self.cOutLock:
+            o = self.getOutput(n)
+            return [dict(c) for c in o.clips] if o else []
+
+
+    ### Check the trigger share for messages
+    def pollTrigger(self):
+
+        if not self.cTrig:
+            return
+
+        while True:
+            msg = self.cTrig.read()
+            if not msg:
+                break
+            if 'trigger' == msg.strip():
+                self.trigger()
+                continue
+            try:
+                m = json.loads(msg)
+                if 'trigger' == m.get('cmd', None):
+                    self.trigger(m.get('fname', None), m.get('output', None))
+            except Exception as e:
+                if self.on_error_callback:
+                    self.on_error_callback(self, f"Invalid trigger message : {msg}")
+
+
+    ''' Open a clip file and write the pre-roll ring into it
+        @param [in] o       - Output
+        @param [in] fname   - File name, empty for the next clip name
+        @param [in] t       - Media time of the trigger
+    '''
+    def openClip(self, o, fname, t):
+
+        n = len(o.clips)
+        name = fname if fname else self.getSegmentName(n, o.fname)
+        clip = self.openContainer(name)
+        if not clip:
+            self.sErr = f"Failed to create clip : {name} : {self.sErr}"
+            return False
+
+        clip.n = n
+        clip.name = name
+        clip.start = o.ring[0][0] if o.ring else t
+        o.clip = clip
+        for _, _, pkt in o.ring:
+            pkt.stream = clip.vstream if 'video' == pkt.stream.type else clip.astream
+            clip.file.mux(pkt)
+
+        return True
+
+
+    ''' Close the current clip
+        @param [in] o   - Output
+        @param [in] t   - Media time the clip ends
+    '''
+    def closeClip(self, o, t):
+
+        clip = o.clip
+        if not clip:
+            return
+        o.clip = None
+
+        clip.file.close()
+        o.clips.append({'n': clip.n, 'name': clip.name, 'start': clip.start, 'dur': max(0, t - clip.start)})
+
+
+    ''' Add a packet to the pre-roll ring and any clip being written
+        @param [in] o       - Output
+        @param [in] pkt     - Encoded packet
+        @param [in] video   - True for a video packet
+        @param [in] t       - Media time of the packet
+        @param [in] cut     - True if a file may start at the packet
+    '''
+    def bufferPacket(self, o, pkt, video, t, cut):
+
+        ring = o.ring
+        keys = o.kts
+
+        # Clips start on a keyframe
+        ring.append((t, cut, pkt))
+        if cut:
+            keys.append(t)
+
+        # Drop whole GOPs that are older than the pre-roll
+        lim = t - o.preroll
+        while 2 <= len(keys) and keys[1] <= lim:
+            keys.popleft()
+            while ring and not ring[0][1]:
+                ring.popleft()
+            ring.popleft()
+            while ring and not ring[0][1]:
+                ring.popleft()
+
+        clip = o.clip
+        trig = o.trig
+        if None != trig:
+            o.trig = None
+            if clip:
+                clip.until = t + o.postroll
+            elif self.openClip(o, trig, t):
+                o.clip.until = t + o.postroll
+                if t >= o.clip.until:
+                    self.closeClip(o, t)
+                return
+            elif self.on_error_callback:
+                self.on_error_callback(self, self.sErr)
+
+        if clip:
+            pkt.stream = clip.vstream if video else clip.astream
+            clip.file.mux(pkt)
+            if t >= clip.until:
+                self.closeClip(o, t)
+
+
+    ''' Write a packet to an output
+        @param [in] o       - Output
+        @param [in] pkt     - Encoded packet
+        @param [in] video   - True for a video packet
+        @param [in] t       - Media time of the packet
+        @param [in] cut     - True if a file may start at the packet
+
+        In segment mode a new file is started at the first video keyframe
+        past the end of the segment, or any packet for audio only.
+    '''
+    def writeOutput(self, o, pkt, video, t, cut):
+
+        # Outputs start on a keyframe
+        if o.wait:
+            if not cut:
+                return
+            o.wait = False
+
+        if o.preroll:
+            self.bufferPacket(o, pkt, video, t, cut)
+            return
+
+        if o.segment:
+            if not o.seg or (cut and t >= o.segend):
+                n = o.seg.n + 1 if o.seg else 0
+                self.closeSegment(o, t)
+                if not self.openSegment(o, n, t):
+                    raise Exception(self.sErr)
+                self.writePlaylist(o)
+            out = o.seg
+        else:
+            out = o.out
+
+        pkt.stream = out.vstream if video else out.astream
+        out.file.mux(pkt)
+
+
+    ''' Write encoded packets to every output
+        @param [in] pkts    - Packets from the encoders
+
+        Muxing rescales the packet time stamps in place but leaves the data
+        alone, so the same packet is handed to each output in turn.  An
+        output that fails is closed and dropped, the others carry on.
+    '''
+    def muxPackets(self, pkts):
+
+        for pkt in pkts:
+
+            video = 'video' == pkt.stream.type
+
+            # Every audio packet is a keyframe
+            cut = None != pkt.pts and (pkt.is_keyframe if video else not self.avf.vstream)
+            t = float(pkt.pts * pkt.time_base) if None != pkt.pts else self.avf.tlast
+            if None != pkt.pts:
+                self.avf.tlast = max(self.avf.tlast, float((pkt.pts + (pkt.duration or (1 if video else 0))) * pkt.time_base))
+
+            with self.cOutLock:
+                for o in list(self.outs):
+                    if o.closed:
+                        continue
+                    try:
+                        self.writeOutput(o, pkt, video, t, cut)
+                    except Exception as e:
+                        self.sErr = f"Output failed : {o.fname} : {e}"
+                        self.closeOutput(o)
+                        if self.on_error_callback:
+                            self.on_error_callback(self, self.sErr)
+
+    ''' Apply the encoder options to a video codec context
+        @param [in] cc      - Codec context, not yet opened
+        @param [in] opts    - Options, see create()
+        @param [in] w       - Frame width
+        @param [in] h       - Frame height
+        @param [in] fps     - Frame rate
+    '''
+    @staticmethod
+    def setEncoderOpts(cc, opts, w, h, fps):
+
+        cc.pix_fmt = opts.get('pixfmt', None) or 'yuv420p'
+        cc.width = int(w)
+        cc.height = int(h)
+        cc.time_base = fractions.Fraction(1, int(fps))
+
+        # Constant quality unless a bit rate is asked for
+        brate = opts.get('bitrate', None)
+        if None == brate and None == opts.get('crf', None):
+            brate = int(w * h * 2)
+        if brate:
+            cc.bit_rate = int(brate)
+            cc.bit_rate_tolerance = int(brate)
+
+        if None != opts.get('gop', None):
+            cc.gop_size = int(opts.gop)
+        if None != opts.get('threads', None):
+            cc.thread_count = int(opts.threads)
+        if opts.get('thread_type', None):
+            cc.thread_type = str(opts.thread_type).upper()
+
+        # Private codec options, e.g. x264 preset / tune / crf
+        copts = {}
+        for k in ('preset', 'tune', 'crf'):
+            if None != opts.get(k, None):
+                copts[k] = str(opts.get(k))
+        copts.update({k: str(v) for k, v in dict(opts.get('copts', None) or {}).items()})
+        if copts:
+            cc.options = copts
+
+
+    ''' Measure the encode rate of encoder configurations on this machine
+        @param [in] configs - List of option dicts, see create(), each may set vtype
+        @param [in] width   - Frame width
+        @param [in] height  - Frame height
+        @param [in] fps     - Frame rate given to the encoder
+        @param [in] frames  - Frames to encode per configuration
+
+        Frames are converted to the encoder pixel format up front, so only
+        the encoder is timed.
+
+        @returns List of {'opts', 'fps', 'error'}
+    '''
+    @staticmethod
+    def benchmark(configs=None, width=1280, height=720, fps=30, frames=120):
+
+        if not configs:
+            configs = [{'preset': 'ultrafast'},
+                       {'preset': 'veryfast'},
+                       {'preset': 'veryfast', 'thread_type': 'slice'},
+                       {'preset': 'veryfast', 'threads': 1},
+                       {'preset': 'medium'}]
+
+        # Moving gradient so the encoder has some work
+        x = np.arange(width, dtype=np.uint16)[None, :] + np.arange(height, dtype=np.uint16)[:, None]
+        src = []
+        for k in range(0, 8):
+            arr = np.repeat((((x + (k * 8)) % 256).astype(np.uint8))[:, :, None], 3, axis=2)
+            src.append(av.VideoFrame.from_ndarray(arr, format='rgb24'))
+
+        r = []
+        for cfg in configs:
+            o = pb.Bag(cfg)
+            res = {'opts': cfg, 'fps': 0, 'error': None}
+            try:
+                cc = av.CodecContext.create(o.get('vtype', None) or 'libx264', 'w')
+                mcRecord.setEncoderOpts(cc, o, width, height, fps)
+                fs = [f.reformat(format=cc.pix_fmt) for f in src]
+
+                t = time.perf_counter()
+                for i in range(0, frames):
+                    f = fs[i % len(fs)]
+                    f.pts = i
+                    cc.encode(f)
+                cc.encode(None)
+                res['fps'] = frames / (time.perf_counter() - t)
+
+            except Exception as e:
+                res['error'] = str(e)
+
+            r.append(res)
+
+        return r
+
+
+    ### Start the encoder thread and allocate the frame pools
+    def openEncoder(self):
+
+        self.nQueue = int(self.opts.get('queue', 0))
+        self.enc = pb.Bag({'queued': 0, 'qmax': 0, 'dropped': 0, 'encoded': 0, 'etime': 0.0, 'emax': 0.0})
+        if 0 >= self.nQueue or self.raw:
+            return True
+
+        if self.opts.get('overflow', 'block') not in ('block', 'drop'):
+            self.sErr = f"Invalid overflow policy : {self.opts.overflow}"
+            return False
+
+        def pool(frs):
+            q = queue.Queue()
+            for i in range(0, self.nQueue):
+                q.put(np.empty(frs[0].shape, dtype=frs[0].dtype))
+            return q
+
+        self.vpool = pool(self.vfrs) if self.avf.vstream else None
+        self.apool = pool(self.afrs) if self.avf.astream else None
+
+        self.cEnc = tm.ThreadMsg(self.encoderThread, start=False)
+        self.cEnc.start()
+
+        return True
+
+
+    ### Encode what is queued and stop the encoder thread
+    def closeEncoder(self):
+
+        if self.cEnc:
+            self.cEnc.join(True)
+            self.cEnc = None
+
+        self.vpool = None
+        self.apool = None
+
+
+    ''' Returns the encoder queue statistics
+                    depth   - Frames waiting for the encoder
+                    qmax    - Largest depth seen
+                    queued  - Frames queued
+                    dropped - Frames skipped because the queue was full
+                    encoded - Frames encoded by the encoder thread
+                    etime   - Average encode time in seconds
+                    emax    - Longest encode time in seconds
+    '''
+    def getQueueStats(self):
+        e = self.enc
+        return {'depth': self.getQueueDepth(), 'qmax': e.get('qmax', 0), 'queued': e.get('queued', 0),
+                'dropped': e.get('dropped', 0), 'encoded': e.get('encoded', 0),
+                'etime': e.etime / e.encoded if e.get('encoded', 0) else 0, 'emax': e.get('emax', 0)}
+
+
+    ### Returns the number of frames waiting for the encoder
+    def getQueueDepth(self):
+        d = 0
+        for p in (self.vpool, self.apool):
+            if p:
+                d += self.nQueue - p.qsize()
+        return d
+
+
+    ''' Copy a frame into the pool and queue it for the encoder thread
+        @param [in] kind    - 'v' or 'a'
+        @param [in] fr      - Frame from the share
+        @param [in] idx     - Frame index from the header
+        @param [in] clk     - Clock from the header
+
+        @returns True if the frame was queued
+    '''
+    def queueFrame(self, kind, fr, idx=None, clk=None):
+
+        pool = self.vpool if 'v' == kind else self.apool
+        if not pool:
+            return False
+
+        # Wait for a free buffer while the encoder is running
+        buf = None
+        block = 'block' == self.opts.get('overflow', 'block')
+        while None is buf:
+            try:
+                buf = pool.get(block=block, timeout=0.1 if block else None)
+            except queue.Empty:
+                if not block or not self.cEnc or not self.cEnc.thread.is_alive():
+                    self.enc.dropped += 1
+                    return False
+
+        np.copyto(buf, fr)
+        self.cEnc.addMsg((kind, buf, idx, clk))
+
+        self.enc.queued += 1
+        d = self.getQueueDepth()
+        if d > self.enc.qmax:
+            self.enc.qmax = d
+
+        return True
+
+
+    ### Encoder thread, returns the pool buffers once the frames are written
+    def encoderThread(self, ctx):
+
+        while True:
+            msg = ctx.getMsgData()
+            if None == msg:
+                break
+
+            kind, buf, idx, clk = msg
+            t = time.perf_counter()
+            try:
+                if 'v' == kind:
+                    self.writeVideoFrame(buf, idx, clk)
+                else:
+                    self.writeAudioFrame(buf, idx, clk)
+            except Exception as e:
+                if self.on_error_callback:
+                    self.on_error_callback(self, e)
+            finally:
+                (self.vpool if 'v' == kind else self.apool).put(buf)
+
+            t = time.perf_counter() - t
+            self.enc.encoded += 1
+            self.enc.etime += t
+            if t > self.enc.emax:
+                self.enc.emax = t
+
+        # Wait for the next frame
+        return None
+
+
+    ### Returns the time stamp statistics, {'late', 'gaps', 'dups', 'skipped'}
+    def getPtsStats(self):
+        return {k: self.pst.get(k, 0) for k in ('late', 'gaps', 'dups', 'skipped')}
+
+
+    ''' Returns the time stamp of a frame from its header
+        @param [in] kind    - 'v' or 'a'
+        @param [in] idx     - Frame index from the header
+        @param [in] clk     - Clock from the header in ms
+
+        @returns Time stamp in the stream time base, None to count frames
+    '''
+    def calcPts(self, kind, idx, clk):
+
+        video = 'v' == kind
+        step = 1 if video else self.avf.isamples
+
+        if 'idx' == self.avf.ptsmode and None != idx:
+            if video:
+                if None == self.avf.vidx0:
+                    self.avf.vidx0 = idx
+                return (idx - self.avf.vidx0) * step
+            if None == self.avf.aidx0:
+                self.avf.aidx0 = idx
+            return (idx - self.avf.aidx0) * step
+
+        # One clock for both streams keeps them in step
+        if 'clk' == self.avf.ptsmode and None != clk:
+            if None == self.avf.clk0:
+                self.avf.clk0 = clk
+            fps = self.avf.vfps if video else self.avf.afps
+            return int(round((clk - self.avf.clk0) * fps / 1000)) * step
+
+        return None
+
+
+    ''' Fill the frames missing before a time stamp
+        @param [in] kind    - 'v' or 'a'
+        @param [in] pts     - Time stamp of the frame that arrived
+    '''
+    def fillGap(self, kind, pts):
+
+        video = 'v' == kind
+        step = 1 if video else self.avf.isamples
+        nxt = self.avf.vpts if video else self.avf.apts
+        miss = int((pts - nxt) / step)
+
+        self.pst.gaps += 1
+        dup = 0
+        if 'dup' == self.avf.gaps:
+            dup = min(miss, int(self.avf.maxdup * (self.avf.vfps if video else self.avf.afps)))
+
+        if video:
+            if not self.avf.vlast:
+                dup = 0
+            for k in range(0, dup):
+                self.encodeVideo(self.avf.vlast, nxt + k)
+        else:
+            if dup and None == self.avf.silence:
+                self.avf.silence = av.AudioFrame.from_ndarray(np.zeros_like(self.afrs[0]), self.opts.audbuf,
+                                                              layout=self.opts.alayout)
+            for k in range(0, dup):
+                self.encodeAudio(self.avf.silence, nxt + k * step)
+
+        self.pst.dups += dup
+        self.pst.skipped += miss - dup
+
+
+    ''' Returns the time stamp to write a frame at, None to drop it
+        @param [in] kind    - 'v' or 'a'
+        @param [in] idx     - Frame index from the header
+        @param [in] clk     - Clock from the header
+    '''
+    def nextPts(self, kind, idx, clk):
+
+        nxt = self.avf.vpts if 'v' == kind else self.avf.apts
+        pts = self.calcPts(kind, idx, clk)
+        if None == pts:
+            return nxt
+
+        if pts < nxt:
+            self.pst.late += 1
+            return None
+
+        if pts > nxt:
+            self.fillGap(kind, pts)
+
+        return pts
+
+
+    ''' Encode a video frame
+        @param [in] frame   - Video frame
+        @param [in] pts     - Time stamp
+    '''
+    def encodeVideo(self, frame, pts):
+
+        frame.pts = pts
+        frame.time_base = self.avf.vstream.time_base
+
+        # Force a keyframe where the next segment starts, or for a new output
+        t = pts * frame.time_base
+        with self.cOutLock:
+            key = self.avf.forcekey
+            self.avf.forcekey = False
+            for o in self.outs:
+                if o.segment and not o.segkeys and not o.closed and t >= o.nextkey:
+                    key = True
+                    while t >= o.nextkey:
+                        o.nextkey += o.segment
+        frame.pict_type = av.video.frame.PictureType.I if key else av.video.frame.PictureType.NONE
+
+        self.muxPackets(self.avf.vstream.encode(frame))
+
+        self.avf.vpts = pts + 1
+
+
+    ''' Encode an audio frame
+        @param [in] aframe  - Audio frame
+        @param [in] pts     - Time stamp
+    '''
+    def encodeAudio(self, aframe, pts):
+
+        aframe.pts = pts
+        aframe.sample_rate = self.avf.asr
+        aframe.time_base = self.avf.time_base
+        self.muxPackets(self.avf.astream.encode(aframe))
+
+        self.avf.apts = pts + self.avf.isamples
+
+
     ''' Write a video frame to the specified file
         @param [in] arr     - numpy array containing frame to write
+        @param [in] idx     - Frame index from the header, see the pts option
+        @param [in] clk     - Clock from the header
     '''
-    def writeVideoFrame(self, arr):
+    def writeVideoFrame(self, arr, idx=None, clk=None):
 
         if type(arr) != np.ndarray:
             return False
@@ -229,45 +1353,77 @@ class mcRecord(mcFilter):
         if not self.avf or not self.avf.vstream:
             return False
 
-        frame = av.VideoFrame.from_ndarray(arr, format=self.opts.pixbuf)
-        frame.pts = self.avf.vpts
-        frame.time_base = self.avf.vstream.time_base
-        for pkt in self.avf.vstream.encode(frame):
-            self.avf.file.mux(pkt)
+        pts = self.nextPts('v', idx, clk)
+        if None == pts:
+            return False
 
-        self.avf.vpts += 1
+        if self.yuv:
+            frame = self.yuv.convert(arr)
+            if None == frame:
+                self.sErr = self.yuv.getError()
+                return False
+        else:
+            frame = av.VideoFrame.from_ndarray(arr, format=self.opts.pixbuf)
+        self.encodeVideo(frame, pts)
+        self.avf.vlast = frame
 
         return True
 
 
     ''' Write an audio frame to the specified file
         @param [in] arr     - numpy array containing frame to write
+        @param [in] idx     - Frame index from the header, see the pts option
+        @param [in] clk     - Clock from the header
     '''
-    def writeAudioFrame(self, arr):
+    def writeAudioFrame(self, arr, idx=None, clk=None):
 
         if not self.avf or not self.avf.astream:
             return False
 
-        # Write audio
-        aframe = av.AudioFrame.from_ndarray(arr, self.opts.audbuf, layout=self.opts.alayout)
-        aframe.pts = self.avf.apts
-        aframe.sample_rate = self.avf.asr
-        aframe.time_base = self.avf.time_base
-        for pkt in self.avf.astream.encode(aframe):
-            self.avf.file.mux(pkt)
+        pts = self.nextPts('a', idx, clk)
+        if None == pts:
+            return False
 
-        self.avf.apts += int(self.avf.asr / self.avf.afps)
+        # Write audio
+        self.encodeAudio(av.AudioFrame.from_ndarray(arr, self.opts.audbuf, layout=self.opts.alayout), pts)
 
         return True
 
     def on_init(self, ctx):
-        self.createFile()
+        if self.createFile() and not self.openEncoder():
+            if self.on_error_callback:
+                self.on_error_callback(self, self.sErr)
+
+        if self.opts.get('trigger', None):
+            self.cTrig = mcMessage()
+            if not self.cTrig.create(name=self.opts.trigger, mode='existing'):
+                self.cTrig = None
+                if self.on_error_callback:
+                    self.on_error_callback(self, f"Failed to open trigger share : {self.opts.trigger}")
 
     def on_end(self, ctx):
+        self.closeEncoder()
         self.closeFile()
+        if self.cTrig:
+            self.cTrig.close()
+            self.cTrig = None
 
     def on_video(self, ctx, vfi, vfr):
-        self.writeVideoFrame(vfr)
+        if self.raw:
+            self.writeRaw(self.raw.getVideo(), vfr, vfi)
+            return
+        self.pollTrigger()
+        if self.cEnc:
+            self.queueFrame('v', vfr, vfi.get('idx'), vfi.get('clk'))
+        else:
+            self.writeVideoFrame(vfr, vfi.get('idx'), vfi.get('clk'))
 
     def on_audio(self, ctx, afi, afr):
-        self.writeAudioFrame(afr)
+        if self.raw:
+            self.writeRaw(self.raw.getAudio(), afr, afi)
+            return
+        self.pollTrigger()
+        if self.cEnc:
+            self.queueFrame('a', afr, afi.get('idx'), afi.get('clk'))
+        else:
+            self.writeAudioFrame(afr, afi.get('idx'), afi.get('clk'))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import math
+import numpy as np
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Streaming polyphase resampler
+
+    Resamples interleaved audio buffers one packet at a time.  Filter
+    history and the fractional read position are carried from one call
+    to the next, so consecutive packets join without seams.  The ratio
+    may be changed between calls, it is ramped smoothly over the next
+    block.
+
+    @begincode
+
+        rs = mcResample(ch=2)
+
+        def on_audio(ctx, afi, afr):
+            rs.setRatio(1.0 + drift)
+            out = rs.process(afr)
+
+    @endcode
+'''
+class mcResample:
+
+    ''' Initialize object
+        @param [in] ch      - Number of interleaved channels
+        @param [in] ratio   - Input samples consumed per output sample
+                                > 1 : Output is shorter than the input
+                                < 1 : Output is longer than the input
+        @param [in] taps    - Filter taps per phase, must be even
+        @param [in] phases  - Number of filter phases
+        @param [in] cutoff  - Low pass cutoff relative to nyquist (0-1)
+    '''
+    def __init__(self, ch=1, ratio=1.0, taps=16, phases=128, cutoff=0.9):
+
+        self.nCh = int(ch)
+        self.nTaps = int(taps + (taps % 2))
+        self.nPhases = int(phases)
+        self.fCutoff = float(cutoff)
+        self.aTable = mcResample.createTable(self.nTaps, self.nPhases, self.fCutoff)
+        self.aOffsets = np.arange(-int(self.nTaps / 2) + 1, int(self.nTaps / 2) + 1)
+        self.fMin = 0.5
+        self.fMax = 2.0
+
+        self.reset(ratio)
+
+
+    ''' Create polyphase filter table
+        @param [in] taps    - Filter taps per phase
+        @param [in] phases  - Number of filter phases
+        @param [in] cutoff  - Low pass cutoff relative to nyquist (0-1)
+
+        @returns numpy array of shape (phases + 1, taps)
+    '''
+    @staticmethod
+    def createTable(taps, phases, cutoff):
+
+        half = int(taps / 2)
+        frac = np.arange(0, phases + 1) / phases
+        m = np.arange(-half + 1, half + 1)
+
+        # Distance from each tap to the output position
+        x = m[None, :] - frac[:, None]
+
+        # Blackman windowed sinc
+        w = 0.42 + 0.5 * np.cos(np.pi * x / half) + 0.08 * np.cos(2 * np.pi * x / half)
+        w[np.abs(x) >= half] = 0
+        h = cutoff * np.sinc(cutoff * x) * w
+
+        # Unity gain for each phase
+        h /= h.sum(axis=1)[:, None]
+
+        return h.astype(np.float32)
+
+
+    ### Returns the number of channels
+    def getChannels(self):
+        return self.nCh
+
+
+    ### Returns the number of filter taps
+    def getTaps(self):
+        return self.nTaps
+
+
+    ### Returns the current ratio
+    def getRatio(self):
+        return self.fRatio
+
+
+    ### Returns the input delay in samples
+    def getLatency(self):
+        return len(self.aHist) - self.fPos
+
+
+    ''' Set the resampling ratio
+        @param [in] ratio   - Input samples consumed per output sample
+        @param [in] ramp    - If True, ramp to the new ratio over the next block,
+                              otherwise the ratio is changed immediately
+    '''
+    def setRatio(self, ratio, ramp=True):
+
+        if self.fMin > ratio:
+            ratio = self.fMin
+        elif self.fMax < ratio:
+            ratio = self.fMax
+
+        self.fTarget = float(ratio)
+        if not ramp:
+            self.fRatio = self.fTarget
+
+
+    ''' Reset the filter history
+        @param [in] ratio   - New ratio, None to keep the current one
+    '''
+    def reset(self, ratio=None):
+
+        if ratio is not None:
+            self.fRatio = 1.0
+            self.setRatio(ratio, False)
+
+        # Prime history with silence so the first output has full support
+        self.aHist = np.zeros((self.nTaps - 1, self.nCh), dtype=np.float32)
+        self.fPos = float(int(self.nTaps / 2) - 1)
+
+
+    ''' Resample a block of interleaved samples
+        @param [in] arr     - numpy array of interleaved samples, for example
+                              an mcAudio buffer of shape (1, samples * ch)
+        @param [in] dtype   - Output data type, defaults to the input type
+
+        @returns numpy array of shape (1, samples * ch)
+    '''
+    def process(self, arr, dtype=None):
+
+        if dtype is None:
+            dtype = arr.dtype
+
+        half = int(self.nTaps / 2)
+        x = np.concatenate((self.aHist, np.asarray(arr, dtype=np.float32).reshape(-1, self.nCh)))
+        last = len(x) - half
+
+        # Estimate the number of outputs, ramping the ratio across the block
+        r0 = self.fRatio
+        r1 = self.fTarget
+        n = int(math.ceil((last - self.fPos) / min(r0, r1))) + 1
+        if 0 >= n:
+            self.aHist = x
+            return np.zeros((1, 0), dtype=dtype)
+
+        if r0 != r1:
+            steps = r0 + (r1 - r0) * np.arange(1, n + 1) / n
+        else:
+            steps = np.full(n, r0)
+
+        # Output positions
+        t = self.fPos + np.concatenate(([0], np.cumsum(steps[:-1])))
+        i = np.floor(t).astype(np.int64)
+        k = np.searchsorted(i, last, side='left')
+        t = t[:k]
+        i = i[:k]
+
+        # Interpolate between the two nearest filter phases
+        f = (t - i) * self.nPhases
+        p = np.floor(f).astype(np.int64)
+        a = (f - p).astype(np.float32)[:, None]
+        coef = self.aTable[p] * (1 - a) + self.aTable[np.minimum(p + 1, self.nPhases)] * a
+
+        out = np.einsum('nt,ntc->nc', coef, x[i[:, None] + self.aOffsets[None, :]])
+
+        # Carry position and history into the next block
+        if k:
+            self.fPos = float(t[-1] + steps[k - 1])
+            self.fRatio = float(steps[k - 1]) if k < n else r1
+        drop = max(0, int(math.floor(self.fPos)) - half + 1)
+        drop = min(drop, len(x))
+        self.aHist = x[drop:].copy()
+        self.fPos -= drop
+
+        if np.issubdtype(dtype, np.integer):
+            lim = np.iinfo(dtype)
+            out = np.clip(np.rint(out), lim.min, lim.max)
+
+        return out.astype(dtype).reshape(1, -1)
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import string
+import random
+import threading
+import numpy as np
+
+from multiprocessing import shared_memory
+
+from . mc_mirror import *
+
+try:
+    import fcntl
+except Exception as e:
+    fcntl = None
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Shared filter statistics
+
+    A small share holding one slot of counters per filter.  Filters
+    created with the stats option write their counters straight into
+    their slot, so a monitor in another process can read every filter
+    without any calls into the filters.
+
+    Callback times are kept as log2 histograms, bucket k counts frames
+    that took [2^k, 2^(k+1)) microseconds, the last bucket everything
+    longer.  A batch callback counts each of its frames at an even share
+    of the call time.  Wake-up lateness of the filter thread, how long after the
+    requested time it actually ran, is kept the same way.
+
+    @begincode
+
+        st = mcStats()
+        st.create(name='stats', slots=32)
+
+        flt = mcBlank(opts={'video': vsname, 'stats': 'stats'})
+
+        for s in st.readAll():
+            print(s['name'], s['vproc'], s['vdrift'])
+
+    @endcode
+'''
+class mcStats:
+
+    # Counters in each slot
+    FIELDS = ['pid', 'time', 'vproc', 'vdrop', 'vover', 'vwin', 'vdrift',
+                             'aproc', 'adrop', 'aover', 'awin', 'adrift',
+                             'wakes', 'jitter', 'jmax']
+
+    # Field indexes, the audio fields follow the same order as video
+    PID = 0
+    TIME = 1
+    VPROC = 2
+    APROC = 7
+    PROC = 0
+    DROP = 1
+    OVER = 2
+    WIN = 3
+    DRIFT = 4
+
+    # Thread wake-ups, last and max lateness in microseconds
+    WAKES = 12
+    JITTER = 13
+    JMAX = 14
+
+    # Callback time histogram buckets
+    HIST = 20
+
+    # Filter name bytes
+    NAME = 32
+
+    # Slot layout
+    VHIST = len(FIELDS)
+    AHIST = VHIST + HIST
+    WHIST = AHIST + HIST
+    INTS = WHIST + HIST + int(NAME / 8)
+
+    # Serializes claims between the threads of a process, the record lock
+    # on the share only excludes other processes.  Reader slot claims take
+    # it as well.
+    cClaimLock = threading.Lock()
+
+
+    ### Initialize object
+    def __init__(self):
+
+        # Buffer overhead
+        # [0] = ID
+        # [1] = Slots
+        # [2] = Ints per slot
+        # [3] = Reserved
+        self.nOvInts = 4
+        self.nOvBytes = self.nOvInts * 8
+
+        self.nBufferId = 0x1F7A3C5E0B9D2468
+
+        self.cShm = None
+        self.sErr = ""
+        self.close()
+
+
+    ### Delete
+    def __del__(self):
+        self.close()
+
+
+    ### Returns the last error string
+    def getError(self):
+        return self.sErr
+
+
+    ### Returns True if share is open
+    def isOpen(self):
+        return True if self.cShm else False
+
+
+    ### Return the share name
+    def getName(self):
+        return self.sName
+
+
+    ### Returns the number of slots
+    def getSlots(self):
+        return self.nSlots
+
+
+    ### Release shared memory and prepare object for reuse
+    def close(self):
+
+        if self.cShm:
+            self.cShm.close()
+            if self.bCleanup:
+                self.cShm.unlink()
+
+        self.cShm = None
+        self.bCleanup = False
+        self.sName = ""
+        self.nSlots = 0
+        self.nSize = 0
+
+
+    ''' Creates the stats share
+        @param [in] name    - Share name, random if not provided
+        @param [in] slots   - Number of filter slots
+        @param [in] mode    - always / existing / new, see mcVideo.create()
+        @param [in] cleanup - Unlink the share on close
+    '''
+    def create(self, name=None, slots=64, mode="always", cleanup=False):
+
+        self.sErr = ""
+        self.close()
+
+        self.sName = name if name else ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(32))
+        self.bCleanup = cleanup
+        existing = False
+
+        try:
+
+            # Attempt to open existing share
+            try:
+                self.cShm = shared_memory.SharedMemory(name=self.sName, create=False)
+                existing = True
+            except Exception as e:
+                self.cShm = None
+
+            # Kill existing share if caller wants a new one
+            if self.cShm and "new" == mode:
+                self.cShm.close()
+                self.cShm.unlink()
+                self.cShm = None
+                existing = False
+
+            if not self.cShm:
+                if "existing" == mode:
+                    self.sErr = "Share does not exist: %s" % name
+                    self.close()
+                    return False
+
+                if 0 >= slots:
+                    self.sErr = "Invalid number of slots: %s" % slots
+                    self.close()
+                    return False
+
+                size = self.nOvBytes + (slots * mcStats.INTS * 8)
+                self.cShm = shared_memory.SharedMemory(name=self.sName, create=True, size=size)
+
+        except Exception as e:
+            Log(e)
+            self.sErr = str(e)
+            self.close()
+            return False
+
+        hdr = self.getHeader()
+        if not existing:
+            hdr[1] = slots
+            hdr[2] = mcStats.INTS
+            hdr[0] = self.nBufferId
+
+        if hdr[0] != self.nBufferId or hdr[2] != mcStats.INTS:
+            self.sErr = "Invalid stats header %s : %s" % (hdr[0], hdr[2])
+            self.close()
+            return False
+
+        self.nSlots = int(hdr[1])
+        self.nSize = self.nOvBytes + (self.nSlots * mcStats.INTS * 8)
+
+        return True
+
+
+    ### Return the main header
+    def getHeader(self):
+        return np.ndarray(shape=(self.nOvInts,), dtype=np.int64, buffer=self.cShm.buf[0:self.nOvBytes])
+
+
+    ''' Returns the counters of a slot as an int64 numpy array
+        @param [in] n   - Slot index
+    '''
+    def getSlot(self, n):
+
+        if 0 > n or n >= self.nSlots:
+            self.sErr = "Invalid slot index: %s" % n
+            return None
+
+        off = self.nOvBytes + (n * mcStats.INTS * 8)
+        return np.ndarray(shape=(mcStats.INTS,), dtype=np.int64, buffer=self.cShm.buf[off:off+(mcStats.INTS * 8)])
+
+
+    ''' Lock the share header against other processes
+        Opens the share again by name and takes a record lock on the header.
+
+        @returns File descriptor to pass to unlock(), -1 if record locks
+                 aren't available on this platform
+    '''
+    def lock(self):
+        return mcStats.lockShm(self.cShm, self.nOvBytes)
+
+
+    ''' Release the lock taken by lock()
+        @param [in] fd  - File descriptor from lock()
+    '''
+    def unlock(self, fd):
+        mcStats.unlockShm(fd, self.nOvBytes)
+
+
+    ''' Take a record lock on a range of a share
+        @param [in] shm     - SharedMemory object
+        @param [in] size    - Bytes to lock
+        @param [in] off     - Offset of the range
+
+        Also locks the reader table of mcVideo and mcAudio.
+
+        @returns File descriptor to pass to unlockShm(), -1 if record
+                 locks aren't available on this platform
+    '''
+    @staticmethod
+    def lockShm(shm, size, off=0):
+
+        shm_open = mcMirror.getShmOpen() if fcntl else None
+        if not shm_open:
+            return -1
+
+        fd = shm_open(('/' + shm.name.lstrip('/')).encode(), os.O_RDWR, 0)
+        if 0 <= fd:
+            fcntl.lockf(fd, fcntl.LOCK_EX, size, off)
+        return fd
+
+
+    ''' Release the lock taken by lockShm()
+        @param [in] fd      - File descriptor from lockShm()
+        @param [in] size    - Bytes locked
+        @param [in] off     - Offset of the range
+    '''
+    @staticmethod
+    def unlockShm(fd, size, off=0):
+        if 0 <= fd:
+            fcntl.lockf(fd, fcntl.LOCK_UN, size, off)
+            os.close(fd)
+
+
+    ''' Claim a free slot for a filter
+        @param [in] name    - Filter name
+
+        Slots of processes that no longer exist are reused.  Claims are
+        locked so two filters never take the same slot.
+
+        @returns Slot index or -1 if there are no free slots
+    '''
+    def claim(self, name):
+
+        pid = os.getpid()
+        with mcStats.cClaimLock:
+            fd = self.lock()
+            try:
+                for n in range(0, self.nSlots):
+                    s = self.getSlot(n)
+                    if s[0] and mcStats.isAlive(int(s[0])):
+                        continue
+
+                    s[1:] = 0
+                    s[0] = pid
+                    mcStats.setName(s, name)
+                    return n
+            finally:
+                self.unlock(fd)
+
+        self.sErr = "No free stats slots"
+        return -1
+
+
+    ''' Release a slot
+        @param [in] n   - Slot index
+    '''
+    def release(self, n):
+        s = self.getSlot(n)
+        if s is not None:
+            s[:] = 0
+
+
+    ### Returns True if the process exists
+    @staticmethod
+    def isAlive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except Exception as e:
+            pass
+        return True
+
+
+    ### Returns a zeroed slot not attached to a share
+    @staticmethod
+    def createSlot():
+        return np.zeros(mcStats.INTS, dtype=np.int64)
+
+
+    ''' Store the filter name in a slot
+        @param [in] s       - Slot array
+        @param [in] name    - Name
+    '''
+    @staticmethod
+    def setName(s, name):
+        b = s[-int(mcStats.NAME / 8):].view(np.uint8)
+        v = str(name).encode('utf-8')[:mcStats.NAME - 1]
+        b[:] = 0
+        b[:len(v)] = np.frombuffer(v, dtype=np.uint8)
+
+
+    ''' Add a callback time to a histogram
+        @param [in] s       - Slot array
+        @param [in] base    - mcStats.VHIST, mcStats.AHIST or mcStats.WHIST
+        @param [in] t       - Time in seconds
+        @param [in] n       - Frames the call covered, t is shared evenly
+                              and each frame counted
+    '''
+    @staticmethod
+    def addTime(s, base, t, n=1):
+        us = int(t * 1000000 / max(1, n))
+        s[base + min(us.bit_length() - 1 if us else 0, mcStats.HIST - 1)] += max(1, n)
+
+
+    ''' Convert a slot to a dict
+        @param [in] s   - Slot array
+
+        @returns {'name', 'pid', 'time', 'vproc', ... 'vhist', 'ahist', 'whist'}
+    '''
+    @staticmethod
+    def toDict(s):
+        d = {k: int(s[i]) for i, k in enumerate(mcStats.FIELDS)}
+        d['name'] = bytes(s[-int(mcStats.NAME / 8):].view(np.uint8)).split(b'\0')[0].decode('utf-8', 'replace')
+        d['vhist'] = s[mcStats.VHIST:mcStats.VHIST + mcStats.HIST].tolist()
+        d['ahist'] = s[mcStats.AHIST:mcStats.AHIST + mcStats.HIST].tolist()
+        d['whist'] = s[mcStats.WHIST:mcStats.WHIST + mcStats.HIST].tolist()
+        return d
+
+
+    ### Returns the stats of every filter with a slot
+    def readAll(self):
+
+        r = []
+        for n in range(0, self.nSlots):
+            s = self.getSlot(n)
+            if s[0]:
+                d = mcStats.toDict(s)
+                d['slot'] = n
+                r.append(d)
+        return r
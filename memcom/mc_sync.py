@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import time
+import math
+import numpy as np
+import propertybag as pb
+
+from . mc_filter import *
+from . mc_resample import *
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' Adaptive A/V jitter buffer and sync controller
+
+    Replaces hand tuned vbias / abias offsets.  The read pointers are kept
+    a target latency behind the writer, the latency grows with the
+    measured jitter of the writer time stamps and decays again when the
+    writer is steady.
+
+    The A/V offset is measured from the clk time stamps of the frames
+    being delivered.  Small offsets are corrected continuously by
+    adjusting the ratio of an mcResample the audio is passed through,
+    large offsets by moving the audio read pointer.
+
+    # Called with each video frame
+    def on_video(ctx, vfi, vfr)
+
+    # Called with each block of resampled audio
+    def on_audio(ctx, afi, afr)
+'''
+class mcSync(mcFilter):
+
+    ''' Initialize object
+        @param [in] on_error    - Called when the errors are detected
+        @param [in] on_video    - Called with each video frame
+        @param [in] on_audio    - Called with each block of resampled audio
+        @param [in] opts        - Options
+                                    video    : The name of the video share
+                                    audio    : The name of the audio share
+                                    latency  : Minimum latency in seconds, default 0.05
+                                    jitter   : Latency added per second of measured jitter, default 3
+                                    decay    : Time constant in seconds of the jitter decay, default 6
+                                    gain     : Ratio change per second of A/V offset, default 0.05
+                                    maxdrift : Maximum ratio change, default 0.005
+                                    maxoff   : A/V offset in seconds corrected by moving
+                                               the audio pointer, default 0.1
+    '''
+    def __init__(self, on_error=None, on_video=None, on_audio=None, opts={}):
+        super().__init__(on_error=on_error, on_video=self.on_video, on_audio=self.on_audio, opts=opts)
+        self.on_sync_video_callback = on_video if callable(on_video) else None
+        self.on_sync_audio_callback = on_audio if callable(on_audio) else None
+        self.rs = None
+        self.resetSync()
+
+
+    ### Delete
+    def __del__(self):
+        super().__del__()
+        self.close()
+
+
+    ### Release resources and prepare object for reuse
+    def close(self):
+        super().close()
+        self.resetSync()
+
+
+    ### Reset controller state
+    def resetSync(self):
+        self.bSync = False
+        self.fLatency = 0
+        self.fJitter = 0
+        self.fOffset = 0
+        self.fSkew = 0
+        self.nAdjust = 0
+        self.vclk = None
+        self.aclk = None
+        self.vhead = None
+        self.ahead = None
+
+
+    ### Returns the current A/V offset in seconds, positive if audio is late
+    def getOffset(self):
+        return self.fOffset
+
+
+    ### Returns the current target latency in seconds
+    def getLatency(self):
+        return self.fLatency
+
+
+    ### Returns the measured writer jitter in seconds
+    def getJitter(self):
+        return self.fJitter
+
+
+    ### Returns the current audio resampling ratio
+    def getRatio(self):
+        return self.rs.getRatio() if self.rs else 1.0
+
+
+    ''' Creates the filter
+        @param [in] opts    - Options, see __init__()
+    '''
+    def create(self, opts={}):
+
+        self.close()
+        self.opts.merge(opts)
+
+        self.fMinLatency = float(self.opts.get('latency', 0.05))
+        self.fJitterMul = float(self.opts.get('jitter', 3))
+        self.fDecay = float(self.opts.get('decay', 6))
+        self.fGain = float(self.opts.get('gain', 0.05))
+        self.fMaxDrift = float(self.opts.get('maxdrift', 0.005))
+        self.fMaxOff = float(self.opts.get('maxoff', 0.1))
+
+        return super().create(opts=opts)
+
+
+    ''' Track the writer time stamps of a share
+        @param [in] share   - Share to check
+        @param [in] fps     - Frame rate of the share
+        @param [in] last    - Last head (clk, idx) seen
+
+        @returns Latest head (clk, idx)
+    '''
+    def trackJitter(self, share, fps, last):
+
+        fi = share.getFrameInfo(share.calcIdx(-1))
+        if not fi:
+            return last
+
+        clk, idx = fi['clk'], fi['idx']
+        if last is not None and clk != last[0]:
+
+            # Deviation from the nominal frame period, averaged over the
+            # frames written since the last look
+            k = max(1, idx - last[1])
+            dev = abs((clk - last[0]) / 1000 / k - (1 / fps))
+
+            # Follow peaks immediately, decay slowly over the writer time
+            # elapsed, so the decay doesn't depend on how often this runs
+            if dev > self.fJitter:
+                self.fJitter = dev
+            elif 0 < self.fDecay:
+                self.fJitter *= math.exp(-max(0, clk - last[0]) / 1000 / self.fDecay)
+
+        return (clk, idx)
+
+
+    ### Update the target latency and read pointer offsets
+    def updateSync(self):
+
+        if self.vshare:
+            self.vhead = self.trackJitter(self.vshare, self.vfps, self.vhead)
+        if self.ashare:
+            self.ahead = self.trackJitter(self.ashare, self.afps, self.ahead)
+
+        self.fLatency = self.fMinLatency + (self.fJitterMul * self.fJitter)
+
+        # Frames behind the writer, one extra for the frame being written.
+        # The offset never exceeds the current lag of the read pointer, so
+        # when the latency grows the pointer holds until the writer moves on.
+        if self.vshare:
+            nv = min(int(math.ceil(self.fLatency * self.vfps)) + 1, self.vbufs - self.vwinf)
+            self.vbiasf = -min(nv, (self.vshare.getIdx() - self.vptr) % self.vbufs)
+
+        if self.ashare:
+
+            # Match the middle of the audio frame to the middle of the video frame
+            if self.vshare:
+                na = int(round(((nv - 0.5) / self.vfps * self.afps) + 0.5))
+            else:
+                na = int(math.ceil(self.fLatency * self.afps)) + 1
+
+            na = max(1, min(na + self.nAdjust, self.abufs - self.awinf))
+            self.abiasf = -min(na, (self.ashare.getIdx() - self.aptr) % self.abufs)
+
+        # Start at the target position
+        if not self.bSync:
+            self.bSync = True
+            if self.vshare:
+                self.vptr = self.vshare.calcIdx(self.vbiasf)
+            if self.ashare:
+                self.aptr = self.ashare.calcIdx(self.abiasf)
+                self.rs = mcResample(ch=self.ashare.getChannels())
+
+        # Need both streams to measure the offset
+        if None == self.vclk or None == self.aclk:
+            return
+
+        # Compare the middle of the current frames, less what the
+        # resampler has already corrected.  Smoothed since the video
+        # frames are usually much longer than the audio frames.
+        vmid = self.vclk / 1000 + (0.5 / self.vfps)
+        amid = self.aclk / 1000 + (0.5 / self.afps)
+        self.fOffset += 0.05 * ((vmid - amid - self.fSkew) - self.fOffset)
+
+        # Large offset, move the audio pointer
+        if self.fMaxOff < abs(self.fOffset):
+            off = self.fOffset
+            n = int(round(off * self.afps))
+            self.nAdjust -= n
+            self.fSkew = 0
+            self.fOffset = 0
+            self.aclk = None
+            if self.on_error_callback:
+                self.on_error_callback(self, f'AVSYNC : Offset {off:.3f}s, audio pointer moved {-n} frames')
+            return
+
+        # Small offset, steer the resampling ratio
+        adj = max(-self.fMaxDrift, min(self.fMaxDrift, self.fGain * self.fOffset))
+        self.rs.setRatio(1.0 + adj)
+
+
+    ### Called to run the filter
+    def runLoop(self, vhead=None, ahead=None):
+        self.updateSync()
+        super().runLoop(vhead, ahead)
+
+
+    def on_video(self, ctx, vfi, vfr):
+        self.vclk = vfi['clk']
+        if self.on_sync_video_callback:
+            self.on_sync_video_callback(ctx, vfi, vfr)
+
+
+    def on_audio(self, ctx, afi, afr):
+
+        self.aclk = afi['clk']
+
+        # Resample and track the time difference introduced
+        out = self.rs.process(afr)
+        ch = self.rs.getChannels()
+        self.fSkew += (afr.size - out.size) / ch / self.ashare.getBitrate()
+
+        if self.on_sync_audio_callback:
+            self.on_sync_audio_callback(ctx, afi, out)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import sys
 import time
 import string
 import random
@@ -8,6 +9,10 @@ import numpy as np
 
 from multiprocessing import shared_memory
 
+from . mc_event import *
+from . mc_readers import *
+from . mc_frameinfo import *
+
 try:
     import sparen
     Log = sparen.log
@@ -16,7 +21,7 @@ except Exception as e:
 
 
 ### Share video buffers between processes
-class mcVideo:
+class mcVideo(mcReaders):
 
     ### Initialize object
     def __init__(self):
@@ -28,7 +33,9 @@ class mcVideo:
         # [3] = Width
         # [4] = Height
         # [5] = FPS
-        self.nOvInts = 6 # Use an even number for byte alignment
+        # [6] = Reader table slots, see mcReaders
+        # [7] = Reserved
+        self.nOvInts = 8 # Use an even number for byte alignment
         self.nOvBytes = self.nOvInts * 8
 
         # Packet overhead
@@ -36,13 +43,15 @@ class mcVideo:
         # [1] = PTS
         # [2] = IDX
         # [3] = CLK
-        # [4] = WTS
-        # [5] = RDS
-        self.nPktOvInts = 6 # Use an even number
+        # [4] = RDS
+        # [5] = WTS
+        # [6] = Pipeline stage completion bits, see setStage()
+        # [7] = Reserved
+        self.nPktOvInts = 8 # Use an even number
         self.nPktOvBytes = self.nPktOvInts * 8
 
-        # ID
-        self.nBufferId = 0x1DDA5A7A2C4C8918
+        # ID, changed whenever the layout changes so older builds reject the share
+        self.nBufferId = 0x1B5329EB977E9D8A
         self.nPacketId = 0x1E6BA49114CE2619
 
         self.cShm = None
@@ -125,17 +134,24 @@ class mcVideo:
         self.bExisting = False
 
         self.nBufs = []
+        self.cHdr = None
+        self.aPktHdrs = []
         self.nBuffers = 0
         self.nWidth = 0
         self.nHeight = 0
         self.nFps = 0
         self.nPacketSize = 0
         self.nFrameSize = 0
+        self.nReaders = 0
+        self.nRdrOff = self.nOvBytes
+        self.nPktOff = self.nOvBytes
 
 
-    ### Return the main header
+    ### Return the main header, the view is created once per open
     def getHeader(self):
-        return np.ndarray(shape=(self.nOvInts,), dtype=np.int64, buffer=self.cShm.buf[0:self.nOvBytes])
+        if self.cHdr is None:
+            self.cHdr = np.ndarray(shape=(self.nOvInts,), dtype=np.int64, buffer=self.cShm.buf[0:self.nOvBytes])
+        return self.cHdr
 
 
     ### Get the current index
@@ -148,9 +164,39 @@ class mcVideo:
     def setIdx(self, idx):
         hdr = self.getHeader()
         hdr[2] = idx % self.nBuffers
+        mcEvent.wake(self.getIdxAddr(hdr))
         return hdr[2]
 
 
+    ### Returns the address of the 32 bit word holding the index
+    def getIdxAddr(self, hdr):
+        return hdr.ctypes.data + (2 * 8) + (4 if 'big' == sys.byteorder else 0)
+
+
+    ### Wake everything blocked in waitIdx()
+    def notifyIdx(self):
+        hdr = self.getHeader()
+        mcEvent.wake(self.getIdxAddr(hdr))
+
+
+    ''' Wait for the writer to change the index
+        @param [in] idx     - Index last seen
+        @param [in] timeout - Maximum time to wait in seconds, None for no limit
+
+        Returns when the index differs from idx, notifyIdx() is called
+        or the timeout expires.
+
+        @returns The current index
+    '''
+    def waitIdx(self, idx, timeout=None):
+        hdr = self.getHeader()
+        addr = self.getIdxAddr(hdr)
+        val = mcEvent.load(addr)
+        if val % self.nBuffers == idx:
+            mcEvent.wait(addr, val, timeout)
+        return hdr[2] % self.nBuffers
+
+
     ''' Calculates the index based on the specified offset
         @param [in] off - Offset from the index
     '''
@@ -177,12 +223,15 @@ class mcVideo:
     def addIdx(self, add):
         hdr = self.getHeader()
         hdr[2] = (hdr[2] + add) % self.nBuffers
+        mcEvent.wake(self.getIdxAddr(hdr))
         return hdr[2]
 
 
     ### Get header for the specified frame
     def getFrameHeader(self, n):
-        off = self.nOvBytes + (n * self.nPacketSize)
+        if n < len(self.aPktHdrs):
+            return self.aPktHdrs[n]
+        off = self.nPktOff + (n * self.nPacketSize)
         return np.ndarray(shape=(self.nPktOvInts,), dtype=np.int64, buffer=self.cShm.buf[off:off+self.nPktOvBytes])
 
 
@@ -193,6 +242,8 @@ class mcVideo:
         @param [in] clk - CLK - Clock value
         @param [in] rds - RDS - Number of reads
         @param [in] wts - WTS - Number of writes
+
+        Clears the stage bits, the frame starts through the pipeline again
     '''
     def setFrameInfo(self, n, pts, idx, clk, rds, wts):
         fh = self.getFrameHeader(n)
@@ -201,18 +252,48 @@ class mcVideo:
         fh[3] = clk
         fh[4] = rds
         fh[5] = wts
+        fh[6] = 0
         fh[0] = self.nPacketId
 
 
+    ''' Returns the stage completion bits of a frame
+        @param [in] n   - Frame index
+
+        Stored in the low word of the stage field, see mcPipeline
+    '''
+    def getStages(self, n):
+        fh = self.getFrameHeader(n)
+        return int(fh[6]) & 0xffffffff
+
+
+    ''' Mark a pipeline stage done for a frame
+        @param [in] n       - Frame index
+        @param [in] stage   - Stage number (0-31)
+
+        Wakes everything blocked in waitIdx() so later stages run immediately.
+    '''
+    def setStage(self, n, stage):
+        fh = self.getFrameHeader(n)
+        addr = fh.ctypes.data + (6 * 8) + (4 if 'big' == sys.byteorder else 0)
+        mcEvent.setBitWake(addr, stage, self.getIdxAddr(self.getHeader()))
+
+
     ''' Get frame info
+        @param [in] n   - Frame index
+        @param [in] fi  - Optional mcFrameInfo record to fill instead of
+                          creating a dict
+
         @returns Object containing the following
                     {
                         pts: Presentation Time Stamp
                         idx: Frame index
                     }
     '''
-    def getFrameInfo(self, n):
+    def getFrameInfo(self, n, fi=None):
         fh = self.getFrameHeader(n)
+        if None != fi:
+            v = fh.tolist()
+            return fi.set(n, v) if v[0] == self.nPacketId else fi.clear()
         if fh[0] != self.nPacketId:
             return {}
         return {'buf': n, 'pts': fh[1], 'idx': fh[2], 'clk': fh[3], 'rds': fh[4], 'wts': fh[5]}
@@ -226,10 +307,11 @@ class mcVideo:
         @param [in] name    - Name for memory buffer, if not provided a random name will be generated.
         @param [in] size    - Desired total size of the memory buffer
         @param [in] cleanup - Non-zero if the shared memory should be unlinked on close
+        @param [in] readers - Number of reader table slots, see mcReaders
 
         @returns True if success
     '''
-    def create(self, name = None, bufs = 0, width = 0, height = 0, fps = 0, mode = "always", cleanup = False):
+    def create(self, name = None, bufs = 0, width = 0, height = 0, fps = 0, mode = "always", cleanup = False, readers = 16):
 
         self.sErr = ""
         self.close()
@@ -268,7 +350,7 @@ class mcVideo:
                     self.sErr = "Invalid video size: %sx%s" % (width, height)
                     return False
                 self.nPacketSize = self.nPktOvBytes + self.nFrameSize
-                self.nSize = self.nOvBytes + (bufs * self.nPacketSize)
+                self.nSize = self.nOvBytes + (readers * mcReaders.RDR_INTS * 8) + (bufs * self.nPacketSize)
                 if 0 >= self.nSize:
                     self.sErr = "Invalid buffer size: %s" % nSize
                     return False
@@ -290,6 +372,7 @@ class mcVideo:
             hdr[3] = width
             hdr[4] = height
             hdr[5] = fps
+            hdr[6] = readers
             hdr[0] = self.nBufferId
 
         # Validate header id
@@ -305,11 +388,16 @@ class mcVideo:
         self.nFps = hdr[5]
         self.nFrameSize = self.nWidth * self.nHeight * 3
         self.nPacketSize = self.nPktOvBytes + self.nFrameSize
-        self.nSize = self.nOvBytes + (self.nBuffers * self.nPacketSize)
+        self.nReaders = int(hdr[6])
+        self.nRdrOff = self.nOvBytes
+        self.nPktOff = self.nRdrOff + (self.nReaders * mcReaders.RDR_INTS * 8)
+        self.nSize = self.nPktOff + (self.nBuffers * self.nPacketSize)
 
         self.nBufs = []
+        self.aPktHdrs = []
         for i in range(0, self.nBuffers):
             self.nBufs.append(self.getBuf(i))
+            self.aPktHdrs.append(self.getFrameHeader(i))
 
         return True
 
@@ -329,7 +417,7 @@ class mcVideo:
             return None
 
         # Calculate buffer offset
-        off = self.nOvBytes + (n * self.nPacketSize) + self.nPktOvBytes
+        off = self.nPktOff + (n * self.nPacketSize) + self.nPktOvBytes
         return np.ndarray(shape=(self.nHeight, self.nWidth, 3), dtype=np.uint8, buffer=self.cShm.buf[off:off+self.nFrameSize])
 
 
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import numpy as np
+import av
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import sparen
+    Log = sparen.log
+except Exception as e:
+    Log = print
+
+
+''' RGB to YUV 4:2:0 conversion on a thread pool
+
+    Converts rgb24 frames to yuv420p, BT.601 limited range as swscale
+    does by default, straight into the planes of a small ring of
+    reusable av.VideoFrame objects.  Each frame is split into bands of
+    rows converted on separate threads, numpy releases the GIL while it
+    works on the arrays so the bands run in parallel.
+
+    Chroma is the average of each 2 x 2 block, so width and height must
+    be even.
+
+    @begincode
+
+        yuv = mcYuv(1920, 1080, workers=4)
+
+        def on_video(ctx, vfi, vfr):
+            frame = yuv.convert(vfr)
+            pkts = stream.encode(frame)
+
+    @endcode
+'''
+class mcYuv:
+
+    # Fixed point BT.601 coefficients, scaled by 256
+    Y = (66, 129, 25)
+    U = (-38, -74, 112)
+    V = (112, -94, -18)
+
+    ''' Initialize object
+        @param [in] width   - Frame width, even
+        @param [in] height  - Frame height, even
+        @param [in] workers - Conversion threads, 0 for one per cpu
+        @param [in] bands   - Row bands per frame, defaults to workers
+        @param [in] frames  - Frames in the output ring.  A frame returned
+                              by convert() is reused frames calls later.
+    '''
+    def __init__(self, width, height, workers=0, bands=0, frames=4):
+
+        self.sErr = ""
+        self.pool = None
+        self.nWidth = int(width)
+        self.nHeight = int(height)
+        self.nWorkers = int(workers) if 0 < int(workers) else (os.cpu_count() or 1)
+        self.nFrames = max(2, int(frames))
+        self.nNext = 0
+
+        if 0 >= self.nWidth or 0 >= self.nHeight or self.nWidth % 2 or self.nHeight % 2:
+            raise ValueError(f"Frame size must be even : {self.nWidth} x {self.nHeight}")
+
+        # Bands are whole chroma rows
+        nb = max(1, min(int(bands) if 0 < int(bands) else self.nWorkers, int(self.nHeight / 2)))
+        rows = [int(self.nHeight / 2 * k / nb) * 2 for k in range(0, nb + 1)]
+        self.bands = [(rows[k], rows[k+1]) for k in range(0, nb)]
+
+        # Scratch per band, so the bands don't allocate
+        self.scratch = []
+        for y0, y1 in self.bands:
+            h = y1 - y0
+            w = self.nWidth
+            self.scratch.append({'rgb': np.empty((3, h, w), dtype=np.uint16),
+                                 'acc': np.empty((h, w), dtype=np.uint16),
+                                 'tmp': np.empty((h, w), dtype=np.uint16),
+                                 'half': np.empty((3, int(h / 2), w), dtype=np.uint16),
+                                 'sum': np.empty((3, int(h / 2), int(w / 2)), dtype=np.int16),
+                                 'c': np.empty((int(h / 2), int(w / 2)), dtype=np.int32),
+                                 't': np.empty((int(h / 2), int(w / 2)), dtype=np.int32)})
+
+        # Output frames and views of their planes
+        self.frames = []
+        for k in range(0, self.nFrames):
+            self.frames.append(self.createFrame())
+
+        if 1 < self.nWorkers and 1 < len(self.bands):
+            self.pool = ThreadPoolExecutor(max_workers=self.nWorkers, thread_name_prefix='mcYuv')
+
+
+    ### Delete
+    def __del__(self):
+        self.close()
+
+
+    ### Returns the last error string
+    def getError(self):
+        return self.sErr
+
+
+    ### Returns the number of conversion threads
+    def getWorkers(self):
+        return self.nWorkers
+
+
+    ### Returns the row bands, [(first row, end row)]
+    def getBands(self):
+        return list(self.bands)
+
+
+    ### Stop the worker threads
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+    ### Create an output frame, returns (frame, [y, u, v] plane views, buffer address)
+    def createFrame(self):
+
+        f = av.VideoFrame(self.nWidth, self.nHeight, 'yuv420p')
+        return (f, self.getPlanes(f), f.planes[0].buffer_ptr)
+
+
+    ''' Returns writable views of the planes of a yuv420p frame
+        @param [in] f   - av.VideoFrame
+    '''
+    def getPlanes(self, f):
+
+        v = []
+        for k, p in enumerate(f.planes):
+            w = self.nWidth if 0 == k else int(self.nWidth / 2)
+            h = self.nHeight if 0 == k else int(self.nHeight / 2)
+            v.append(np.frombuffer(p, dtype=np.uint8).reshape(-1, p.line_size)[:h, :w])
+        return v
+
+
+    ''' Convert one band of rows
+        @param [in] rgb     - Source frame, height x width x 3 uint8
+        @param [in] planes  - Output plane views
+        @param [in] k       - Band index
+    '''
+    def convertBand(self, rgb, planes, k):
+
+        y0, y1 = self.bands[k]
+        s = self.scratch[k]
+
+        # Planar copy first, strided channel access is slower than the copy
+        pl = s['rgb']
+        np.copyto(pl, rgb[y0:y1].transpose(2, 0, 1))
+
+        # Luma, every term is positive so it fits 16 bits
+        acc = s['acc']
+        tmp = s['tmp']
+        np.multiply(pl[0], mcYuv.Y[0], out=acc)
+        np.multiply(pl[1], mcYuv.Y[1], out=tmp)
+        acc += tmp
+        np.multiply(pl[2], mcYuv.Y[2], out=tmp)
+        acc += tmp
+        acc += 128
+        acc >>= 8
+        acc += 16
+        np.copyto(planes[0][y0:y1], acc, casting='unsafe')
+
+        # Sum of each 2 x 2 block
+        half = s['half']
+        sums = s['sum']
+        np.add(pl[:, 0::2], pl[:, 1::2], out=half)
+        np.add(half[:, :, 0::2], half[:, :, 1::2], out=sums, casting='unsafe')
+
+        # Chroma, the sums are four pixels so the scale is 256 * 4
+        ct = s['c']
+        t = s['t']
+        c0 = int(y0 / 2)
+        c1 = int(y1 / 2)
+        for coef, out in ((mcYuv.U, planes[1]), (mcYuv.V, planes[2])):
+            np.multiply(sums[0], coef[0], out=ct, dtype=np.int32)
+            np.multiply(sums[1], coef[1], out=t, dtype=np.int32)
+            ct += t
+            np.multiply(sums[2], coef[2], out=t, dtype=np.int32)
+            ct += t
+            ct += 512
+            ct >>= 10
+            ct += 128
+            np.copyto(out[c0:c1], ct, casting='unsafe')
+
+
+    ''' Convert a frame
+        @param [in] rgb - Source frame, height x width x 3 uint8, may be a view
+
+        @returns av.VideoFrame in yuv420p, reused by a later call
+    '''
+    def convert(self, rgb):
+
+        if rgb.shape[0] != self.nHeight or rgb.shape[1] != self.nWidth:
+            self.sErr = f"Frame size {rgb.shape[1]} x {rgb.shape[0]} doesn't match {self.nWidth} x {self.nHeight}"
+            return None
+
+        n = self.nNext
+        self.nNext = (n + 1) % self.nFrames
+        f, planes, ptr = self.frames[n]
+
+        # Buffers an encoder still holds are left to it, the frame gets new ones
+        f.make_writable()
+        if ptr != f.planes[0].buffer_ptr:
+            planes = self.getPlanes(f)
+            self.frames[n] = (f, planes, f.planes[0].buffer_ptr)
+
+        if self.pool:
+            for fut in [self.pool.submit(self.convertBand, rgb, planes, k) for k in range(0, len(self.bands))]:
+                fut.result()
+        else:
+            for k in range(0, len(self.bands)):
+                self.convertBand(rgb, planes, k)
+
+        f.pts = None
+        f.pict_type = av.video.frame.PictureType.NONE
+        return f
+
+
+    ''' Compare the conversion with swscale
+        @param [in] width   - Frame width
+        @param [in] height  - Frame height
+        @param [in] frames  - Frames to convert per run
+        @param [in] workers - Thread counts to try
+
+        @returns List of {'name', 'workers', 'fps'}, swscale first
+    '''
+    @staticmethod
+    def benchmark(width=1920, height=1080, frames=60, workers=None):
+
+        if not workers:
+            workers = sorted(set([1, 2, os.cpu_count() or 1]))
+
+        x = np.arange(width, dtype=np.uint16)[None, :] + np.arange(height, dtype=np.uint16)[:, None]
+        src = [np.stack([(x + k) % 256, (x * 2 + k) % 256, (x * 3 + k) % 256], axis=2).astype(np.uint8)
+               for k in range(0, 4)]
+
+        def timeIt(fn):
+            t = time.perf_counter()
+            for i in range(0, frames):
+                fn(src[i % len(src)])
+            return frames / (time.perf_counter() - t)
+
+        r = [{'name': 'swscale', 'workers': 1,
+              'fps': timeIt(lambda a: av.VideoFrame.from_ndarray(a, format='rgb24').reformat(format='yuv420p'))}]
+
+        for w in workers:
+            yuv = mcYuv(width, height, workers=w)
+            r.append({'name': 'mcYuv', 'workers': w, 'fps': timeIt(yuv.convert)})
+            yuv.close()
+
+        return r
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import time
+import memcom
+
+try:
+    import sparen
+    Log = sparen.log
+except:
+    Log = print
+
+
+''' Per frame overhead of the filter loop
+
+    Writes frames into a share by hand and times mcFilter.runStep()
+    draining them with an empty callback, so only the loop itself is
+    measured.  The old per frame calls are timed as well for reference.
+
+    Also compares mcYuv with the swscale conversion the encoder does.
+'''
+
+def legacyFrame(vid, n, roi):
+    vfr = vid.getBuf(n)
+    vfi = vid.getFrameInfo(n)
+    if 'idx' in vfi:
+        vfr = vfr[roi['y']:roi['y']+roi['h'], roi['x']:roi['x']+roi['w']]
+    return vfi, vfr
+
+
+def cachedFrame(vid, n, frs, fis):
+    return vid.getFrameInfo(n, fis[n]), frs[n]
+
+
+def timeIt(fn, count):
+    t = time.perf_counter()
+    for i in range(0, count):
+        fn(i)
+    return (time.perf_counter() - t) / count * 1000000
+
+
+def run():
+
+    bufs = 32
+    frames = 20000
+    roi = {'x': 16, 'y': 16, 'w': 320, 'h': 240}
+
+    Log('Create video share')
+    vid = memcom.mcVideo()
+    if not vid.create(bufs=bufs, width=640, height=480, fps=1000, cleanup=True):
+        raise Exception(vid.getError())
+
+    for n in range(0, bufs):
+        vid.setFrameInfo(n, n, n, n, 0, 0)
+
+    frs = [f[roi['y']:roi['y']+roi['h'], roi['x']:roi['x']+roi['w']] for f in vid.getBufs()]
+    fis = [memcom.mcFrameInfo() for _ in range(bufs)]
+
+    Log(f'Frame access, legacy : {timeIt(lambda i: legacyFrame(vid, i % bufs, roi), frames):.2f} us')
+    Log(f'Frame access, cached : {timeIt(lambda i: cachedFrame(vid, i % bufs, frs, fis), frames):.2f} us')
+
+    # Drain a growing number of frames per pass, the cost per frame should stay flat
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: None,
+                          opts={'video': vid.getName(), 'vwin': 1, 'thread': False, 'roi': roi})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    for per in [1, 4, 16, bufs - 1]:
+        idx = 0
+        t = 0
+        passes = int(frames / per)
+        for p in range(0, passes):
+            for k in range(0, per):
+                i = vid.getIdx()
+                idx += 1
+                vid.setFrameInfo(i, idx, idx, idx, 0, 0)
+                vid.setIdx(i + 1)
+            s = time.perf_counter()
+            flt.runStep()
+            t += time.perf_counter() - s
+        Log(f'runStep, {per:>2} frames per pass : {t / (passes * per) * 1000000:.2f} us / frame')
+
+    flt.close()
+    vid.close()
+
+    # Colour conversion ahead of the encoder, swscale is what the encoder does otherwise
+    for w, h in [(1280, 720), (1920, 1080)]:
+        for r in memcom.mcYuv.benchmark(width=w, height=h, frames=60):
+            Log(f"RGB to YUV {w} x {h}, {r['name']:>7} {r['workers']} thread(s) : {r['fps']:.1f} fps")
+
+
+if __name__ == '__main__':
+    try:
+        run()
+    except KeyboardInterrupt:
+        Log(" ~ keyboard ~ ")
+    finally:
+        Log('\r\n--- Done ---')
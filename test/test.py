@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import time
+import mmap
 import json
+import threading
 import asyncio
 import inspect
 import memcom
@@ -299,6 +302,1416 @@ def test_5():
         raise Exception(f'Buffer still exists {name}!')
 
 
+#------------------------------------------------------------------------------
+def test_6():
+
+    ch = 2
+    sr = 48000
+    n = int(sr / 50)
+    blocks = 20
+
+    # Stereo test tone
+    t = np.arange(n * blocks)
+    tone = (8000 * np.sin(2 * np.pi * 440 * t / sr)).astype(np.int16)
+    src = np.stack([tone, tone], 1).reshape(1, -1)
+
+    # Unity ratio only delays the signal
+    rs = memcom.mcResample(ch=ch)
+    out = rs.process(src).reshape(-1, ch)[:, 0].astype(np.int32)
+    dly = int(rs.getTaps() / 2)
+    err = np.abs(out[dly:] - tone[:len(out) - dly]).max()
+    if 50 < err:
+        raise Exception(f'Unity resample error too large {err}')
+
+    # Processing packet by packet must match processing in one block
+    ratio = 1.01
+    rs1 = memcom.mcResample(ch=ch, ratio=ratio)
+    whole = rs1.process(src).astype(np.int32)
+
+    rs2 = memcom.mcResample(ch=ch, ratio=ratio)
+    parts = np.concatenate([rs2.process(src[:, i*n*ch:(i+1)*n*ch]) for i in range(blocks)], 1).astype(np.int32)
+
+    if whole.shape != parts.shape:
+        raise Exception(f'Block sizes do not match {whole.shape} !≃ {parts.shape}')
+    if 1 < np.abs(whole - parts).max():
+        raise Exception(f'Seam detected between packets {np.abs(whole - parts).max()}')
+
+    exp = int(n * blocks / ratio)
+    got = int(parts.shape[1] / ch)
+    if 2 < abs(exp - got):
+        raise Exception(f'Invalid output length {got} !≃ {exp}')
+
+
+#------------------------------------------------------------------------------
+def test_7():
+
+    ch = 2
+    bps = 16
+    bitrate = 48000
+    fps = 50
+    name = 'testAvShare'
+
+    # 64 buffers of 3840 bytes fill whole pages, 50 don't
+    for b in [64, 50]:
+
+        Log(f'Create packed audio share, {b} buffers')
+        ab1 = memcom.mcAudio()
+        if not ab1.create(name=name, bufs=b, ch=ch, bps=bps, bitrate=bitrate, fps=fps, cleanup=True, packed=True):
+            raise Exception(ab1.getError())
+
+        ab2 = memcom.mcAudio()
+        if not ab2.create(name=name, mode='existing'):
+            raise Exception(name + " : " + ab2.getError())
+
+        if not ab2.isPacked():
+            raise Exception('Share is not packed')
+
+        if b != ab2.getBuffers():
+            raise Exception(f'Invalid buffer count {b} / {ab2.getBuffers()}')
+
+        mirrored = 0 == (b * ch * 2 * int(bitrate / fps)) % mmap.PAGESIZE
+        if mirrored != ab2.isMirrored():
+            raise Exception(f'Invalid mirror state {ab2.isMirrored()}')
+
+        ns = ab2.getSamples()
+        total = b * ns
+
+        # Number each sample frame through the per buffer views
+        for i in range(0, b):
+            buf = ab1.getBuf(i)
+            v = np.arange(i * ns, (i + 1) * ns) % 30000
+            buf[0][0::ch] = v
+            buf[0][1::ch] = -v
+            ab1.setFrameInfo(i, i, i, i, 0, 0)
+            if ab2.getFrameInfo(i)['idx'] != i:
+                raise Exception(f'Invalid frame header {i}')
+
+        # Read across buffers and around the end of the ring
+        for start, count in [(0, 2048), (ns - 100, 2048), (total - 1000, 2048), (total - 1, total)]:
+            arr = ab2.readSamples(ab2.calcSample(0) + start, count)
+            if (1, count * ch) != arr.shape:
+                raise Exception(f'Invalid shape {arr.shape}')
+            exp = (np.arange(start, start + count) % total) % 30000
+            if not np.array_equal(arr[0][0::ch], exp) or not np.array_equal(arr[0][1::ch], -exp):
+                raise Exception(f'Invalid samples at {start}:{count}')
+
+        # Views must be zero copy, reads that wrap only if mirrored
+        arr = ab2.readSamples(total - 10, 20)
+        arr[0][-1] = 12345
+        if mirrored != (12345 == ab1.getBuf(0)[0][19]):
+            raise Exception('readSamples() did not return a view')
+
+        ab2.close()
+        ab1.close()
+
+
+#------------------------------------------------------------------------------
+def test_8():
+
+    b = 10
+    ch = 2
+    bps = 16
+    bitrate = 48000
+    fps = 50
+    name = 'testAvShare'
+
+    for packed in [False, True]:
+
+        Log(f'Create audio share with levels, packed: {packed}')
+        ab1 = memcom.mcAudio()
+        if not ab1.create(name=name, bufs=b, ch=ch, bps=bps, bitrate=bitrate, fps=fps, cleanup=True, packed=packed, levels=True):
+            raise Exception(ab1.getError())
+
+        ab2 = memcom.mcAudio()
+        if not ab2.create(name=name, mode='existing'):
+            raise Exception(name + " : " + ab2.getError())
+
+        if not ab2.hasLevels():
+            raise Exception('Share has no levels')
+
+        # Square wave, amplitude depends on buffer and channel
+        for i in range(0, ab1.getBuffers()):
+            buf = ab1.getBuf(i)
+            buf[0][0::ch] = 1000 * (i + 1)
+            buf[0][1::ch] = -2000 * (i + 1)
+            buf[0][2::2*ch] *= -1
+            ab1.setFrameInfo(i, i, i, i, 0, 0)
+            ab1.setLevels(i)
+
+        tbl = ab2.getLevelTable()
+        for i in range(0, ab2.getBuffers()):
+            exp = np.array([[1000, 1000], [2000, 2000]]) * (i + 1) / 32768
+            if not np.allclose(ab2.getLevels(i), exp) or not np.allclose(tbl[i], exp):
+                raise Exception(f'Invalid levels {i} : {tbl[i]} !≃ {exp}')
+            if ab2.getFrameInfo(i)['idx'] != i:
+                raise Exception(f'Invalid frame header {i}')
+
+        ab2.close()
+        ab1.close()
+
+
+#------------------------------------------------------------------------------
+def test_9():
+
+    name = 'testAvShare'
+
+    Log('Create video share')
+    vb1 = memcom.mcVideo()
+    if not vb1.create(name=name, bufs=8, width=32, height=24, fps=15, cleanup=True):
+        raise Exception(vb1.getError())
+
+    vb2 = memcom.mcVideo()
+    if not vb2.create(name=name, mode='existing'):
+        raise Exception(name + " : " + vb2.getError())
+
+    # Times out if the index doesn't change
+    start = time.time()
+    idx = vb2.waitIdx(vb2.getIdx(), 0.1)
+    if 0 != idx or 0.09 > time.time() - start:
+        raise Exception(f'waitIdx() returned early {idx} : {time.time() - start}')
+
+    # Index already changed, must not wait
+    vb1.setIdx(3)
+    start = time.time()
+    if 3 != vb2.waitIdx(0, 1) or 0.5 < time.time() - start:
+        raise Exception('waitIdx() missed an index change')
+
+    # Wakes when another thread advances the index
+    def writer():
+        time.sleep(0.1)
+        vb1.addIdx(1)
+
+    t = threading.Thread(target=writer)
+    t.start()
+    start = time.time()
+    idx = vb2.waitIdx(3, 5)
+    t.join()
+    if 4 != idx or 2 < time.time() - start:
+        raise Exception(f'waitIdx() was not woken {idx} : {time.time() - start}')
+
+    vb2.close()
+    vb1.close()
+
+
+#------------------------------------------------------------------------------
+def test_10():
+
+    name = 'testProcFilter'
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=8, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    for i in range(0, vb.getBuffers()):
+        vb.getBuf(i).fill(255)
+
+    Log('Blank frames in a child process')
+    errs = []
+    blank = memcom.mcBlank(on_error=lambda ctx, e: errs.append(e))
+    if not blank.create(opts={'video': name, 'process': True}):
+        raise Exception(blank.getError())
+
+    clock = memcom.mcClock()
+    if not clock.create(opts={'video': name, 'vfps': 30}):
+        raise Exception(clock.getError())
+
+    # Wait for the child to blank a frame
+    end = time.time() + 20
+    while not any(0 == vb.getBuf(i).max() for i in range(0, vb.getBuffers())):
+        if time.time() > end:
+            raise Exception(f'Filter process did not blank a frame : {errs}')
+        time.sleep(0.05)
+
+    clock.close()
+    blank.close()
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_11():
+
+    name = 'testGroup'
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=8, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    Log('Run filters from one group thread')
+    grp = memcom.mcGroup(opts={'wait': 'event'})
+    seen = [[], []]
+    flts = []
+    for i in range(0, 2):
+        f = memcom.mcFilter(on_video=lambda ctx, vfi, vfr, i=i: seen[i].append(vfi['idx']),
+                            opts={'video': name, 'thread': False})
+        if not f.create():
+            raise Exception(f.getError())
+        if f.isThreaded():
+            raise Exception('Filter started a thread')
+        if not grp.add(f):
+            raise Exception(grp.getError())
+        flts.append(f)
+
+    grp.create()
+
+    clock = memcom.mcClock()
+    if not clock.create(opts={'video': name, 'vfps': 30}):
+        raise Exception(clock.getError())
+
+    end = time.time() + 10
+    while 10 > min(len(seen[0]), len(seen[1])):
+        if time.time() > end:
+            raise Exception(f'Group did not run the filters : {seen}')
+        time.sleep(0.05)
+
+    clock.close()
+    grp.close()
+
+    # Both filters see every frame, in order
+    for v in seen:
+        if v != list(range(v[0], v[0] + len(v))):
+            raise Exception(f'Missed frames : {v}')
+
+    for f in flts:
+        f.close()
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_12():
+
+    name = 'testPipeline'
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=16, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    errs = []
+    seen = [[], []]
+
+    def draw(ctx, vfi, vfr):
+        vfr.fill(vfi['idx'] % 200 + 1)
+
+    def check(i):
+        def f(ctx, vfi, vfr):
+            seen[i].append((vfi['idx'], int(vfr[0, 0, 0]), vb.getStages(vfi['buf'])))
+        return f
+
+    Log('Stages run in order')
+    pl = memcom.mcPipeline(on_error=lambda ctx, e: errs.append(e), opts={'video': name})
+    pl.add(memcom.mcFilter(on_video=draw))
+    pl.add(memcom.mcFilter(on_video=check(0)), memcom.mcFilter(on_video=check(1)))
+    pl.add(memcom.mcBlank())
+    if not pl.create():
+        raise Exception(pl.getError())
+
+    clock = memcom.mcClock()
+    if not clock.create(opts={'video': name, 'vfps': 30}):
+        raise Exception(clock.getError())
+
+    end = time.time() + 10
+    while 10 > min(len(seen[0]), len(seen[1])):
+        if time.time() > end:
+            raise Exception(f'Pipeline did not run : {seen} : {errs}')
+        time.sleep(0.05)
+
+    clock.close()
+    pl.close()
+
+    # Each frame was drawn, and the eraser hadn't run, before the checks saw it
+    for v in seen:
+        for idx, px, stg in v:
+            if px != idx % 200 + 1 or 1 != (stg & 0x9):
+                raise Exception(f'Stage ran early : {idx} : {px} : {stg}')
+
+    if errs:
+        raise Exception(errs)
+
+    # Stage bits leave the write count alone and are cleared on publish
+    vb.setFrameInfo(0, 0, 0, 0, 0, 7)
+    vb.setStage(0, 3)
+    if 7 != vb.getFrameInfo(0)['wts'] or 0x8 != vb.getStages(0):
+        raise Exception(f'Stage bits overlap WTS : {vb.getFrameInfo(0)} : {vb.getStages(0)}')
+    vb.setFrameInfo(0, 0, 1, 0, 0, 8)
+    if 0 != vb.getStages(0):
+        raise Exception('Stage bits not cleared')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_13():
+
+    name = 'testBatch'
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=16, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    calls = []
+    errs = []
+    flt = memcom.mcFilter(on_video_batch=lambda ctx, fis, frs: calls.append(([fi['idx'] for fi in fis], len(frs))),
+                          on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': name, 'thread': False, 'vwin': 0.5})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    def write(n):
+        for k in range(0, n):
+            i = vb.getIdx()
+            vb.setFrameInfo(i, 0, write.idx, 0, 0, 0)
+            vb.setIdx(i + 1)
+            write.idx += 1
+    write.idx = 0
+
+    Log('Pending frames arrive in one call')
+    write(5)
+    flt.runStep()
+    if calls != [([0, 1, 2, 3, 4], 5)] or errs:
+        raise Exception(f'Bad batch : {calls} : {errs}')
+
+    Log('Out of the window, jump back in one step')
+    calls.clear()
+    write(10)
+    flt.runStep()
+    if calls != [([8, 9, 10, 11, 12, 13, 14], 7)] or 1 != len(errs):
+        raise Exception(f'Bad catch up : {calls} : {errs}')
+
+    flt.close()
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_14():
+
+    name = 'testDrop'
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=16, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    def write(n):
+        for k in range(0, n):
+            i = vb.getIdx()
+            vb.setFrameInfo(i, 0, write.idx, int(write.idx * 1000 / 30), 0, 0)
+            vb.setIdx(i + 1)
+            write.idx += 1
+    write.idx = 0
+
+    for opts, n, exp in [({'vdrop': 'latest'}, 5, [4]),
+                         ({'vdrop': 'nth', 'vnth': 3}, 7, [0, 3, 6]),
+                         ({'vdrop': 'fps', 'vrate': 10}, 9, [0, 3, 6])]:
+
+        Log(f'Drop policy {opts}')
+        seen = []
+        errs = []
+        flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: seen.append(vfi['idx']),
+                              on_error=lambda ctx, e: errs.append(e),
+                              opts=dict({'video': name, 'thread': False, 'vwin': 0.75}, **opts))
+        if not flt.create():
+            raise Exception(flt.getError())
+
+        base = write.idx
+        write(n)
+        flt.runStep()
+        seen = [v - base for v in seen]
+        if seen != exp or errs or flt.getDropped()['video'] != n - len(exp):
+            raise Exception(f'{opts} : {seen} : {flt.getDropped()} : {errs}')
+
+        flt.close()
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_15():
+
+    name = 'testStats'
+
+    Log('Create shares')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=16, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    st = memcom.mcStats()
+    if not st.create(name=name + 'St', slots=4, cleanup=True):
+        raise Exception(st.getError())
+
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: None,
+                          opts={'name': 'Counted', 'video': name, 'thread': False, 'stats': name + 'St'})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    for k in range(0, 3):
+        i = vb.getIdx()
+        vb.setFrameInfo(i, 0, k, 0, 0, 0)
+        vb.setIdx(i + 1)
+    flt.runStep()
+
+    Log('Counters are visible in the share')
+    s = st.readAll()
+    if 1 != len(s) or 'Counted' != s[0]['name'] or 3 != s[0]['vproc'] or 3 != sum(s[0]['vhist']):
+        raise Exception(f'Bad stats : {s}')
+
+    if flt.getStats()['vproc'] != 3 or flt.getStats()['vdrift'] != 0:
+        raise Exception(f'Bad stats : {flt.getStats()}')
+
+    Log('Slot is released on close')
+    flt.close()
+    if st.readAll() or 3 != flt.getStats()['vproc']:
+        raise Exception('Stats slot not released')
+
+    Log('Concurrent claims get separate slots')
+    import multiprocessing
+    mp = multiprocessing.get_context('fork')
+    q = mp.Queue()
+    bar = mp.Barrier(5)
+
+    def claim():
+        s = memcom.mcStats()
+        if s.create(name=name + 'St', mode='existing'):
+            bar.wait()
+            q.put(s.claim('Claim'))
+            bar.wait()
+
+    procs = [mp.Process(target=claim) for k in range(0, 4)]
+    for p in procs:
+        p.start()
+    bar.wait(10)
+    slots = sorted([q.get(timeout=10) for p in procs])
+    bar.wait(10)
+    for p in procs:
+        p.join()
+
+    if [0, 1, 2, 3] != slots:
+        raise Exception(f'Slots claimed twice : {slots}')
+
+    st.close()
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_16():
+
+    name = 'testAsync'
+
+    async def main():
+
+        Log('Create video share')
+        vb = memcom.mcVideo()
+        if not vb.create(name=name, bufs=16, width=32, height=24, fps=30, cleanup=True):
+            raise Exception(vb.getError())
+
+        seen = []
+        ended = []
+
+        async def on_video(ctx, vfi, vfr):
+            await asyncio.sleep(0.001)
+            seen.append(vfi['idx'])
+
+        async def on_end(ctx):
+            ended.append(True)
+
+        Log('Coroutine callbacks on the running loop')
+        flt = memcom.mcAsync(on_video=on_video, on_end=on_end, opts={'video': name})
+        if not flt.create():
+            raise Exception(flt.getError())
+        if flt.isThreaded():
+            raise Exception('Async filter started a thread')
+
+        for k in range(0, 10):
+            i = vb.getIdx()
+            vb.setFrameInfo(i, 0, k, 0, 0, 0)
+            vb.setIdx(i + 1)
+            await asyncio.sleep(0.01)
+
+        end = time.time() + 5
+        while 10 > len(seen) and time.time() < end:
+            await asyncio.sleep(0.01)
+
+        await flt.aclose()
+
+        if seen != list(range(0, 10)) or not ended:
+            raise Exception(f'Bad async filter : {seen} : {ended}')
+
+        if 10 != flt.getStats()['vproc']:
+            raise Exception(f'Bad stats : {flt.getStats()}')
+
+        vb.close()
+
+    # The test runner awaits coroutines, pytest doesn't
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(main())
+    return main()
+
+
+#------------------------------------------------------------------------------
+def test_17():
+
+    name = 'testTiles'
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=8, width=37, height=23, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    def on_tile(ctx, vfi, tile, roi):
+        tile += 1
+
+    for tiles in [4, (3, 5)]:
+
+        Log(f'Tiles {tiles}')
+        vb.getBuf(vb.getIdx()).fill(0)
+
+        flt = memcom.mcFilter(on_video_tile=on_tile,
+                              opts={'video': name, 'thread': False, 'tiles': tiles, 'workers': 3})
+        if not flt.create():
+            raise Exception(flt.getError())
+
+        i = vb.getIdx()
+        vb.setFrameInfo(i, 0, 0, 0, 0, 0)
+        vb.setIdx(i + 1)
+        flt.runStep()
+
+        # Every pixel touched exactly once
+        if 1 != vb.getBuf(i).min() or 1 != vb.getBuf(i).max():
+            raise Exception(f'Tiles overlap or missed pixels : {tiles}')
+
+        flt.close()
+
+    Log('Tiles in batch mode')
+    batches = []
+    flt = memcom.mcFilter(on_video_tile=on_tile, on_video_batch=lambda ctx, vfis, vfrs: batches.append(len(vfis)),
+                          opts={'video': name, 'vwin': 1, 'thread': False, 'tiles': 4, 'workers': 3})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    bufs = []
+    for k in range(0, 3):
+        i = vb.getIdx()
+        vb.getBuf(i).fill(0)
+        vb.setFrameInfo(i, 0, k + 1, 0, 0, 0)
+        vb.setIdx(i + 1)
+        bufs.append(i)
+    flt.runStep()
+    flt.close()
+
+    if [3] != batches or any(1 != vb.getBuf(i).min() or 1 != vb.getBuf(i).max() for i in bufs):
+        raise Exception(f'Batch frames not tiled : {batches}')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_18():
+
+    name = 'testReaders'
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=8, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: None, opts={'video': name, 'vwin': 1, 'thread': False, 'register': True})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    Log('Writer may not lap a registered reader')
+    for k in range(0, 7):
+        if not vb.canWrite():
+            raise Exception(f'Blocked early at {k}')
+        i = vb.getIdx()
+        vb.setFrameInfo(i, 0, k, 0, 0, 0)
+        vb.setIdx(i + 1)
+    if vb.canWrite() or 7 != vb.getSlowestReader():
+        raise Exception(f'Reader would be lapped : {vb.getSlowestReader()}')
+
+    flt.runStep()
+    if not vb.canWrite() or 0 != vb.getSlowestReader():
+        raise Exception(f'Reader cursor not published : {vb.getSlowestReader()}')
+
+    flt.close()
+    if -1 != vb.getSlowestReader():
+        raise Exception('Reader slot not released')
+
+    Log('Concurrent claims get their own slots')
+    slots = []
+    def claim():
+        rb = memcom.mcVideo()
+        if rb.create(name=name):
+            slots.append(rb.registerReader())
+            rb.close()
+    ths = [threading.Thread(target=claim) for _ in range(0, 16)]
+    for th in ths:
+        th.start()
+    for th in ths:
+        th.join()
+    if sorted(slots) != list(range(0, 16)) or -1 != vb.registerReader():
+        raise Exception(f'Reader slots shared : {sorted(slots)}')
+    for n in slots:
+        vb.releaseReader(n)
+
+    Log('Clock blocks for a slow reader')
+    seen = []
+    errs = []
+    def slow(ctx, vfi, vfr):
+        seen.append(vfi['idx'])
+        time.sleep(0.1)
+
+    flt = memcom.mcFilter(on_video=slow, on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': name, 'vwin': 1, 'register': True})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    clock = memcom.mcClock()
+    if clock.create(opts={'video': name, 'vfps': 30, 'policy': 'bogus'}):
+        raise Exception('Invalid clock policy accepted')
+    if not clock.create(opts={'video': name, 'vfps': 30, 'policy': 'block'}):
+        raise Exception(clock.getError())
+
+    time.sleep(1.5)
+    clock.close()
+    flt.close()
+
+    if 8 > len(seen) or seen != list(range(seen[0], seen[0] + len(seen))) or errs:
+        raise Exception(f'Frames lost : {seen} : {errs}')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_19():
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=4, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    Log('Frame info record reads like the dict')
+    fi = memcom.mcFrameInfo()
+    if vb.getFrameInfo(1, fi) or 'idx' in fi or {} != vb.getFrameInfo(1):
+        raise Exception('Empty frame reported valid')
+
+    vb.setFrameInfo(1, 10, 11, 12, 0, 0)
+    vb.getFrameInfo(1, fi)
+    if vb.getFrameInfo(1) != fi.toDict() or 11 != fi['idx'] or 12 != fi.clk or 10 != fi.get('pts'):
+        raise Exception(f'Frame info mismatch : {fi}')
+
+    Log('Filter reuses views and records')
+    seen = []
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: seen.append((vfi, vfr)),
+                          opts={'video': vb.getName(), 'thread': False, 'vwin': 1,
+                                'roi': {'x': 4, 'y': 2, 'w': 8, 'h': 6}})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    for k in range(0, 6):
+        i = vb.getIdx()
+        vb.setFrameInfo(i, k, k, k, 0, 0)
+        vb.setIdx(i + 1)
+        flt.runStep()
+
+    if 6 != len(seen) or (6, 8, 3) != seen[0][1].shape:
+        raise Exception(f'Bad frames : {len(seen)}')
+    if seen[0][0] is not seen[4][0] or seen[0][1] is not seen[4][1] or 4 != seen[0][0]['idx']:
+        raise Exception('Frame records not reused per buffer')
+
+    flt.close()
+
+    Log('New dicts with infodict')
+    seen = []
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: seen.append(vfi),
+                          opts={'video': vb.getName(), 'thread': False, 'vwin': 1, 'infodict': True})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    for k in range(6, 12):
+        i = vb.getIdx()
+        vb.setFrameInfo(i, k, k, k, 0, 0)
+        vb.setIdx(i + 1)
+        flt.runStep()
+
+    if list(range(6, 12)) != [v['idx'] for v in seen] or not all(isinstance(v, dict) for v in seen):
+        raise Exception(f'Bad frame info : {seen}')
+
+    flt.close()
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_20():
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=32, height=24, fps=100, cleanup=True):
+        raise Exception(vb.getError())
+
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: None, opts={'video': vb.getName(), 'sched': 'bogus'})
+    if flt.create():
+        raise Exception('Invalid scheduling policy accepted')
+
+    Log('Pin the filter thread and lower its priority')
+    errs = []
+    cpu = min(os.sched_getaffinity(0))
+    nice = min(19, os.getpriority(os.PRIO_PROCESS, 0) + 1)
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: None, on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': vb.getName(), 'cpus': str(cpu), 'nice': nice})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    time.sleep(0.5)
+    tid = flt.thread.native_id
+    if {cpu} != os.sched_getaffinity(tid) or nice != os.getpriority(os.PRIO_PROCESS, tid):
+        raise Exception(f'Scheduling not applied : {os.sched_getaffinity(tid)}, {os.getpriority(os.PRIO_PROCESS, tid)}')
+
+    # The caller's thread is untouched
+    if nice == os.getpriority(os.PRIO_PROCESS, 0) or errs:
+        raise Exception(f'Scheduling leaked to the caller : {errs}')
+
+    st = flt.getStats()
+    flt.close()
+
+    Log(f"Wake-ups: {st['wakes']}, jitter: {st['jitter']} us, max: {st['jmax']} us")
+    if 10 > st['wakes'] or st['jmax'] < st['jitter'] or st['wakes'] != sum(st['whist']):
+        raise Exception(f'Bad wake-up stats : {st}')
+
+    Log('Event waits that run out are measured too')
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: None, opts={'video': vb.getName(), 'wait': 'event'})
+    if not flt.create():
+        raise Exception(flt.getError())
+    time.sleep(0.5)
+    st = flt.getStats()
+    flt.close()
+
+    if 2 > st['wakes'] or st['wakes'] != sum(st['whist']):
+        raise Exception(f'Bad event wake-up stats : {st}')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_21():
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+    name = vb.getName()
+
+    clock = memcom.mcClock()
+    if clock.create(opts={'video': name, 'vfps': 30, 'mode': 'bogus'}):
+        raise Exception('Invalid clock mode accepted')
+
+    def check(seen, errs, t):
+        want = [int(round(k * 1000 / 30)) for k in range(0, len(seen))]
+        if int(t * 30 * 2) > len(seen) or seen != want or errs:
+            raise Exception(f'Free run : {len(seen)} frames : {seen[:10]} : {errs[:3]}')
+
+    Log('Free run against a registered reader')
+    seen = []
+    errs = []
+    flt = memcom.mcFilter(on_video=lambda ctx, vfi, vfr: seen.append(vfi['clk']), on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': name, 'register': True, 'wait': 'event'})
+    if not flt.create():
+        raise Exception(flt.getError())
+
+    clock = memcom.mcClock(opts={'video': name, 'vfps': 30, 'mode': 'freerun', 'wait': 'event'})
+    if not clock.create():
+        raise Exception(clock.getError())
+    time.sleep(0.5)
+    clock.close()
+    flt.close()
+    check(seen, errs, 0.5)
+
+    Log('Free run through a pipeline')
+    seen = []
+    errs = []
+    pl = memcom.mcPipeline(on_error=lambda ctx, e: errs.append(e), opts={'video': name})
+    pl.add(memcom.mcFilter(on_video=lambda ctx, vfi, vfr: seen.append(vfi['clk'])))
+    pl.add(memcom.mcFilter(on_video=lambda ctx, vfi, vfr: None))
+    vb.setIdx(0)
+    if not pl.create():
+        raise Exception(pl.getError())
+
+    clock = memcom.mcClock(opts={'video': name, 'vfps': 30, 'mode': 'freerun', 'depth': 2,
+                                 'mask': pl.getMask(), 'wait': 'event'})
+    if not clock.create():
+        raise Exception(clock.getError())
+    time.sleep(0.5)
+    clock.close()
+    pl.close()
+    check(seen, errs, 0.5)
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_22():
+
+    import av
+    import tempfile
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=64, height=48, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    Log('Record through the encoder queue')
+    errs = []
+    fname = os.path.join(tempfile.mkdtemp(), 'queued.mp4')
+    rec = memcom.mcRecord(on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': vb.getName(), 'vwin': 1, 'thread': False, 'queue': 4})
+    if not rec.create(fname):
+        raise Exception(rec.getError())
+
+    frames = 40
+    for k in range(0, frames):
+        i = vb.getIdx()
+        vb.getBuf(i)[:] = (k * 5) % 255
+        vb.setFrameInfo(i, k, k, k, 0, 0)
+        vb.setIdx(i + 1)
+        rec.runStep()
+
+    rec.close()
+    st = rec.getQueueStats()
+    Log(f'Queue stats : {st}')
+    if errs or frames != st['queued'] or frames != st['encoded'] or st['dropped'] or 0 != st['depth'] or 4 < st['qmax']:
+        raise Exception(f'Bad queue stats : {st} : {errs}')
+
+    with av.open(fname) as f:
+        n = sum(1 for _ in f.decode(video=0))
+    if frames != n:
+        raise Exception(f'Recorded {n} of {frames} frames')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_23():
+
+    import av
+    import tempfile
+
+    Log('Encoder benchmark')
+    r = memcom.mcRecord.benchmark([{'preset': 'ultrafast'}, {'preset': 'bogus'}], width=64, height=48, frames=10)
+    Log(r)
+    if 0 >= r[0]['fps'] or r[0]['error'] or not r[1]['error']:
+        raise Exception(f'Bad benchmark : {r}')
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=64, height=48, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    Log('Record with encoder options')
+    errs = []
+    fname = os.path.join(tempfile.mkdtemp(), 'tuned.mp4')
+    rec = memcom.mcRecord(on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': vb.getName(), 'vwin': 1, 'thread': False,
+                                'preset': 'veryfast', 'tune': 'zerolatency', 'crf': 30,
+                                'gop': 10, 'threads': 1, 'thread_type': 'slice'})
+    if not rec.create(fname):
+        raise Exception(rec.getError())
+
+    for k in range(0, 30):
+        i = vb.getIdx()
+        vb.setFrameInfo(i, k, k, k, 0, 0)
+        vb.setIdx(i + 1)
+        rec.runStep()
+    rec.close()
+
+    with av.open(fname) as f:
+        keys = [p.is_keyframe for p in f.demux(video=0) if p.size]
+    if errs or 30 != len(keys) or 3 > sum(keys):
+        raise Exception(f'Encoder options not applied : {sum(keys)} keyframes in {len(keys)} : {errs}')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_24():
+
+    import av
+    import tempfile
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=64, height=48, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    Log('Record one second segments, keeping two')
+    errs = []
+    d = tempfile.mkdtemp()
+    rec = memcom.mcRecord(on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': vb.getName(), 'vwin': 1, 'thread': False,
+                                'segment': 1, 'keep': 2, 'playlist': os.path.join(d, 'live.m3u8')})
+    if not rec.create(os.path.join(d, 'cap.ts')):
+        raise Exception(rec.getError())
+
+    for k in range(0, 100):
+        i = vb.getIdx()
+        vb.setFrameInfo(i, k, k, k, 0, 0)
+        vb.setIdx(i + 1)
+        rec.runStep()
+    rec.close()
+
+    segs = rec.getSegments()
+    files = sorted(os.listdir(d))
+    Log(files)
+    if errs or [2, 3] != [sg['n'] for sg in segs] or ['cap_00002.ts', 'cap_00003.ts', 'live.m3u8'] != files:
+        raise Exception(f'Bad segments : {files} : {errs}')
+
+    # Every frame lands in exactly one segment, each starting on a keyframe
+    for sg, want in zip(segs, [30, 10]):
+        with av.open(sg['name']) as f:
+            fr = list(f.decode(video=0))
+        if want != len(fr) or not fr[0].key_frame:
+            raise Exception(f"Segment {sg['name']} : {len(fr)} frames")
+
+    pl = open(os.path.join(d, 'live.m3u8')).read()
+    if '#EXT-X-MEDIA-SEQUENCE:2' not in pl or 'cap_00003.ts' not in pl or not pl.strip().endswith('#EXT-X-ENDLIST'):
+        raise Exception(f'Bad playlist : {pl}')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_25():
+
+    import av
+    import tempfile
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=64, height=48, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    msg = memcom.mcMessage()
+    if not msg.create(cleanup=True):
+        raise Exception(msg.getError())
+
+    Log('Pre-roll ring, clips on trigger')
+    errs = []
+    d = tempfile.mkdtemp()
+    rec = memcom.mcRecord(on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': vb.getName(), 'vwin': 1, 'thread': False, 'tune': 'zerolatency', 'gop': 10,
+                                'preroll': 1, 'postroll': 0.5, 'trigger': msg.getName()})
+    if not rec.create(os.path.join(d, 'clip.mp4')):
+        raise Exception(rec.getError())
+
+    for k in range(0, 130):
+        if 60 == k:
+            rec.trigger()
+        if 120 == k:
+            msg.send(json.dumps({'cmd': 'trigger', 'fname': os.path.join(d, 'event.mp4')}))
+        i = vb.getIdx()
+        vb.setFrameInfo(i, k, k, k, 0, 0)
+        vb.setIdx(i + 1)
+        rec.runStep()
+    rec.close()
+
+    clips = rec.getClips()
+    Log(clips)
+    if errs or ['clip_00000.mp4', 'event.mp4'] != sorted(os.listdir(d)) or 2 != len(clips):
+        raise Exception(f'Bad clips : {os.listdir(d)} : {errs}')
+
+    # One second back to the keyframe at 1.0s, half a second on
+    with av.open(clips[0]['name']) as f:
+        fr = list(f.decode(video=0))
+    if 46 != len(fr) or not fr[0].key_frame:
+        raise Exception(f'Clip has {len(fr)} frames')
+
+    # Recording stopped during the post-roll
+    with av.open(clips[1]['name']) as f:
+        fr = list(f.decode(video=0))
+    if 40 != len(fr):
+        raise Exception(f'Clip has {len(fr)} frames')
+
+    Log('Pre-roll and segments are rejected together')
+    rec = memcom.mcRecord(opts={'video': vb.getName(), 'thread': False, 'segment': 1, 'preroll': 1})
+    if rec.create(os.path.join(d, 'both.mp4')) or 'preroll' not in rec.getError():
+        raise Exception(f'segment with preroll accepted : {rec.getError()}')
+    rec = memcom.mcRecord(opts={'video': vb.getName(), 'thread': False})
+    if 0 <= rec.addOutput(os.path.join(d, 'both.ts'), {'segment': 1, 'preroll': 1}):
+        raise Exception('Output with segment and preroll accepted')
+
+    msg.close()
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_26():
+
+    import av
+    import tempfile
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=64, height=48, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    Log('One encode, an mp4 and a segmented archive')
+    errs = []
+    d = tempfile.mkdtemp()
+    rec = memcom.mcRecord(on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': vb.getName(), 'vwin': 1, 'thread': False, 'tune': 'zerolatency',
+                                'outputs': [{'fname': os.path.join(d, 'arc_%d.ts'), 'segment': 1}]})
+    if not rec.create(os.path.join(d, 'local.mp4')):
+        raise Exception(rec.getError())
+
+    for k in range(0, 90):
+        if 30 == k:
+            n = rec.addOutput(os.path.join(d, 'late.mkv'))
+            if 0 > n:
+                raise Exception(rec.getError())
+        if 60 == k and not rec.removeOutput(n):
+            raise Exception(rec.getError())
+        i = vb.getIdx()
+        vb.setFrameInfo(i, k, k, k, 0, 0)
+        vb.setIdx(i + 1)
+        rec.runStep()
+    rec.close()
+
+    outs = rec.getOutputs()
+    Log(outs)
+    if errs or [0, 1] != [o['id'] for o in outs] or 3 != len(outs[1]['segments']):
+        raise Exception(f'Bad outputs : {outs} : {errs}')
+
+    def frames(fname):
+        with av.open(fname) as f:
+            fr = list(f.decode(video=0))
+        return len(fr), fr[0].key_frame
+
+    # Same frames in both, the late output starts on a forced keyframe
+    want = {'local.mp4': 90, 'late.mkv': 30, 'arc_0.ts': 30, 'arc_1.ts': 30, 'arc_2.ts': 30}
+    for fname, cnt in want.items():
+        if (cnt, True) != frames(os.path.join(d, fname)):
+            raise Exception(f'{fname} : {frames(os.path.join(d, fname))}')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_27():
+
+    import tempfile
+
+    Log('Create video and audio shares')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+    ab = memcom.mcAudio()
+    if not ab.create(bufs=8, ch=2, bps=16, bitrate=8000, fps=25, cleanup=True):
+        raise Exception(ab.getError())
+
+    Log('Raw capture, one second allocated')
+    errs = []
+    fname = os.path.join(tempfile.mkdtemp(), 'cap.raw')
+    rec = memcom.mcRecord(on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': vb.getName(), 'audio': ab.getName(), 'vwin': 1, 'awin': 1,
+                                'thread': False, 'raw': True, 'rawsecs': 1})
+    if not rec.create(fname):
+        raise Exception(rec.getError())
+
+    for k in range(0, 40):
+        i = vb.getIdx()
+        vb.getBuf(i)[:] = k
+        vb.setFrameInfo(i, k, k, k * 33, 0, 0)
+        vb.setIdx(i + 1)
+        i = ab.calcIdx(1)
+        ab.getBuf(i)[:] = k
+        ab.setFrameInfo(i, k, k, k * 40, 0, 0)
+        ab.setIdx(i)
+        rec.runStep()
+
+    # Ten video frames past the end, the audio filter trails the writer by one
+    if 10 + 14 != rec.getRawDropped() or 1 != len(errs):
+        raise Exception(f'Dropped {rec.getRawDropped()} : {errs}')
+    rec.close()
+
+    Log('Read it back')
+    raw = memcom.mcRawFile()
+    if not raw.open(fname):
+        raise Exception(raw.getError())
+    vid = raw.getVideo()
+    aud = raw.getAudio()
+    if 30 != vid.getIdx() or (32, 24, 30) != (vid.getWidth(), vid.getHeight(), vid.getFps()):
+        raise Exception(f'Video : {vid.getIdx()} frames')
+    if 25 != aud.getIdx() or (2, 16, 8000, 25) != (aud.getChannels(), aud.getBps(), aud.getBitrate(), aud.getFps()):
+        raise Exception(f'Audio : {aud.getIdx()} frames')
+
+    for n in range(0, 30):
+        fi = vid.getFrameInfo(n)
+        if n != fi['idx'] or n * 33 != fi['clk'] or (n != vid.getBuf(n)).any():
+            raise Exception(f'Video frame {n} : {fi}')
+    if (24 != aud.getBuf(24)).any() or 24 != aud.getFrameInfo(24)['idx'] or aud.getFrameInfo(25):
+        raise Exception(f'Audio frame : {aud.getFrameInfo(24)}')
+
+    if 10 != vid.findFrame(340) or -1 != vid.findFrame(-1) or 29 != vid.findFrame(10000):
+        raise Exception(f'Find frame : {vid.findFrame(340)}')
+
+    raw.close()
+    vb.close()
+    ab.close()
+
+
+#------------------------------------------------------------------------------
+def test_28():
+
+    import av
+    import tempfile
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=64, height=48, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    d = tempfile.mkdtemp()
+    vb.setIdx(0)
+    for gaps, want in (('dup', list(range(0, 40))), ('skip', list(range(0, 20)) + list(range(25, 40)))):
+
+        Log(f'Time stamps from the clock, gaps = {gaps}')
+        errs = []
+        fname = os.path.join(d, f'{gaps}.mp4')
+        rec = memcom.mcRecord(on_error=lambda ctx, e: errs.append(e),
+                              opts={'video': vb.getName(), 'vwin': 1, 'thread': False, 'tune': 'zerolatency',
+                                    'pts': 'clk', 'gaps': gaps})
+        if not rec.create(fname):
+            raise Exception(rec.getError())
+
+        # Frames 20 - 24 are lost, and a stale one turns up after 30
+        idx = 0
+        for k in list(range(0, 20)) + list(range(25, 31)) + [10] + list(range(31, 40)):
+            i = vb.getIdx()
+            vb.setFrameInfo(i, k, idx, int(round(k * 1000 / 30)), 0, 0)
+            vb.setIdx(i + 1)
+            idx += 1
+            rec.runStep()
+        rec.close()
+
+        st = rec.getPtsStats()
+        if errs or {'late': 1, 'gaps': 1, 'dups': 5 if 'dup' == gaps else 0, 'skipped': 0 if 'dup' == gaps else 5} != st:
+            raise Exception(f'Bad stats : {st} : {errs}')
+
+        with av.open(fname) as f:
+            got = [int(round(fr.time * 30)) for fr in f.decode(video=0)]
+        if want != got:
+            raise Exception(f'Bad time stamps : {got}')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_29():
+
+    import av
+    import tempfile
+
+    Log('RGB to YUV against swscale')
+    rgb = np.repeat(np.repeat(np.random.default_rng(7).integers(0, 256, (6, 8, 3), dtype=np.uint8), 8, 0), 8, 1)
+    ref = av.VideoFrame.from_ndarray(rgb, format='rgb24').reformat(format='yuv420p')
+
+    # swscale filters chroma across the block edges, compare the insides
+    inner = np.zeros((24, 32), dtype=bool)
+    for k in (1, 2):
+        inner[k::4, 1::4] = inner[k::4, 2::4] = True
+
+    def planes(f):
+        return [np.frombuffer(p, dtype=np.uint8).reshape(-1, p.line_size)[:p.height, :p.width].astype(int) for p in f.planes]
+
+    for workers in (1, 3):
+        yuv = memcom.mcYuv(64, 48, workers=workers)
+        got = planes(yuv.convert(rgb))
+        want = planes(ref)
+        yuv.close()
+        diff = [np.abs(got[0] - want[0]).max()] + [np.abs(g - w)[inner].max() for g, w in zip(got[1:], want[1:])]
+        if 1 < max(diff):
+            raise Exception(f'Conversion differs by {diff} with {workers} workers')
+
+    Log('Record through the conversion stage')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=8, width=64, height=48, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    errs = []
+    fname = os.path.join(tempfile.mkdtemp(), 'yuv.mp4')
+    rec = memcom.mcRecord(on_error=lambda ctx, e: errs.append(e),
+                          opts={'video': vb.getName(), 'vwin': 1, 'thread': False, 'convert': 2, 'crf': 10})
+    if not rec.create(fname):
+        raise Exception(rec.getError())
+
+    for k in range(0, 10):
+        i = vb.getIdx()
+        vb.getBuf(i)[:] = rgb
+        vb.setFrameInfo(i, k, k, k, 0, 0)
+        vb.setIdx(i + 1)
+        rec.runStep()
+    rec.close()
+
+    with av.open(fname) as f:
+        frs = [planes(fr)[0] for fr in f.decode(video=0)]
+    if errs or 10 != len(frs) or 4 < np.abs(frs[-1] - planes(ref)[0]).mean():
+        raise Exception(f'Recorded {len(frs)} frames : {errs}')
+
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_30():
+
+    import re
+
+    Log('Create shares')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=16, width=8, height=8, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+    ab = memcom.mcAudio()
+    if not ab.create(bufs=100, ch=2, bps=16, bitrate=48000, fps=100, cleanup=True):
+        raise Exception(ab.getError())
+
+    Log('Audio time stamps 200 ms ahead of the video')
+    errs = []
+    sync = memcom.mcSync(on_error=lambda ctx, e: errs.append(e),
+                         opts={'video': vb.getName(), 'audio': ab.getName(), 'thread': False})
+    if not sync.create():
+        raise Exception(sync.getError())
+
+    # 10 ms ticks, a video frame every 1/30 s and an audio frame every tick
+    nv = 0
+    for t in range(0, 400):
+        while nv * 100 <= t * 30:
+            i = vb.getIdx()
+            vb.setFrameInfo(i, nv, nv, nv * 1000 / 30, 0, 0)
+            vb.setIdx(i + 1)
+            nv += 1
+        i = ab.calcIdx(1)
+        ab.setFrameInfo(i, t, t, t * 10 + 200, 0, 0)
+        ab.setIdx(i)
+        sync.runStep()
+
+    off = sync.getOffset()
+    sync.close()
+
+    # The offset is smoothed, so it is corrected in jumps of the audio
+    # pointer reported as they happen, the resampler takes care of the rest
+    m = [re.match(r'AVSYNC : Offset (-?[0-9.]+)s, audio pointer moved (-?[0-9]+) frames', e) for e in errs]
+    if not m or not all(m):
+        raise Exception(f'Bad sync reports : {errs}')
+    if not all(-0.2 <= float(v.group(1)) <= -0.1 for v in m) or 20 != sum(int(v.group(2)) for v in m):
+        raise Exception(f'Bad correction : {errs}')
+    if 0.01 < abs(off):
+        raise Exception(f'Offset not corrected : {off:.3f}s')
+
+    ab.close()
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_31():
+
+    name = 'testGroupRemove'
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(name=name, bufs=8, width=32, height=24, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    Log('Remove a filter while the group runs on a pool')
+    grp = memcom.mcGroup(opts={'workers': 2})
+    events = [[], [], []]
+
+    def video(i):
+        def f(ctx, vfi, vfr):
+            events[i].append('video')
+            time.sleep(0.02)
+            events[i].append('done')
+        return f
+
+    flts = []
+    for i in range(0, 3):
+        f = memcom.mcFilter(on_video=video(i), on_end=lambda ctx, i=i: events[i].append('end'),
+                            opts={'video': name, 'thread': False})
+        if not f.create():
+            raise Exception(f.getError())
+        if not grp.add(f):
+            raise Exception(grp.getError())
+        flts.append(f)
+
+    grp.create()
+
+    clock = memcom.mcClock()
+    if not clock.create(opts={'video': name, 'vfps': 30}):
+        raise Exception(clock.getError())
+
+    # Remove it from inside a callback
+    end = time.time() + 10
+    while 10 > len(events[0]) or 'video' != events[0][-1]:
+        if time.time() > end:
+            raise Exception(f'Group did not run the filters : {events}')
+        time.sleep(0.001)
+
+    if not grp.remove(flts[0]):
+        raise Exception('Filter not removed')
+    if grp.remove(flts[0]):
+        raise Exception('Filter removed twice')
+
+    n = len(events[1])
+    end = time.time() + 10
+    while n + 10 > len(events[1]):
+        if time.time() > end:
+            raise Exception(f'Group stopped after remove : {events}')
+        time.sleep(0.01)
+
+    clock.close()
+    grp.close()
+
+    # on_end runs once, after the last callback has returned
+    if 1 != events[0].count('end') or 'end' != events[0][-1] or 'done' != events[0][-2]:
+        raise Exception(f'Bad end order : {events[0]}')
+    for v in events[1:]:
+        if 1 != v.count('end') or 'end' != v[-1]:
+            raise Exception(f'Filter not ended : {v}')
+
+    for f in flts:
+        f.close()
+    vb.close()
+
+
+#------------------------------------------------------------------------------
+def test_32():
+
+    Log('Create video share')
+    vb = memcom.mcVideo()
+    if not vb.create(bufs=16, width=8, height=8, fps=30, cleanup=True):
+        raise Exception(vb.getError())
+
+    Log('A steady writer read every few frames has no jitter')
+    sync = memcom.mcSync(opts={'video': vb.getName(), 'thread': False, 'latency': 0.05})
+    if not sync.create():
+        raise Exception(sync.getError())
+
+    for n in range(0, 120):
+        i = vb.getIdx()
+        vb.setFrameInfo(i, n, n, n * 1000 / 30, 0, 0)
+        vb.setIdx(i + 1)
+        if 0 == n % (1 + n % 4):
+            sync.runStep()
+
+    lat = sync.getLatency()
+    sync.close()
+
+    if 0.005 < abs(lat - 0.05):
+        raise Exception(f'Skipped steps counted as jitter : {lat:.3f}s')
+
+    vb.close()
+
+
 #------------------------------------------------------------------------------
 
 async def run():